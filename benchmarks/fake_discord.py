@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import random
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeDiscordServer:
+    """
+    Local stand-in for the Discord webhook API, used to benchmark the mirror without Discord.
+
+    It accepts webhook posts, avatar updates, message edits and deletions on any path, and
+    can simulate network latency, rate limits and server errors.
+
+    Attributes:
+        latency (float): Seconds each request takes before it is answered.
+        rate_limit_every (int): Answer every n-th request with a 429, 0 to disable.
+        retry_after (float): `retry_after` of the simulated 429 responses, in seconds.
+        error_rate (float): Fraction of requests answered with a 502.
+        bucket_size (int): Requests per bucket reported in the `X-RateLimit-*` headers.
+        requests (Counter): Number of requests received per HTTP method.
+        responses (Counter): Number of responses sent per status code.
+        bytes_received (int): Total size of the request bodies.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rate_limit_every=0, retry_after=0.05,
+                 error_rate=0.0, bucket_size=50, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.bucket_size = bucket_size
+        self.requests = Counter()
+        self.responses = Counter()
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._request_count = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def webhook_url(self, name='webhook'):
+        """Returns the URL of a fake webhook."""
+        return f"{self.url}/api/webhooks/{name}/token"
+
+    async def start(self):
+        """Starts the server; with port 0 a free port is picked and stored in `port`."""
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        """Clears the request counters."""
+        self.requests.clear()
+        self.responses.clear()
+        self.bytes_received = 0
+
+    async def _handle(self, request):
+        body = await request.read()
+        self.requests[request.method] += 1
+        self.bytes_received += len(body)
+        number = next(self._request_count)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.rate_limit_every and number % self.rate_limit_every == 0:
+            response = web.json_response({'message': 'You are being rate limited.', 'retry_after': self.retry_after,
+                                          'global': False}, status=429)
+        elif self.error_rate and self._random.random() < self.error_rate:
+            response = web.Response(status=502, text='Bad Gateway')
+        elif request.method == 'POST' and request.query.get('wait') == 'true':
+            response = web.json_response({'id': str(next(self._message_ids))})
+        elif request.method == 'PATCH':
+            response = web.json_response({})
+        else:
+            response = web.Response(status=204)
+
+        limited = response.status == 429
+        response.headers['X-RateLimit-Limit'] = str(self.bucket_size)
+        response.headers['X-RateLimit-Remaining'] = '0' if limited else str(self.bucket_size - 1)
+        response.headers['X-RateLimit-Reset-After'] = str(self.retry_after) if limited else '1'
+        self.responses[response.status] += 1
+        return response
@@ -0,0 +1,182 @@
+"""
+End-to-end benchmark of the mirror against a local fake Discord webhook and synthetic Telegram events.
+
+Run from the project root:
+
+    python -m benchmarks.run_benchmark --messages 500
+    python -m benchmarks.run_benchmark --messages 500 --discord-latency 0.05 --rate-limit-every 20 --error-rate 0.01
+    python -m benchmarks.run_benchmark --messages 500 --pipeline-workers 4 --json baseline.json
+
+Reports messages per second, p50/p99 latency per message, peak RSS and requests per message,
+so runs before and after a change can be compared. With a pipeline, every event is submitted
+at once and latency is measured from submission, so it includes the time spent queued.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_discord import FakeDiscordServer
+from benchmarks.synthetic_events import SyntheticClient, SyntheticEventGenerator
+from services.discord_service import DiscordService
+from services.media_processor import MediaProcessor
+from services.load_shedder import LoadShedder
+from services.message_coalescer import MessageCoalescer
+from services.message_handler import MessageHandler
+from services.message_pipeline import MessagePipeline
+from services.user_service import UserService
+from utils.file_manager import FileManager
+from utils.media_cache import MediaCache
+from utils.metrics import default_metrics
+from utils.processing_pool import default_pool
+
+
+def percentile(values, fraction):
+    """Returns the value below which `fraction` of the sorted values fall."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+async def run(args):
+    metrics = default_metrics()
+    metrics.enabled = args.stages
+    server = FakeDiscordServer(latency=args.discord_latency, rate_limit_every=args.rate_limit_every,
+                               retry_after=args.retry_after, error_rate=args.error_rate, seed=args.seed)
+    await server.start()
+    save_folder = tempfile.mkdtemp(prefix='mirror-benchmark-')
+    file_manager = FileManager()
+    file_manager.base_folder = save_folder
+    media_cache = MediaCache(os.path.join(save_folder, 'media_cache')) if args.media_cache else None
+    media_processor = MediaProcessor(file_manager, mode=args.media_mode, media_cache=media_cache)
+    media_processor.save_folder = save_folder
+    user_service = UserService(file_manager, disk_cache=False)
+    message_handler = MessageHandler(media_processor, user_service)
+    webhook_pool = [server.webhook_url(f'pool{index}') for index in range(1, args.webhooks)]
+    discord_service = DiscordService(server.webhook_url(), webhook_pool, retry_base_delay=args.retry_after)
+    client = SyntheticClient(latency=args.telegram_latency, seed=args.seed)
+    generator = SyntheticEventGenerator(client, users=args.users, document_size=args.document_size,
+                                        repeat_media_rate=args.repeat_media_rate, seed=args.seed)
+    events = generator.events(args.messages)
+
+    latencies = []
+    shedder = None
+    started_at = time.perf_counter()
+    try:
+        if args.pipeline_workers:
+            submitted_at = {}
+
+            def on_processed(event, delivered):
+                latencies.append(time.perf_counter() - submitted_at[id(event)])
+
+            coalescer = MessageCoalescer(message_handler, discord_service,
+                                         args.coalesce_window) if args.coalesce_window else None
+            shedder = LoadShedder(message_handler, args.max_pending, args.max_pending_bytes, args.max_pending_bytes,
+                                  args.message_policy, args.media_policy) if args.max_pending else None
+            pipeline = MessagePipeline(message_handler, discord_service, client, workers=args.pipeline_workers,
+                                       on_processed=on_processed, coalescer=coalescer, shedder=shedder)
+            pipeline.start()
+            for event in events:
+                submitted_at[id(event)] = time.perf_counter()
+                await pipeline.submit(event)
+            await pipeline.join()
+            await pipeline.stop()
+        else:
+            for event in events:
+                event_started_at = time.perf_counter()
+                await message_handler.handle_new_message(discord_service, client, event)
+                latencies.append(time.perf_counter() - event_started_at)
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await discord_service.close()
+        await server.stop()
+        default_pool().shutdown()
+        shutil.rmtree(save_folder, ignore_errors=True)
+
+    latencies.sort()
+    discord_requests = sum(server.requests.values())
+    report = {
+        'messages': args.messages,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(args.messages / elapsed, 2),
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'discord_requests_per_message': round(discord_requests / args.messages, 3),
+        'telegram_requests_per_message': round(sum(client.requests.values()) / args.messages, 3),
+        'discord_bytes_received': server.bytes_received,
+        'discord_requests': dict(server.requests),
+        'discord_responses': {str(status): count for status, count in server.responses.items()},
+        'telegram_requests': client.requests,
+        'delivery_stats': discord_service.delivery_stats,
+    }
+    report['image_bytes_saved_per_message'] = round(
+        (user_service.encode_stats['bytes_saved'] + media_processor.encode_stats['bytes_saved']) / args.messages)
+    report['image_encoding'] = {'avatars': user_service.encode_stats, 'photos': media_processor.encode_stats}
+    if media_cache:
+        report['media_cache'] = media_cache.stats
+    if args.pipeline_workers and shedder:
+        report['load_shedding'] = dict(shedder.stats)
+    if args.stages:
+        report['stage_mean_ms'] = {stage: round(histogram.total / histogram.count * 1000, 3)
+                                   for stage, histogram in metrics.stages.items() if histogram.count}
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200, help='number of synthetic events')
+    parser.add_argument('--users', type=int, default=20, help='number of distinct senders')
+    parser.add_argument('--document-size', type=int, default=256 * 1024, help='size of documents, in bytes')
+    parser.add_argument('--media-mode', choices=('stream', 'disk'), default='stream')
+    parser.add_argument('--media-cache', action='store_true', help='serve repeated media from a media cache')
+    parser.add_argument('--repeat-media-rate', type=float, default=0.0,
+                        help='fraction of photos and documents repeating an earlier one')
+    parser.add_argument('--webhooks', type=int, default=1, help='size of the webhook pool')
+    parser.add_argument('--pipeline-workers', type=int, default=0,
+                        help='send through a MessagePipeline with this many workers instead of handle_new_message')
+    parser.add_argument('--coalesce-window', type=float, default=0.0,
+                        help='merge bursts of text messages within this many seconds (needs --pipeline-workers)')
+    parser.add_argument('--max-pending', type=int, default=0,
+                        help='cap on prepared messages waiting for Discord (needs --pipeline-workers)')
+    parser.add_argument('--max-pending-bytes', type=int, default=64 * 1024 * 1024,
+                        help='cap on media bytes held in memory and on disk by those messages')
+    parser.add_argument('--message-policy', choices=('block', 'summary'), default='block')
+    parser.add_argument('--media-policy', choices=('block', 'placeholder'), default='block')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='seconds per Telegram request')
+    parser.add_argument('--discord-latency', type=float, default=0.0, help='seconds per Discord request')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every n-th request with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='retry_after of the simulated 429s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 502')
+    parser.add_argument('--stages', action='store_true', help='also report the mean duration of each stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='also write the report to a JSON file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.WARNING)
+    report = asyncio.run(run(args))
+    for name, value in report.items():
+        print(f"{name:32} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import asyncio
+import io
+import itertools
+import os
+import random
+from datetime import datetime, timezone
+
+from PIL import Image
+from telethon.tl.types import (Document, MessageMediaDocument, MessageMediaPhoto, Photo, PhotoSize, User,
+                               UserProfilePhoto)
+
+from utils.telegram_event import HistoryEvent
+
+KINDS = ('text', 'photo', 'document', 'reply', 'album')
+
+
+def _jpeg(size, seed):
+    """Returns a noisy JPEG image, so it does not compress to nothing."""
+    image = Image.frombytes('RGB', size, random.Random(seed).randbytes(size[0] * size[1] * 3))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+class SyntheticFile:
+    """The `file` property of a Telethon message, reduced to what the mirror reads."""
+
+    def __init__(self, mime_type):
+        self.mime_type = mime_type
+
+
+class SyntheticMessage:
+    """
+    A Telethon-like message carrying what the message handler reads from real ones.
+
+    Attributes match the Telethon `Message` attributes of the same name.
+    """
+
+    def __init__(self, client, chat_id, message_id, sender, text, media=None, grouped_id=None, reply_to_msg_id=None,
+                 attach_sender=True):
+        self._client = client
+        self.id = message_id
+        self.chat_id = chat_id
+        self.chat = None
+        self.sender_id = sender.id
+        self.sender = sender if attach_sender else None
+        self.message = text
+        self.media = media
+        self.grouped_id = grouped_id
+        self.reply_to_msg_id = reply_to_msg_id
+        self.reply_to = None
+        self.action = None
+        self.date = datetime.now(timezone.utc)
+        if isinstance(media, MessageMediaPhoto):
+            self.file = SyntheticFile('image/jpeg')
+        elif isinstance(media, MessageMediaDocument):
+            self.file = SyntheticFile(media.document.mime_type)
+        else:
+            self.file = None
+
+    async def get_sender(self):
+        return await self._client.get_entity(self.sender_id)
+
+    async def get_reply_message(self):
+        if not self.reply_to_msg_id:
+            return None
+        return await self._client.get_messages(self.chat_id, ids=self.reply_to_msg_id)
+
+
+class SyntheticClient:
+    """
+    Stand-in for the Telethon client, answering the requests the message handler makes.
+
+    Every request takes `latency` seconds, like a round trip to Telegram, and is counted.
+
+    Attributes:
+        latency (float): Seconds each simulated Telegram request takes.
+        photo (bytes): Content returned for photos.
+        requests (dict): Number of requests per client method.
+    """
+
+    def __init__(self, latency=0.0, photo_size=(640, 480), seed=0):
+        self.latency = latency
+        self.photo = _jpeg(photo_size, seed)
+        self.seed = seed
+        self.avatars = {}
+        self.requests = {}
+        self.users = {}
+        self.messages = {}
+
+    async def _request(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _media_bytes(media, photo):
+        if isinstance(media, MessageMediaDocument):
+            return os.urandom(media.document.size)
+        return photo
+
+    async def get_entity(self, entity_id):
+        await self._request('get_entity')
+        return self.users[entity_id]
+
+    async def get_messages(self, chat_id, ids):
+        await self._request('get_messages')
+        return self.messages.get((chat_id, ids))
+
+    async def download_media(self, message, file=None):
+        await self._request('download_media')
+        data = self._media_bytes(message.media, self.photo)
+        if file is bytes:
+            return data
+        with open(file, 'wb') as output:
+            output.write(data)
+        return file
+
+    async def iter_download(self, media, request_size=512 * 1024):
+        await self._request('iter_download')
+        data = self._media_bytes(media, self.photo)
+        for offset in range(0, len(data), request_size):
+            yield data[offset:offset + request_size]
+
+    async def download_profile_photo(self, entity, file=None):
+        await self._request('download_profile_photo')
+        if entity.id not in self.avatars:
+            self.avatars[entity.id] = _jpeg((160, 160), self.seed + entity.id)
+        with open(file, 'wb') as output:
+            output.write(self.avatars[entity.id])
+        return file
+
+
+class SyntheticEventGenerator:
+    """
+    Generates a reproducible stream of Telethon-like events: texts, photos, documents,
+    replies to earlier messages and albums, from a fixed set of users.
+
+    Attributes:
+        client (SyntheticClient): Client the events' requests are answered by.
+        chat_id (int): Chat the events come from.
+        users (list): Senders of the events.
+        mix (dict): Relative weight of each event kind.
+        document_size (int): Size of generated documents, in bytes.
+        album_size (int): Number of photos per album.
+        attached_sender_rate (float): Fraction of events whose sender comes attached, as with
+                                      most live updates; the others need a `get_sender` request.
+        repeat_media_rate (float): Fraction of photos and documents that repeat an earlier one,
+                                   as forwarded files do.
+    """
+
+    def __init__(self, client, chat_id=-1001000000001, users=20, mix=None, document_size=256 * 1024, album_size=3,
+                 attached_sender_rate=0.5, repeat_media_rate=0.0, seed=0):
+        self.client = client
+        self.chat_id = chat_id
+        self.mix = mix or {'text': 60, 'photo': 15, 'document': 5, 'reply': 15, 'album': 5}
+        self.document_size = document_size
+        self.album_size = album_size
+        self.attached_sender_rate = attached_sender_rate
+        self.repeat_media_rate = repeat_media_rate
+        self._media = {'photo': [], 'document': []}
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._last_message_id = 0
+        self._grouped_ids = itertools.count(1)
+        self.users = [User(id=1000 + index, first_name=f"User {index}",
+                           photo=UserProfilePhoto(photo_id=5000 + index, dc_id=1)) for index in range(users)]
+        client.users.update({user.id: user for user in self.users})
+
+    def _message(self, sender, text, media=None, grouped_id=None, reply_to_msg_id=None):
+        message = SyntheticMessage(self.client, self.chat_id, next(self._message_ids), sender, text, media,
+                                   grouped_id, reply_to_msg_id, self._random.random() < self.attached_sender_rate)
+        self.client.messages[(self.chat_id, message.id)] = message
+        self._last_message_id = message.id
+        return message
+
+    def _media_of(self, kind):
+        """Returns a new photo or document, or an earlier one at `repeat_media_rate`."""
+        seen = self._media[kind]
+        if seen and self._random.random() < self.repeat_media_rate:
+            return self._random.choice(seen)
+        media_id = self._random.getrandbits(62)
+        if kind == 'photo':
+            size = PhotoSize(type='y', w=640, h=480, size=len(self.client.photo))
+            media = MessageMediaPhoto(photo=Photo(id=media_id, access_hash=0, file_reference=b'', date=None,
+                                                  sizes=[size], dc_id=1))
+        else:
+            media = MessageMediaDocument(document=Document(
+                id=media_id, access_hash=0, file_reference=b'', date=None, mime_type='application/pdf',
+                size=self.document_size, dc_id=1, attributes=[]))
+        seen.append(media)
+        return media
+
+    def event(self, kind=None):
+        """
+        Generates one event.
+
+        Args:
+            kind (str): One of `KINDS`, or None to pick one according to `mix`.
+
+        Returns:
+            HistoryEvent: The event, shaped like a NewMessage or Album event.
+        """
+        kind = kind or self._random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        sender = self._random.choice(self.users)
+        text = ' '.join(self._random.choice(('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'mirror', 'discord'))
+                        for _ in range(self._random.randint(3, 40)))
+        if kind == 'photo':
+            return HistoryEvent([self._message(sender, text, self._media_of('photo'))])
+        if kind == 'document':
+            return HistoryEvent([self._message(sender, '', self._media_of('document'))])
+        if kind == 'reply':
+            last_id = max(1, self._last_message_id)
+            reply_to = self._random.randint(max(1, last_id - 50), last_id)
+            return HistoryEvent([self._message(sender, text, reply_to_msg_id=reply_to)])
+        if kind == 'album':
+            grouped_id = next(self._grouped_ids)
+            return HistoryEvent([self._message(sender, text if index == 0 else '', self._media_of('photo'), grouped_id)
+                                 for index in range(self.album_size)])
+        return HistoryEvent([self._message(sender, text)])
+
+    def events(self, count):
+        """Generates `count` events."""
+        return [self.event() for _ in range(count)]
@@ -1,3 +1,176 @@
 DISCORD_WEBHOOK_URL = 'https://discord.com/api/webhooks/1290358835776852080/4j9ukjCG_GZNQVyoaqHCWiUZ8pbhRLVgQcxrUGyEonTD6oKTktW6G7N6IOlqOe8gNAx_'
+# Extra webhooks of the same channel as DISCORD_WEBHOOK_URL; users are spread across them
+DISCORD_WEBHOOK_POOL = []
 SESSION_NAME = 'session_name'
 SAVE_FOLDER = "profile_files/"
+
+# Discord HTTP session
+DISCORD_CONNECTION_LIMIT = 100
+DISCORD_CONNECTION_LIMIT_PER_HOST = 10
+DISCORD_KEEPALIVE_TIMEOUT = 60
+DISCORD_DNS_CACHE_TTL = 300
+DISCORD_REQUEST_TIMEOUT = 30
+
+# Avatar cache
+AVATAR_CACHE_SIZE = 512
+AVATAR_CACHE_TTL = 6 * 60 * 60
+AVATAR_DISK_CACHE = True
+AVATAR_CACHE_FOLDER = "profile_files/avatars/"
+AVATAR_DISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Discord delivery
+DISCORD_MAX_RETRIES = 8
+DISCORD_RETRY_BASE_DELAY = 1.0
+DISCORD_RETRY_MAX_DELAY = 60.0
+# Rate-limit buckets unused for this many seconds are forgotten
+DISCORD_BUCKET_IDLE_TIMEOUT = 10 * 60
+
+# Message pipeline
+PIPELINE_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 1000
+
+# Media handling: "disk" downloads to SAVE_FOLDER, "stream" keeps small files in memory
+# and pipes larger ones from Telegram straight into the Discord upload
+MEDIA_MODE = "stream"
+MEDIA_SPOOL_THRESHOLD = 8 * 1024 * 1024
+MEDIA_STREAM_CHUNK_SIZE = 512 * 1024
+
+# Routing table used by the "mirror configured routes" option. Each route maps a Telegram
+# chat (id, @username or link), optionally one forum topic, to one or more Discord webhooks:
+# {"chat": -1001234567890, "topic": 42,
+#  "destinations": [DISCORD_WEBHOOK_URL, {"webhook_url": "https://...", "thread_id": 123,
+#                                         "webhook_pool": ["https://...", "https://..."],
+#                                         "max_upload_size": 100 * 1024 * 1024}]}
+ROUTES = []
+
+# Discord upload limits, used to split albums across posts
+DISCORD_MAX_ATTACHMENTS = 10
+DISCORD_MAX_UPLOAD_SIZE = 25 * 1024 * 1024
+
+# What to send, decided before downloading, for media over the upload limit of a destination
+# (its max_upload_size, or DISCORD_MAX_UPLOAD_SIZE). The first rule whose mime pattern matches
+# applies its action once the media exceeds the limit, or the rule's own "max_size" if lower:
+# "download" as is, "downscale" (images only, others get a thumbnail), "thumbnail" or "stub",
+# a text note. Unmatched media over the limit gets a stub.
+MEDIA_POLICY_ENABLED = True
+MEDIA_RULES = [
+    {"mime": "image/*", "action": "downscale"},
+    {"mime": "video/*", "action": "thumbnail"},
+    {"mime": "*", "action": "stub"},
+]
+# Longest side, in pixels, of downscaled images
+MEDIA_DOWNSCALE_MAX_SIDE = 2560
+
+# Image encoding, without metadata. Avatars are sent in the smallest of AVATAR_IMAGE_FORMATS
+# (Discord documents JPEG, PNG and GIF for avatar data). Photos larger than the threshold are
+# sent in the smallest of IMAGE_ATTACHMENT_FORMATS when that saves at least the given fraction.
+IMAGE_QUALITY = 82
+AVATAR_IMAGE_FORMATS = ("JPEG", "PNG")
+IMAGE_REENCODE_ENABLED = True
+IMAGE_REENCODE_THRESHOLD = 512 * 1024
+IMAGE_ATTACHMENT_FORMATS = ("JPEG", "WEBP")
+IMAGE_REENCODE_MIN_SAVING = 0.1
+
+# CPU-bound work (image decoding/encoding): "thread" or "process" pool
+PROCESSING_POOL_KIND = "thread"
+PROCESSING_POOL_WORKERS = 2
+PROCESSING_POOL_QUEUE_SIZE = 32
+
+# Durable outbox: messages are stored before being sent and retried until delivered. Messages
+# still queued or being prepared in the pipeline when the process stops are not stored yet
+OUTBOX_ENABLED = True
+OUTBOX_PATH = "profile_files/outbox.sqlite3"
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_RETRY_BASE_DELAY = 5.0
+OUTBOX_RETRY_MAX_DELAY = 15 * 60
+OUTBOX_RETENTION = 7 * 24 * 60 * 60
+# Seconds a new delivery is kept from the retry loop while its first send is running
+OUTBOX_SEND_LEASE = 5 * 60
+
+# History backfill
+BACKFILL_WORKERS = 8
+BACKFILL_CHECKPOINT_PATH = "profile_files/backfill_checkpoints.json"
+BACKFILL_CHECKPOINT_EVERY = 50
+
+# Sender and chat entity cache
+ENTITY_CACHE_SIZE = 5000
+ENTITY_CACHE_TTL = 30 * 60
+
+# Recent messages kept per chat to build reply embeds without fetching them
+RECENT_MESSAGES_PER_CHAT = 1000
+
+# Telegram -> Discord message id map, used to mirror edits and deletions
+MESSAGE_MAP_ENABLED = True
+MESSAGE_MAP_PATH = "profile_files/message_map.sqlite3"
+MESSAGE_MAP_RETENTION = 30 * 24 * 60 * 60
+EDIT_DEBOUNCE_DELAY = 2.0
+
+# Prometheus metrics, served on http://METRICS_HOST:METRICS_PORT/metrics when enabled
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Merge bursts of short text messages from the same sender into one post
+COALESCE_ENABLED = False
+COALESCE_WINDOW = 2.0
+DISCORD_MAX_CONTENT_LENGTH = 2000
+
+# On-disk media cache keyed by Telegram photo/document id, so forwarded files are downloaded once.
+# When enabled it takes precedence over MEDIA_MODE: every photo and document that fits in the
+# cache is written to MEDIA_CACHE_FOLDER, even in "stream" mode, so it is off by default
+MEDIA_CACHE_ENABLED = False
+MEDIA_CACHE_FOLDER = "profile_files/media_cache/"
+MEDIA_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Also detect identical files with different ids by their SHA-256, storing them once
+MEDIA_CACHE_HASH = False
+
+# Resolved ids of the chats given by username or link in routes, so restarts need no lookup
+CHAT_ID_CACHE_PATH = "profile_files/chat_ids.json"
+
+# Persistent index of dialogs and forum topics, refreshed with what changed since the last visit,
+# and read in full again after DIALOG_INDEX_FULL_REFRESH seconds
+DIALOG_INDEX_PATH = "profile_files/dialog_index.json"
+DIALOG_INDEX_FULL_REFRESH = 24 * 60 * 60
+FORUM_TOPICS_PAGE_SIZE = 100
+
+# Documents larger than the threshold are downloaded in parts over several connections to their DC
+PARALLEL_DOWNLOAD_ENABLED = True
+PARALLEL_DOWNLOAD_THRESHOLD = 10 * 1024 * 1024
+PARALLEL_DOWNLOAD_CONNECTIONS = 4
+# Must be a multiple of 4 KiB that divides 1 MiB, at most 512 KiB
+PARALLEL_DOWNLOAD_PART_SIZE = 512 * 1024
+
+# Caps on the prepared messages waiting for Discord, so a slow Discord cannot exhaust memory or disk.
+# The disk cap counts media cache files held by those messages too.
+BACKPRESSURE_ENABLED = True
+BACKPRESSURE_MAX_MESSAGES = 500
+BACKPRESSURE_MAX_BYTES = 256 * 1024 * 1024
+BACKPRESSURE_MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024
+# Past the message cap: "block" pauses ingest, "summary" skips messages and says how many in the next one
+BACKPRESSURE_MESSAGE_POLICY = "block"
+# Past the memory or disk cap: "block" pauses ingest, "placeholder" sends a note instead of the media
+BACKPRESSURE_MEDIA_POLICY = "block"
+
+# Central scheduler of Telegram requests: requests per second per request type, served by
+# priority (live messages, then avatars, then backfill), and a pause of every request on FloodWait.
+# It wraps the private TelegramClient._call, and is skipped with a warning on Telethon versions
+# where that method has changed.
+TELEGRAM_SCHEDULER_ENABLED = True
+TELEGRAM_RATE_LIMITS = {
+    "GetFileRequest": 40,
+    "GetHistoryRequest": 5,
+    "GetMessagesRequest": 10,
+    "GetChannelMessagesRequest": 10,
+    "GetUsersRequest": 10,
+    "GetFullUserRequest": 5,
+    "GetForumTopicsRequest": 2,
+    "GetDialogsRequest": 2,
+}
+TELEGRAM_DEFAULT_RATE = 20
+# Seconds worth of requests a type may send at once before being paced
+TELEGRAM_RATE_BURST = 2.0
+# Longer FloodWaits are raised to the caller instead of pausing every request
+TELEGRAM_MAX_FLOOD_WAIT = 300
+TELEGRAM_FLOOD_RETRIES = 3
@@ -1,16 +1,36 @@
-from config import DISCORD_WEBHOOK_URL
+from config import (DISCORD_WEBHOOK_URL, DISCORD_WEBHOOK_POOL, ROUTES, OUTBOX_ENABLED, MESSAGE_MAP_ENABLED,
+                    MEDIA_CACHE_ENABLED, PARALLEL_DOWNLOAD_ENABLED, MEDIA_POLICY_ENABLED,
+                    TELEGRAM_SCHEDULER_ENABLED)
 import os
 from dotenv import load_dotenv
+import argparse
 import asyncio
+import json
+import signal
+import sys
+from datetime import datetime, timedelta, timezone
 
 from models.identifier import Identifier
+from services.backfill_service import BackfillService
 from services.discord_service import DiscordService
+from services.dialog_index import DialogIndex
+from services.entity_cache import EntityCache
+from services.media_policy import MediaPolicy
 from services.media_processor import MediaProcessor
 from services.message_handler import MessageHandler
+from services.message_map import MessageMap
+from services.message_router import MessageRouter
+from services.outbox import Outbox
+from services.parallel_downloader import ParallelDownloader
+from services.recent_messages import RecentMessages
+from services.telegram_scheduler import TelegramScheduler
 from services.telegram_service import TelegramService
 from services.user_service import UserService
 from utils.check_string import CheckString
 from utils.file_manager import FileManager
+from utils.media_cache import MediaCache
+from utils.metrics import default_metrics
+from utils.processing_pool import default_pool
 from utils.user_interface import UserInterface
 
 load_dotenv()
@@ -19,6 +39,43 @@ telegram_api_id = os.getenv('TELEGRAM_API_ID')
 telegram_api_hash = os.getenv('TELEGRAM_API_HASH')
 
 
+def create_services(webhook_url=DISCORD_WEBHOOK_URL, webhook_pool=DISCORD_WEBHOOK_POOL):
+    """
+    Builds the Discord, Telegram and message handling services configured in config.py.
+
+    Returns:
+        tuple: (discord_service, telegram_service, message_handler).
+    """
+    discord_service = DiscordService(webhook_url, webhook_pool)
+    file_manager = FileManager()
+    media_cache = MediaCache() if MEDIA_CACHE_ENABLED else None
+    media_processor = MediaProcessor(file_manager, media_cache=media_cache,
+                                     downloader=ParallelDownloader() if PARALLEL_DOWNLOAD_ENABLED else None,
+                                     policy=MediaPolicy() if MEDIA_POLICY_ENABLED else None)
+    user_service = UserService(file_manager)
+    message_map = MessageMap() if MESSAGE_MAP_ENABLED else None
+    outbox = Outbox(message_map=message_map, media_cache=media_cache) if OUTBOX_ENABLED else None
+    message_handler = MessageHandler(media_processor, user_service, outbox, EntityCache(), RecentMessages(),
+                                     message_map)
+    telegram_service = TelegramService(int(telegram_api_id), telegram_api_hash, media_processor,
+                                       message_handler,
+                                       scheduler=TelegramScheduler() if TELEGRAM_SCHEDULER_ENABLED else None)
+    discord_service.register_metrics(default_metrics())
+    message_handler.register_metrics(default_metrics())
+    return discord_service, telegram_service, message_handler
+
+
+async def close_services(discord_service, message_handler):
+    """Closes the metrics endpoint, the Discord session and the outbox and message map databases."""
+    await default_metrics().stop_server()
+    await discord_service.close()
+    if message_handler.outbox:
+        await message_handler.outbox.close()
+    if message_handler.message_map:
+        await message_handler.message_map.close()
+    default_pool().shutdown()
+
+
 async def main():
     """
     Main entry point for the application. Initializes services,
@@ -29,28 +86,79 @@ async def main():
     The loop continues until the user chooses to exit. User choices
     include listing groups and starting the mirroring process.
     """
-    discord_service = DiscordService(DISCORD_WEBHOOK_URL)
-    file_manager = FileManager()
-    media_processor = MediaProcessor(file_manager)
-    user_service = UserService(file_manager)
-    message_handler = MessageHandler(media_processor, user_service)
-    telegram_service = TelegramService(int(telegram_api_id), telegram_api_hash, media_processor,
-                                       message_handler)
+    discord_service, telegram_service, message_handler = create_services()
     user_interface = UserInterface()
-    await telegram_service.authenticate()
-
-    while True:
-        user_interface.display_menu()
-        choice = user_interface.get_user_choice()
-        if choice == '1':
-            await handle_group_selection(telegram_service, user_interface, discord_service)
-        elif choice == '2':
-            await handle_group_mirroring(telegram_service, user_interface, discord_service)
-        elif choice == '0':
-            user_interface.exit()
-            break
-        else:
-            print("Invalid choice, please try again.")
+    try:
+        await default_metrics().start_server()
+        await telegram_service.authenticate()
+
+        while True:
+            user_interface.display_menu()
+            choice = user_interface.get_user_choice()
+            if choice == '1':
+                await handle_group_selection(telegram_service, user_interface, discord_service)
+            elif choice == '2':
+                await handle_group_mirroring(telegram_service, user_interface, discord_service)
+            elif choice == '3':
+                await handle_routes_mirroring(telegram_service, discord_service)
+            elif choice == '4':
+                await handle_backfill(telegram_service, user_interface, message_handler, discord_service)
+            elif choice == '0':
+                user_interface.exit()
+                break
+            else:
+                print("Invalid choice, please try again.")
+    finally:
+        await close_services(discord_service, message_handler)
+
+
+async def run_headless(config_path):
+    """
+    Mirrors the routes listed in a JSON file, without the menu or any prompt, e.g. in a container.
+
+    The file holds the routes in the format of ROUTES in config.py, and optionally the
+    default webhook and its pool:
+        {"webhook_url": "https://...", "webhook_pool": [],
+         "routes": [{"chat": -1001234567890, "topic": 42, "destinations": ["https://..."]}]}
+
+    Chats are resolved from the access hashes cached in the Telegram session and the ids
+    resolved on previous runs, so startup never iterates the dialogs of the account. The
+    session must already be authorized, e.g. by logging in once with the menu.
+
+    Args:
+        config_path (str): Path of the JSON file.
+
+    Returns:
+        int: The process exit code.
+    """
+    try:
+        with open(config_path, 'r', encoding='utf-8') as file:
+            mirror_config = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {config_path}: {e}")
+        return 1
+    routes = mirror_config.get('routes') or ROUTES
+    if not routes:
+        print(f"No routes configured in {config_path}.")
+        return 1
+
+    discord_service, telegram_service, message_handler = create_services(
+        mirror_config.get('webhook_url', DISCORD_WEBHOOK_URL), mirror_config.get('webhook_pool', DISCORD_WEBHOOK_POOL))
+    try:
+        await default_metrics().start_server()
+        if not await telegram_service.authenticate(interactive=False):
+            print("The Telegram session is not authorized, run `python main.py` once to log in.")
+            return 1
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, lambda: asyncio.ensure_future(telegram_service.client.disconnect()))
+            except (NotImplementedError, RuntimeError):
+                pass
+        await telegram_service.mirror_routes(MessageRouter.from_config(routes), discord_service)
+        return 0
+    finally:
+        await close_services(discord_service, message_handler)
 
 
 async def handle_group_selection(telegram_service, user_interface, discord_service):
@@ -94,6 +202,61 @@ async def handle_group_mirroring(telegram_service, user_interface, discord_servi
     await start_mirroring_group(group, telegram_service, user_interface, discord_service, group_choice=group_choice)
 
 
+async def handle_routes_mirroring(telegram_service, discord_service):
+    """
+    Mirrors every chat configured in the ROUTES routing table of config.py with
+    a single Telegram client.
+    """
+    if not ROUTES:
+        print("No routes configured, add them to ROUTES in config.py.")
+        return
+    await telegram_service.mirror_routes(MessageRouter.from_config(ROUTES), discord_service)
+
+
+async def handle_backfill(telegram_service, user_interface, message_handler, discord_service):
+    """
+    Mirrors the history of a Telegram group, or of one of its topics, within a
+    message ID or date range. Interrupted imports resume from their last checkpoint.
+    """
+    group_choice: Identifier = CheckString.check_string_group(user_interface.get_group())
+    group = await telegram_service.get_group(group_choice)
+    if not group:
+        print("Group not found, please try again.")
+        return
+    start, end = user_interface.get_backfill_range()
+    try:
+        from_id, from_date = parse_backfill_bound(start)
+        to_id, to_date = parse_backfill_bound(end, end_of_day=True)
+    except ValueError:
+        print("Invalid range, please use a message ID or a date as YYYY-MM-DD.")
+        return
+    backfill_service = BackfillService(telegram_service.client, message_handler, discord_service)
+    mirrored, failed = await backfill_service.backfill(group, group_choice.subgroup_id, from_id, to_id, from_date,
+                                                       to_date)
+    if failed:
+        print(f"Backfill finished: {mirrored} messages mirrored, {failed} failed. "
+              f"Run it again to retry from the first failed message.")
+    else:
+        print(f"Backfill finished: {mirrored} messages mirrored.")
+
+
+def parse_backfill_bound(value, end_of_day=False):
+    """
+    Parses a backfill range bound typed by the user.
+
+    Returns:
+        tuple: (message ID, None), (None, UTC datetime) or (None, None) if empty.
+    """
+    if not value:
+        return None, None
+    if value.isdigit():
+        return int(value), None
+    date = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        date += timedelta(days=1, microseconds=-1)
+    return None, date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
 async def start_mirroring_group(group, telegram_service, user_interface, discord_service, sub_groups=None,
                                 group_choice=None):
     """
@@ -132,7 +295,7 @@ async def start_mirroring_group(group, telegram_service, user_interface, discord
     print(
         f"Starting mirroring of group:\nName:{group_title}\nUserName:{group_username}\nId:{group.id}{subgroup_name_display}")
     print("\n" + "=" * 50 + "\n")
-    await telegram_service.mirror_group_messages(int(group.id), discord_service, sub_group_id)
+    await telegram_service.mirror_group_messages(DialogIndex.chat_key(group), discord_service, sub_group_id)
 
 
 async def show_loading_indicator(task):
@@ -152,4 +315,10 @@ async def show_loading_indicator(task):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror Telegram groups to Discord.")
+    parser.add_argument('--config', default=os.getenv('MIRROR_CONFIG'),
+                        help="JSON file of routes to mirror without the menu (or set MIRROR_CONFIG)")
+    args = parser.parse_args()
+    if args.config:
+        sys.exit(asyncio.run(run_headless(args.config)))
     asyncio.run(main())
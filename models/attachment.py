@@ -0,0 +1,67 @@
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Attachment:
+    """
+    A file to be uploaded with a Discord message.
+
+    The content can live on disk (`path`), in memory (`data`) or be streamed from
+    Telegram (`stream_factory`). A fresh body is produced for every upload attempt,
+    since aiohttp closes file objects and exhausts streams once they have been sent.
+
+    Attributes:
+        filename (str): Name the file is uploaded with.
+        path (str): Path of the file on disk, if stored on disk.
+        data (bytes): Content of the file, if spooled in memory.
+        stream_factory: Callable returning a new async iterator of chunks, if streamed.
+        size (int): Size of the file in bytes, if known.
+        source (tuple): (chat id, message id) of the Telegram message the file comes from, if any,
+                        so it can be downloaded again later.
+        cached (bool): Whether the file belongs to the media cache, and must not be deleted after upload.
+    """
+
+    def __init__(self, filename, path=None, data=None, stream_factory=None, size=None, source=None, cached=False):
+        self.filename = filename
+        self.path = path
+        self.data = data
+        self.stream_factory = stream_factory
+        self.size = size if size is not None else self._known_size()
+        self.source = source
+        self.cached = cached
+
+    @classmethod
+    def from_path(cls, path, source=None, cached=False):
+        return cls(os.path.basename(path), path=path, source=source, cached=cached)
+
+    def to_record(self):
+        """Returns a reference to the file for persistent storage: its path and its Telegram source."""
+        return {'filename': self.filename, 'path': self.path, 'source': list(self.source) if self.source else None,
+                'cached': self.cached}
+
+    def _known_size(self):
+        if self.data is not None:
+            return len(self.data)
+        if self.path and os.path.exists(self.path):
+            return os.path.getsize(self.path)
+        return None
+
+    def open(self):
+        """
+        Opens a fresh body for the attachment.
+
+        Returns:
+            A file object or an async iterator of chunks, or None if an error occurred.
+        """
+        try:
+            if self.data is not None:
+                return io.BytesIO(self.data)
+            if self.stream_factory is not None:
+                return self.stream_factory()
+            return open(self.path, 'rb')
+        except Exception as e:
+            logger.error(f"Error opening attachment {self.filename}: {e}")
+            return None
@@ -2,16 +2,25 @@ from models.embed import Embed
 
 
 class Content:
-    def __init__(self, username):
+    def __init__(self, username, sender_id=None):
         self.username = username
+        self.sender_id = sender_id
         self.avatar = None
         self.avatar_url = None
         self.content = ""
+        self.notes = []
         self.embeds = []
 
     def set_content(self, content):
         self.content = content
 
+    def set_notes(self, notes):
+        self.notes = list(notes)
+
+    def text(self):
+        """Returns the text as posted: the content followed by its notes, one per line."""
+        return "\n".join(([self.content] if self.content else []) + self.notes)
+
     def set_avatar(self, avatar_base64):
         self.avatar = avatar_base64
 
@@ -24,7 +33,7 @@ class Content:
     def to_dict(self):
         data = {
             "username": self.username,
-            "content": self.content,
+            "content": self.text(),
             "embeds": [embed.to_dict() for embed in self.embeds],
         }
 
@@ -35,3 +44,27 @@ class Content:
 
     def avatar_to_dict(self):
         return {"avatar": self.avatar}
+
+    def to_record(self):
+        """Returns every field of the content, including the avatar, for persistent storage."""
+        return {
+            "username": self.username,
+            "sender_id": self.sender_id,
+            "content": self.content,
+            "notes": self.notes,
+            "embeds": [embed.to_dict() for embed in self.embeds],
+            "avatar": self.avatar,
+            "avatar_url": self.avatar_url,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuilds a content from the dictionary returned by `to_record`."""
+        content = cls(record["username"], record.get("sender_id"))
+        content.set_content(record.get("content") or "")
+        content.set_notes(record.get("notes") or [])
+        content.set_avatar(record.get("avatar"))
+        content.set_avatar_url(record.get("avatar_url"))
+        for embed in record.get("embeds", []):
+            content.add_embed(Embed.from_dict(embed))
+        return content
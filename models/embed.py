@@ -9,6 +9,17 @@ class Embed:
         self.footer = None
         self.color = None
 
+    @classmethod
+    def from_dict(cls, data):
+        embed = cls(data.get('description'), data.get('title'))
+        embed.author = data.get('author')
+        embed.fields = data.get('fields', [])
+        embed.thumbnail = data.get('thumbnail')
+        embed.image = data.get('image')
+        embed.footer = data.get('footer')
+        embed.color = data.get('color')
+        return embed
+
     def set_author(self, name, url=None, icon_url=None):
         self.author = {"name": name, "url": url, "icon_url": icon_url}
 
@@ -0,0 +1,53 @@
+class PreparedMessage:
+    """
+    A Telegram message that has been fetched and formatted, ready to be sent to Discord.
+
+    Attributes:
+        event: The Telegram message event the message was built from.
+        user_name (str): Display name of the sender.
+        user_image_data_url (str): Base64 data URL of the sender's avatar, if any.
+        content (Content): The Discord message content.
+        destinations (list): Destination objects to send to; [None] means the default webhook.
+        attachments (list): Attachment objects to upload with the message.
+        temp_paths (list): Temporary files to delete once the message has been handled.
+        cached_attachments (list): Attachments served from the media cache, released once
+                                   the message has been handled.
+        merged_events (list): Events of later messages whose text was merged into this one.
+        notes (list): (text, destinations) notes added to the content for some destinations,
+                      e.g. in place of media over their upload limit.
+    """
+
+    def __init__(self, event, user_name, user_image_data_url, content, destinations=None):
+        self.event = event
+        self.user_name = user_name
+        self.user_image_data_url = user_image_data_url
+        self.content = content
+        self.destinations = destinations or [None]
+        self.attachments = []
+        self.temp_paths = []
+        self.cached_attachments = []
+        self.merged_events = []
+        self.notes = []
+        self._attachment_destinations = {}
+
+    def add_attachment(self, attachment, temp=True, destinations=None):
+        """Adds an attachment, sent to every destination or only to the given ones."""
+        self.attachments.append(attachment)
+        if destinations is not None:
+            self._attachment_destinations[id(attachment)] = destinations
+        if attachment.cached:
+            self.cached_attachments.append(attachment)
+        elif temp and attachment.path:
+            self.temp_paths.append(attachment.path)
+
+    def add_note(self, text, destinations):
+        self.notes.append((text, destinations))
+
+    def attachments_for(self, destination):
+        """Returns the attachments sent to a destination."""
+        return [attachment for attachment in self.attachments
+                if destination in self._attachment_destinations.get(id(attachment), [destination])]
+
+    def notes_for(self, destination):
+        """Returns the notes added to the content sent to a destination."""
+        return [text for text, destinations in self.notes if destination in destinations]
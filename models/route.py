@@ -0,0 +1,90 @@
+class Destination:
+    """
+    A Discord channel reached through a webhook, optionally posting into a thread.
+
+    Extra webhooks of the same channel can be given as a pool: users are spread across
+    them, which avoids avatar updates between speakers and multiplies the send capacity.
+
+    Attributes:
+        webhook_url (str): The Discord webhook URL.
+        thread_id (int): ID of the Discord thread to post into, or None for the channel itself.
+        webhook_pool (list): Additional webhook URLs of the same channel.
+        max_upload_size (int): Upload limit of the channel's server in bytes, or None for
+                               DISCORD_MAX_UPLOAD_SIZE.
+    """
+
+    def __init__(self, webhook_url, thread_id=None, webhook_pool=None, max_upload_size=None):
+        self.webhook_url = webhook_url
+        self.thread_id = thread_id
+        self.webhook_pool = webhook_pool or []
+        self.max_upload_size = max_upload_size
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a destination from its configuration.
+
+        Args:
+            data: A webhook URL, or a dict with `webhook_url` and optional `thread_id`, `webhook_pool`
+                  and `max_upload_size`.
+
+        Returns:
+            Destination: The parsed destination.
+        """
+        if isinstance(data, str):
+            return cls(data)
+        return cls(data['webhook_url'], data.get('thread_id'), data.get('webhook_pool'), data.get('max_upload_size'))
+
+    def to_dict(self):
+        return {'webhook_url': self.webhook_url, 'thread_id': self.thread_id, 'webhook_pool': self.webhook_pool,
+                'max_upload_size': self.max_upload_size}
+
+    def key(self):
+        """Returns a string identifying the webhook and thread of the destination."""
+        return f"{self.webhook_url}#{self.thread_id or ''}"
+
+    def webhook_urls(self):
+        """Returns every webhook URL of the destination, starting with the main one."""
+        return [self.webhook_url] + [url for url in self.webhook_pool if url != self.webhook_url]
+
+    def __eq__(self, other):
+        return isinstance(other, Destination) and (self.webhook_url, self.thread_id) == (
+            other.webhook_url, other.thread_id)
+
+    def __hash__(self):
+        return hash((self.webhook_url, self.thread_id))
+
+    def __repr__(self):
+        return f"Destination(thread_id={self.thread_id}, pool_size={len(self.webhook_urls())})"
+
+
+class Route:
+    """
+    Maps a Telegram chat, optionally restricted to one forum topic, to Discord destinations.
+
+    Attributes:
+        chat: The Telegram chat (id, username or link) to mirror.
+        topic_id (int): ID of the forum topic to mirror, or None for the whole chat.
+        destinations (list): Destination objects the messages are sent to.
+    """
+
+    def __init__(self, chat, destinations, topic_id=None):
+        self.chat = chat
+        self.topic_id = topic_id
+        self.destinations = destinations
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a route from its configuration dictionary.
+
+        Args:
+            data (dict): A dictionary with `chat`, optional `topic` and a list of `destinations`,
+                         each one a webhook URL or a dict with `webhook_url` and optional
+                         `thread_id`, `webhook_pool` and `max_upload_size`.
+
+        Returns:
+            Route: The parsed route.
+        """
+        destinations = [Destination.from_dict(destination) for destination in data['destinations']]
+        return cls(data['chat'], destinations, data.get('topic'))
@@ -0,0 +1,130 @@
+import logging
+from collections import deque
+
+from telethon.tl.types import MessageMediaPoll
+
+from config import BACKFILL_WORKERS, BACKFILL_CHECKPOINT_PATH, BACKFILL_CHECKPOINT_EVERY, BACKPRESSURE_ENABLED
+from services.load_shedder import LoadShedder, BLOCK
+from services.message_pipeline import MessagePipeline
+from services.telegram_scheduler import telegram_priority, BACKFILL
+from utils.checkpoint_store import CheckpointStore
+from utils.metrics import default_metrics
+from utils.telegram_event import HistoryEvent
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillService:
+    """
+    Mirrors the history of a chat, e.g. what was posted before the mirror started or while it was down.
+
+    Messages are read oldest first and fed to a message pipeline, so senders, avatars and
+    media of many messages are fetched concurrently while Discord receives them in order
+    and at the pace its rate limits allow. The id of the last mirrored message of each chat
+    is saved as a checkpoint, so an interrupted import resumes where it stopped. The
+    checkpoint never moves past a message that failed to be delivered, so the next import
+    starts again from it.
+
+    With backpressure enabled, the pipeline has its own load shedder, which only ever
+    blocks: skipping messages or media would leave holes in the imported history.
+
+    Attributes:
+        client: Telethon client used to read the history.
+        message_handler: Prepares and sends messages.
+        discord_service: Service handling the delivery of messages to Discord.
+        workers (int): Number of concurrent prepare workers.
+        checkpoints (CheckpointStore): Last mirrored message id of each chat and topic.
+        checkpoint_every (int): Number of mirrored messages between checkpoint saves.
+    """
+
+    def __init__(self, client, message_handler, discord_service, workers=BACKFILL_WORKERS,
+                 checkpoint_path=BACKFILL_CHECKPOINT_PATH, checkpoint_every=BACKFILL_CHECKPOINT_EVERY):
+        self.client = client
+        self.message_handler = message_handler
+        self.discord_service = discord_service
+        self.workers = workers
+        self.checkpoints = CheckpointStore(checkpoint_path)
+        self.checkpoint_every = checkpoint_every
+
+    @staticmethod
+    def checkpoint_key(chat_id, topic_id=None):
+        return f"{chat_id}:{topic_id or ''}"
+
+    async def backfill(self, chat, topic_id=None, from_id=None, to_id=None, from_date=None, to_date=None,
+                       destinations=None):
+        """
+        Mirrors the messages of a chat within an id or date range, resuming from the last checkpoint.
+
+        Args:
+            chat: The chat entity or id to read.
+            topic_id (int): Forum topic to restrict the import to, if any.
+            from_id (int): First message id to mirror (inclusive).
+            to_id (int): Last message id to mirror (inclusive).
+            from_date (datetime): Mirror messages sent from this date on.
+            to_date (datetime): Mirror messages sent up to this date.
+            destinations (list): Destination objects, defaults to the Discord service's webhook.
+
+        Returns:
+            tuple: Number of messages (albums counting once) that were mirrored, and that failed.
+        """
+        chat_id = await self.client.get_peer_id(chat)
+        key = self.checkpoint_key(chat_id, topic_id)
+        min_id = max((from_id or 1) - 1, self.checkpoints.get(key, 0))
+        max_id = to_id + 1 if to_id else 0
+        destinations = destinations or [self.discord_service.default_destination()]
+        processed = {'mirrored': 0, 'failed': 0}
+        submitted_ids = deque()
+        done_ids = set()
+
+        async def submit(messages):
+            submitted_ids.append(messages[-1].id)
+            await pipeline.submit(HistoryEvent(messages), destinations)
+
+        def on_processed(event, delivered):
+            # Topics of a forum are delivered independently, so the checkpoint only moves
+            # past messages once every older message has been delivered as well.
+            message_id = max(message.id for message in (event.messages or [event.message]))
+            if delivered:
+                processed['mirrored'] += 1
+                done_ids.add(message_id)
+            else:
+                processed['failed'] += 1
+                logger.error(f"Backfill of chat {chat_id}: message {message_id} was not delivered, "
+                             f"the checkpoint stays before it.")
+            while submitted_ids and submitted_ids[0] in done_ids:
+                done_ids.discard(submitted_ids[0])
+                self.checkpoints.set(key, submitted_ids.popleft())
+            if (processed['mirrored'] + processed['failed']) % self.checkpoint_every == 0:
+                self.checkpoints.save()
+                logger.info(f"Backfill of chat {chat_id}: {processed['mirrored']} messages mirrored, "
+                            f"{processed['failed']} failed, checkpoint {self.checkpoints.get(key)}.")
+
+        shedder = LoadShedder(self.message_handler, message_policy=BLOCK,
+                              media_policy=BLOCK) if BACKPRESSURE_ENABLED else None
+        pipeline = MessagePipeline(self.message_handler, self.discord_service, self.client, workers=self.workers,
+                                   on_processed=on_processed, shedder=shedder, priority=BACKFILL)
+        pipeline.register_metrics(default_metrics())
+        pipeline.start()
+        try:
+            album = []
+            with telegram_priority(BACKFILL):
+                async for message in self.client.iter_messages(chat, reverse=True, min_id=min_id, max_id=max_id,
+                                                               offset_date=from_date, reply_to=topic_id, wait_time=0):
+                    if to_date and message.date > to_date:
+                        break
+                    if album and message.grouped_id != album[0].grouped_id:
+                        await submit(album)
+                        album = []
+                    if getattr(message, 'action', None) or isinstance(message.media, MessageMediaPoll):
+                        continue
+                    if message.grouped_id:
+                        album.append(message)
+                    else:
+                        await submit([message])
+            if album:
+                await submit(album)
+            await pipeline.join()
+        finally:
+            await pipeline.stop()
+            self.checkpoints.save()
+        return processed['mirrored'], processed['failed']
@@ -0,0 +1,200 @@
+import logging
+import time
+
+from telethon import utils
+from telethon.tl.types import ForumTopic, ForumTopicDeleted
+
+try:
+    from telethon.tl.functions.channels import GetForumTopicsRequest
+    TOPICS_PEER_ARGUMENT = 'channel'
+except ImportError:
+    # Newer Telethon layers moved the request to messages, taking any peer.
+    from telethon.tl.functions.messages import GetForumTopicsRequest
+    TOPICS_PEER_ARGUMENT = 'peer'
+
+from config import DIALOG_INDEX_PATH, DIALOG_INDEX_FULL_REFRESH, FORUM_TOPICS_PAGE_SIZE
+from utils.checkpoint_store import CheckpointStore
+
+logger = logging.getLogger(__name__)
+
+
+class DialogEntry:
+    """
+    A channel or group of the account, as listed in the menu.
+
+    Attributes:
+        id (int): Marked chat id.
+        title (str): Title of the chat.
+        name (str): Display name, same as the title.
+        username (str): Public username, or None.
+        date (float): Timestamp of the chat's latest message.
+    """
+
+    def __init__(self, id, title, username=None, date=0.0):
+        self.id = id
+        self.title = title
+        self.name = title
+        self.username = username
+        self.date = date
+
+    def to_dict(self):
+        return {'id': self.id, 'title': self.title, 'username': self.username, 'date': self.date}
+
+
+class TopicEntry:
+    """
+    A forum topic.
+
+    Attributes:
+        id (int): ID of the topic.
+        title (str): Title of the topic.
+        top_message (int): ID of the latest message of the topic.
+    """
+
+    def __init__(self, id, title, top_message=0):
+        self.id = id
+        self.title = title
+        self.top_message = top_message
+
+
+class DialogIndex:
+    """
+    Persistent index of the account's channels and of their forum topics.
+
+    Telegram lists dialogs and topics by latest activity, so a refresh only reads them
+    until it reaches one that has not changed since the previous refresh: revisiting the
+    menu costs a single request instead of iterating every dialog, and topic names are
+    looked up locally. Dialogs and the topics of each forum are read in full again every
+    `full_refresh_interval` seconds, to drop the dialogs the account left and to pick up
+    topics renamed or closed without a new message.
+
+    Attributes:
+        store (CheckpointStore): JSON file holding the index.
+        full_refresh_interval (int): Seconds between complete dialog and topic refreshes.
+        page_size (int): Topics requested per page.
+    """
+
+    def __init__(self, path=DIALOG_INDEX_PATH, full_refresh_interval=DIALOG_INDEX_FULL_REFRESH,
+                 page_size=FORUM_TOPICS_PAGE_SIZE):
+        self.store = CheckpointStore(path)
+        self.full_refresh_interval = full_refresh_interval
+        self.page_size = page_size
+
+    @staticmethod
+    def chat_key(chat):
+        """Returns the marked id of a chat given as an id, a DialogEntry or an entity."""
+        if isinstance(chat, int):
+            return chat
+        if isinstance(chat, DialogEntry):
+            return chat.id
+        return utils.get_peer_id(chat)
+
+    def dialogs(self):
+        """
+        Returns the indexed channels, most recently active first.
+
+        Returns:
+            list: DialogEntry objects.
+        """
+        dialogs = [DialogEntry(**record) for record in self.store.get('dialogs', {}).values()]
+        return sorted(dialogs, key=lambda dialog: dialog.date, reverse=True)
+
+    async def refresh_dialogs(self, client, full=False):
+        """
+        Adds the channels whose latest message is newer than the previous refresh.
+
+        Args:
+            client: Telethon client used to read the dialogs.
+            full (bool): Whether to read every dialog, dropping the ones no longer there.
+        """
+        dialogs = self.store.get('dialogs', {})
+        full = full or not dialogs or time.time() - self.store.get('dialogs_refreshed_at', 0) > \
+            self.full_refresh_interval
+        watermark = 0.0 if full else self.store.get('dialogs_watermark', 0.0)
+        newest = watermark
+        found = {}
+        async for dialog in client.iter_dialogs():
+            date = dialog.date.timestamp() if dialog.date else 0.0
+            if not full and not dialog.pinned and date <= watermark:
+                break
+            newest = max(newest, date)
+            if dialog.is_channel:
+                entry = DialogEntry(dialog.id, dialog.title, getattr(dialog.entity, 'username', None), date)
+                found[str(dialog.id)] = entry.to_dict()
+        self.store.set('dialogs', found if full else {**dialogs, **found})
+        self.store.set('dialogs_watermark', newest)
+        if full:
+            self.store.set('dialogs_refreshed_at', time.time())
+        self.store.save()
+        logger.info(f"Dialog index refreshed: {len(found)} channel(s) read, {'full' if full else 'incremental'}.")
+
+    def topics(self, chat):
+        """
+        Returns the indexed topics of a forum, most recently active first.
+
+        Args:
+            chat: The forum, as an id, a DialogEntry or an entity.
+
+        Returns:
+            list: TopicEntry objects, or None if the forum was never indexed.
+        """
+        entry = self.store.get(f"topics:{self.chat_key(chat)}")
+        if entry is None:
+            return None
+        topics = [TopicEntry(int(topic_id), topic['title'], topic['top_message'])
+                  for topic_id, topic in entry['topics'].items()]
+        return sorted(topics, key=lambda topic: topic.top_message, reverse=True)
+
+    def topic_title(self, chat, topic_id):
+        """Returns the title of an indexed topic, or None."""
+        entry = self.store.get(f"topics:{self.chat_key(chat)}")
+        topic = entry['topics'].get(str(topic_id)) if entry else None
+        return topic['title'] if topic else None
+
+    async def refresh_topics(self, client, chat, full=False):
+        """
+        Reads the topics of a forum page by page, until it reaches one that has had no
+        message since the previous refresh.
+
+        Args:
+            client: Telethon client used to read the topics.
+            chat: The forum, as an id, a DialogEntry or an entity.
+            full (bool): Whether to read every topic, replacing the indexed ones.
+
+        Raises:
+            ChannelInvalidError, ChannelForumMissingError: If the chat is not a forum.
+        """
+        key = f"topics:{self.chat_key(chat)}"
+        entry = self.store.get(key)
+        full = full or entry is None or time.time() - entry.get('refreshed_at', 0) > self.full_refresh_interval
+        if full:
+            entry = {'watermark': 0, 'topics': {}, 'refreshed_at': time.time()}
+        channel = chat.id if isinstance(chat, DialogEntry) else chat
+        watermark = newest = entry['watermark']
+        offset_date, offset_id, offset_topic = None, 0, 0
+        while True:
+            result = await client(GetForumTopicsRequest(
+                **{TOPICS_PEER_ARGUMENT: channel},
+                offset_date=offset_date,
+                offset_id=offset_id,
+                offset_topic=offset_topic,
+                limit=self.page_size
+            ))
+            caught_up = False
+            for topic in result.topics:
+                if isinstance(topic, ForumTopicDeleted):
+                    entry['topics'].pop(str(topic.id), None)
+                    continue
+                if watermark and topic.top_message <= watermark and not topic.pinned:
+                    caught_up = True
+                    break
+                entry['topics'][str(topic.id)] = {'title': topic.title, 'top_message': topic.top_message}
+                newest = max(newest, topic.top_message)
+            last = next((topic for topic in reversed(result.topics) if isinstance(topic, ForumTopic)), None)
+            if caught_up or last is None or len(result.topics) < self.page_size:
+                break
+            dates = {message.id: message.date for message in result.messages}
+            offset_date, offset_id, offset_topic = dates.get(last.top_message), last.top_message, last.id
+        entry['watermark'] = newest
+        self.store.set(key, entry)
+        self.store.save()
@@ -1,25 +1,160 @@
+import asyncio
 import json
 import logging
+import random
+import re
+import time
 
 import aiohttp
 
+from config import (DISCORD_CONNECTION_LIMIT, DISCORD_CONNECTION_LIMIT_PER_HOST, DISCORD_KEEPALIVE_TIMEOUT,
+                    DISCORD_DNS_CACHE_TTL, DISCORD_REQUEST_TIMEOUT, DISCORD_MAX_RETRIES, DISCORD_RETRY_BASE_DELAY,
+                    DISCORD_RETRY_MAX_DELAY, DISCORD_MAX_ATTACHMENTS, DISCORD_MAX_UPLOAD_SIZE,
+                    DISCORD_BUCKET_IDLE_TIMEOUT)
 from models.content import Content
+from models.route import Destination
+from services.webhook_pool import WebhookPool
+from utils.metrics import default_metrics
+from utils.rate_limit_bucket import RateLimitBucket
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_AVATAR_URL = ("https://raw.githubusercontent.com/OniMock/.github/refs/heads/main/"
+                      ".resources/logo/fav_icon_logo.png")
+# Message ids in edit and delete URLs, which share the rate limit of their webhook's route
+MESSAGE_ID_PATTERN = re.compile(r'/messages/\d+$')
+
 
 class DiscordService:
-    def __init__(self, webhook_url):
+    """
+    Delivers mirrored messages to one or more Discord webhooks.
+
+    A single aiohttp session with a keep-alive connector pool is kept for the life
+    of the service, so consecutive posts and avatar updates reuse the same TCP/TLS
+    connections instead of paying a new handshake for every message.
+
+    Requests go through a small scheduler that tracks Discord's rate-limit buckets,
+    paces requests before a limit is hit and retries 429 and 5xx responses, while
+    keeping posts to each webhook in order.
+
+    Attributes:
+        webhook_url (str): The default Discord webhook URL messages are posted to.
+        webhook_pool (list): Extra webhooks of the default webhook's channel.
+        connection_stats (dict): Counters of created and reused connections.
+        delivery_stats (dict): Counters of sent, failed, retried and rate-limited requests,
+                               and of uploaded bytes.
+    """
+
+    def __init__(self, webhook_url, webhook_pool=None, connection_limit=DISCORD_CONNECTION_LIMIT,
+                 connection_limit_per_host=DISCORD_CONNECTION_LIMIT_PER_HOST,
+                 keepalive_timeout=DISCORD_KEEPALIVE_TIMEOUT, dns_cache_ttl=DISCORD_DNS_CACHE_TTL,
+                 request_timeout=DISCORD_REQUEST_TIMEOUT, max_retries=DISCORD_MAX_RETRIES,
+                 retry_base_delay=DISCORD_RETRY_BASE_DELAY, retry_max_delay=DISCORD_RETRY_MAX_DELAY,
+                 max_attachments=DISCORD_MAX_ATTACHMENTS, max_upload_size=DISCORD_MAX_UPLOAD_SIZE,
+                 bucket_idle_timeout=DISCORD_BUCKET_IDLE_TIMEOUT):
         self.webhook_url = webhook_url
-        self.last_user = None
+        self.webhook_pool = webhook_pool or []
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_attachments = max_attachments
+        self.max_upload_size = max_upload_size
+        self.bucket_idle_timeout = bucket_idle_timeout
+        self.connection_stats = {'created': 0, 'reused': 0}
+        self.delivery_stats = {'sent': 0, 'failed': 0, 'retries': 0, 'rate_limited': 0, 'bytes_uploaded': 0}
+        self._session = None
+        self._buckets = {}
+        self._webhook_locks = {}
+        self._pools = {}
+        self._global_reset_at = 0.0
+
+    async def get_session(self):
+        """
+        Returns the shared aiohttp session, creating it on first use.
+
+        The session must be created inside a running event loop, so it is built
+        lazily instead of in the constructor.
+
+        Returns:
+            aiohttp.ClientSession: The long-lived session used for every webhook request.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                trace_configs=[self._create_trace_config()]
+            )
+        return self._session
+
+    async def close(self):
+        """Closes the shared HTTP session and its connection pool. Safe to call more than once."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f'Discord session closed. Connections: {self.connection_stats}')
+        self._session = None
+
+    def connection_reuse_ratio(self):
+        """
+        Returns the fraction of requests that were served by an already open connection.
+
+        Returns:
+            float: Ratio between 0 and 1, or 0.0 if no request has been made yet.
+        """
+        total = self.connection_stats['created'] + self.connection_stats['reused']
+        return self.connection_stats['reused'] / total if total else 0.0
+
+    def _create_trace_config(self):
+        """Builds an aiohttp trace config that counts new and reused pooled connections."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_connection_create_end(session, context, params):
+            self.connection_stats['created'] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connection_stats['reused'] += 1
+
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def register_metrics(self, metrics):
+        """Exposes the delivery and connection counters on a metrics registry."""
+        stats = self.delivery_stats
+        metrics.register('mirror_discord_messages_total', 'counter', 'Webhook posts by outcome.',
+                         lambda: {'sent': stats['sent'], 'failed': stats['failed']}, 'status')
+        metrics.register('mirror_discord_retries_total', 'counter', 'Retried Discord requests.',
+                         lambda: stats['retries'])
+        metrics.register('mirror_discord_rate_limited_total', 'counter', 'Discord 429 responses.',
+                         lambda: stats['rate_limited'])
+        metrics.register('mirror_discord_bytes_uploaded_total', 'counter', 'Bytes of payloads and files uploaded.',
+                         lambda: stats['bytes_uploaded'])
+        metrics.register('mirror_discord_connections_total', 'counter', 'Connections created and reused.',
+                         lambda: self.connection_stats, 'kind')
+
+    def default_destination(self):
+        """Returns the destination of the configured webhook and its pool."""
+        return Destination(self.webhook_url, webhook_pool=self.webhook_pool)
 
     def update_webhook_avatar(self, user_name, user_image_data_url, form_data_message):
         """
-        Updates the avatar of the webhook message based on the user's name and image data.
+        Sets the avatar the webhook message should be posted with.
 
-        If the user name has changed since the last update, it sets the avatar to the user's image URL
-        or a default image if no user image is provided.
+        The user's image is kept on the message, and the webhook avatar is only updated
+        when the message is sent and the webhook it is assigned to has a different avatar.
+        Users without an image are posted with a default `avatar_url`, which needs no update.
 
         Args:
             user_name (str): The name of the user whose avatar is to be updated.
@@ -27,81 +162,331 @@ class DiscordService:
             form_data_message: An object representing the message to be sent to the webhook,
                                which should have methods for setting the avatar.
         """
-        if self.last_user != user_name:
-            if user_image_data_url:
-                form_data_message.set_avatar(user_image_data_url)
-            else:
-                form_data_message.set_avatar_url(
-                    "https://raw.githubusercontent.com/OniMock/.github/refs/heads/main/.resources/logo/fav_icon_logo.png")
-        self.last_user = user_name
+        if user_image_data_url:
+            form_data_message.set_avatar(user_image_data_url)
+        else:
+            form_data_message.set_avatar_url(DEFAULT_AVATAR_URL)
 
-    async def send_message(self, form_data_message: Content, form_data):
+    async def send_message(self, form_data_message: Content, attachments=None, destination=None, posted=None):
         """
-        Sends a webhook message asynchronously with optional avatar data.
+        Sends a webhook message asynchronously with optional avatar data and attachments.
 
-        This method constructs a session to send the message, adding the message
-        payload and handling avatar data if provided.
+        The message goes through the webhook of the destination's pool assigned to its
+        sender (by Telegram id, or by name when the content has none), updating that
+        webhook's avatar only if it differs from the user's. Posts
+        to the same webhook are delivered one at a time in the order they were
+        submitted, so a message that is waiting on a rate limit or a retry is never
+        overtaken by a later one. Attachments are split across several posts only when
+        they exceed Discord's attachment count or upload size limits; the content goes
+        with the first post.
 
         Args:
             form_data_message (Content): The message content, converted to a JSON payload.
-            form_data: Form data object containing additional data for the webhook.
+            attachments (list): Optional list of Attachment objects to upload.
+            destination (Destination): Webhook and thread to post to, defaults to `webhook_url`.
+            posted (list): If given, the posts are sent with `?wait=true` and the (webhook URL,
+                           Discord message id) of each posted message is appended to it.
+
+        Returns:
+            bool: True if the message was delivered, False otherwise.
+        """
+        destination = destination or self.default_destination()
+        pool = self._webhook_pool(destination)
+        user_key = form_data_message.sender_id or form_data_message.username
+        webhook_url, update_avatar = pool.assign(user_key, form_data_message.avatar)
+        async with self._webhook_lock(webhook_url):
+            if update_avatar and not await self._send_avatar(form_data_message.avatar_to_dict(), webhook_url):
+                pool.forget_avatar(webhook_url)
+            batches = self._split_attachments(attachments or [])
+            delivered = await self._send_message(form_data_message, batches[0], webhook_url, destination.thread_id,
+                                                 posted)
+            for batch in batches[1:]:
+                follow_up = Content(form_data_message.username, form_data_message.sender_id)
+                follow_up.set_avatar_url(form_data_message.avatar_url)
+                delivered = await self._send_message(follow_up, batch, webhook_url,
+                                                     destination.thread_id, posted) and delivered
+            return delivered
+
+    def _webhook_pool(self, destination):
+        """Returns the webhook pool of a destination, creating it on first use."""
+        key = tuple(destination.webhook_urls())
+        if key not in self._pools:
+            self._pools[key] = WebhookPool(key)
+        return self._pools[key]
+
+    def pool_stats(self):
         """
-        async with aiohttp.ClientSession() as session:
-            form_data.add_field('payload_json', json.dumps(form_data_message.to_dict()))
-            if form_data_message.avatar:
-                await self._send_avatar(form_data_message.avatar_to_dict(), session)
-            await self._send_message(form_data, session)
+        Returns the counters of every webhook pool.
 
-    async def _send_message(self, form_data, session):
+        Returns:
+            dict: Assignment, reassignment and avatar update counters, summed over all pools.
         """
-        Sends the prepared form data to the specified webhook URL.
+        stats = {'assignments': 0, 'reassignments': 0, 'avatar_updates': 0}
+        for pool in self._pools.values():
+            for name, value in pool.stats.items():
+                stats[name] += value
+        return stats
 
-        Tries to post the form data to the webhook URL, handling any exceptions
-        that occur and logging errors if the request fails.
+    def _split_attachments(self, attachments):
+        """
+        Splits attachments into batches that fit in one Discord message.
 
         Args:
-            form_data: The data payload to send in the request.
-            session: The aiohttp session used for sending the request.
+            attachments (list): Attachment objects to upload.
 
         Returns:
-            False if an exception occurs; otherwise, response handling proceeds.
+            list: Lists of attachments; always at least one, possibly empty, batch.
+        """
+        batches = [[]]
+        batch_size = 0
+        for attachment in attachments:
+            size = attachment.size or 0
+            batch = batches[-1]
+            if batch and (len(batch) >= self.max_attachments or batch_size + size > self.max_upload_size):
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(attachment)
+            batch_size += size
+        return batches
+
+    async def _send_message(self, form_data_message, attachments, webhook_url, thread_id=None, posted=None):
         """
+        Sends the message payload and its attachments to the webhook URL.
+
+        The multipart body is rebuilt for every attempt, since aiohttp form data
+        can only be sent once.
+
+        Args:
+            form_data_message (Content): The message content.
+            attachments (list): List of Attachment objects to upload.
+            webhook_url (str): The webhook to post to.
+            thread_id (int): ID of the thread to post into, if any.
+            posted (list): Receives the (webhook URL, Discord message id) of the posted message, if given.
+
+        Returns:
+            bool: True if the message was delivered, False otherwise.
+        """
+        params = {'thread_id': thread_id} if thread_id else {}
+        if posted is not None:
+            params['wait'] = 'true'
+        payload_json = json.dumps(form_data_message.to_dict())
+        opened_files = []
+
+        def build_form_data():
+            with metrics.timer('payload_build'):
+                self._close_files(opened_files)
+                form_data = aiohttp.FormData()
+                for attachment in attachments:
+                    file = attachment.open()
+                    if file:
+                        opened_files.append(file)
+                        form_data.add_field('files', file, filename=attachment.filename)
+                form_data.add_field('payload_json', payload_json)
+            self.delivery_stats['bytes_uploaded'] += upload_size
+            return {'data': form_data, 'params': params}
+
+        metrics = default_metrics()
+        upload_size = len(payload_json) + sum(attachment.size or 0 for attachment in attachments)
         try:
-            async with session.post(self.webhook_url, data=form_data) as response:
-                await self._handle_response(response)
-        except Exception as e:
-            logger.error(f'An error occurred: {str(e)} - Data:\n {form_data}')
+            with metrics.timer('webhook_post'):
+                result = await self._request('POST', webhook_url, build_form_data,
+                                             lambda response: self._handle_response(response, webhook_url, posted))
+        finally:
+            self._close_files(opened_files)
+        if result is None:
+            logger.error(f'An error occurred: message dropped after retries - Data:\n {payload_json}')
+            self.delivery_stats['failed'] += 1
             return False
+        return result
 
-    async def _send_avatar(self, payload, session):
+    async def edit_message(self, webhook_url, message_id, payload, thread_id=None):
         """
-        Updates the webhook avatar by sending a PATCH request with avatar data.
+        Edits a message previously posted with a webhook.
 
-        Attempts to update the avatar with the provided payload, logging the outcome
-        based on response status and handling any exceptions.
+        Args:
+            webhook_url (str): The webhook the message was posted with.
+            message_id (int): ID of the Discord message.
+            payload (dict): Fields to change, e.g. `content`.
+            thread_id (int): ID of the thread the message is in, if any.
+
+        Returns:
+            bool: True if the message was edited, False otherwise.
+        """
+        async def handle_edit_response(response):
+            if response.status == 200:
+                logger.info('message edited successfully.')
+                return True
+            response_text = await response.text()
+            logger.error(f'Error editing message: {response.status} - {response_text}')
+            return False
+
+        params = {'thread_id': thread_id} if thread_id else {}
+        async with self._webhook_lock(webhook_url):
+            result = await self._request('PATCH', f'{webhook_url}/messages/{message_id}',
+                                         lambda: {'json': payload, 'params': params}, handle_edit_response)
+        return bool(result)
+
+    async def delete_message(self, webhook_url, message_id, thread_id=None):
+        """
+        Deletes a message previously posted with a webhook.
+
+        Args:
+            webhook_url (str): The webhook the message was posted with.
+            message_id (int): ID of the Discord message.
+            thread_id (int): ID of the thread the message is in, if any.
+
+        Returns:
+            bool: True if the message was deleted or no longer exists, False otherwise.
+        """
+        async def handle_delete_response(response):
+            if response.status in [204, 200, 404]:
+                logger.info('message deleted successfully.')
+                return True
+            response_text = await response.text()
+            logger.error(f'Error deleting message: {response.status} - {response_text}')
+            return False
+
+        params = {'thread_id': thread_id} if thread_id else {}
+        async with self._webhook_lock(webhook_url):
+            result = await self._request('DELETE', f'{webhook_url}/messages/{message_id}',
+                                         lambda: {'params': params}, handle_delete_response)
+        return bool(result)
+
+    @staticmethod
+    def _close_files(files):
+        """Closes the file objects opened for an upload attempt. Streams need no closing."""
+        for file in files:
+            if hasattr(file, 'close'):
+                file.close()
+        files.clear()
+
+    async def _send_avatar(self, payload, webhook_url):
+        """
+        Updates the webhook avatar by sending a PATCH request with avatar data.
 
         Args:
             payload (dict): JSON payload containing the avatar data.
-            session: The aiohttp session used for sending the request.
+            webhook_url (str): The webhook whose avatar is updated.
 
         Returns:
             True if the avatar update is successful (status 200 or 204), False otherwise.
         """
-        try:
-            async with session.patch(self.webhook_url, json=payload) as response:
-                if response.status in [204, 200]:
-                    logger.info('Avatar updated successfully.')
-                    return True
-                else:
-                    response_text = await response.text()
-                    logger.info(f'Error updating avatar:{response.status} - {response_text}')
-                    return False
-        except Exception as e:
-            logger.error(f'An error occurred while updating the avatar: {str(e)}')
+        async def handle_avatar_response(response):
+            if response.status in [204, 200]:
+                logger.info('Avatar updated successfully.')
+                return True
+            response_text = await response.text()
+            logger.info(f'Error updating avatar:{response.status} - {response_text}')
             return False
 
-    @staticmethod
-    async def _handle_response(response):
+        def build_request():
+            self.delivery_stats['bytes_uploaded'] += len(payload.get('avatar') or '')
+            return {'json': payload}
+
+        with default_metrics().timer('avatar_patch'):
+            result = await self._request('PATCH', webhook_url, build_request, handle_avatar_response)
+        if result is None:
+            logger.error('An error occurred while updating the avatar: gave up after retries')
+            return False
+        return result
+
+    async def _request(self, method, url, build_kwargs, handle_response):
+        """
+        Sends a request through the rate-limit scheduler, retrying when Discord asks to.
+
+        Requests are paced using the bucket of the route, so the limit is respected
+        before it is hit. 429 responses are retried after the server-provided
+        `retry_after`; 5xx responses and network errors are retried with jittered
+        exponential backoff.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            build_kwargs: Callable returning fresh keyword arguments for each attempt.
+            handle_response: Coroutine function that consumes a final response.
+
+        Returns:
+            The result of `handle_response`, or None if every attempt failed.
+        """
+        session = await self.get_session()
+        bucket = self._bucket(method, url)
+        for attempt in range(self.max_retries + 1):
+            await self._wait_global_limit()
+            await bucket.acquire()
+            try:
+                async with session.request(method, url, **build_kwargs()) as response:
+                    bucket.update(response.headers)
+                    if response.status == 429:
+                        retry_after = await self._handle_rate_limited(response, bucket)
+                        logger.warning(f'Rate limited on {method} webhook, retrying in {retry_after:.2f}s.')
+                        continue
+                    if response.status >= 500:
+                        delay = self._backoff_delay(attempt)
+                        logger.warning(f'Discord returned {response.status}, retrying in {delay:.2f}s.')
+                    else:
+                        return await handle_response(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self._backoff_delay(attempt)
+                logger.warning(f'Request to Discord failed: {str(e)}, retrying in {delay:.2f}s.')
+            self.delivery_stats['retries'] += 1
+            await asyncio.sleep(delay)
+        return None
+
+    def _bucket(self, method, url):
+        """
+        Returns the rate-limit bucket of a route. Edits and deletions of every message of a
+        webhook share the bucket of `{webhook}/messages`, and buckets left idle are dropped,
+        so the number of buckets stays bounded by the webhooks in use.
+        """
+        route = (method, MESSAGE_ID_PATTERN.sub('/messages', url))
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            for key in [key for key, idle in self._buckets.items() if idle.idle(self.bucket_idle_timeout)]:
+                del self._buckets[key]
+            bucket = self._buckets[route] = RateLimitBucket()
+        return bucket
+
+    async def _handle_rate_limited(self, response, bucket):
+        """
+        Records a 429 response and blocks its bucket, or every bucket for a global limit.
+
+        Args:
+            response: The aiohttp 429 response.
+            bucket (RateLimitBucket): Bucket of the limited route.
+
+        Returns:
+            float: Seconds to wait before retrying.
+        """
+        self.delivery_stats['rate_limited'] += 1
+        self.delivery_stats['retries'] += 1
+        try:
+            body = await response.json(content_type=None)
+        except (ValueError, aiohttp.ClientError):
+            body = {}
+        retry_after = body.get('retry_after') or response.headers.get('Retry-After') or self.retry_base_delay
+        retry_after = float(retry_after)
+        if body.get('global') or response.headers.get('X-RateLimit-Global'):
+            self._global_reset_at = max(self._global_reset_at, time.monotonic() + retry_after)
+        else:
+            bucket.block_for(retry_after)
+        return retry_after
+
+    async def _wait_global_limit(self):
+        """Waits until a global rate limit reported by Discord has expired."""
+        delay = self._global_reset_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _backoff_delay(self, attempt):
+        """Returns the jittered exponential backoff delay for a retry attempt."""
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _webhook_lock(self, webhook_url):
+        """Returns the lock that keeps deliveries to a webhook in submission order."""
+        return self._webhook_locks.setdefault(webhook_url, asyncio.Lock())
+
+    async def _handle_response(self, response, webhook_url=None, posted=None):
         """
         Handles the response status for a webhook message request.
 
@@ -111,14 +496,24 @@ class DiscordService:
 
         Args:
             response: The aiohttp response object from the message request.
+            webhook_url (str): The webhook the message was posted with.
+            posted (list): Receives the (webhook URL, message id) of the posted message, if given.
 
         Returns:
             True if the response status is 200 or 204, indicating success; False otherwise.
         """
         if response.status in [204, 200]:
             logger.info('message sent successfully.')
+            self.delivery_stats['sent'] += 1
+            if posted is not None and response.status == 200:
+                try:
+                    body = await response.json(content_type=None)
+                    posted.append((webhook_url, int(body['id'])))
+                except (ValueError, KeyError, TypeError, aiohttp.ClientError) as e:
+                    logger.warning(f'Posted message id unavailable: {e}')
             return True
         else:
             response_text = await response.text()
             logger.error(f'Error sending message: {response.status} - {response_text}')
+            self.delivery_stats['failed'] += 1
             return False
@@ -0,0 +1,110 @@
+import logging
+
+from telethon import events, utils
+from telethon.tl.types import UpdateUserName, UpdateUser, UpdateChannel, UpdateChat, PeerChannel, PeerChat
+
+from config import ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL
+from models.user import get_username
+from utils.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEntity:
+    """
+    A sender or chat entity with the values derived from it.
+
+    Attributes:
+        entity: The Telegram user, chat or channel.
+        name (str): The display name returned by `get_username`.
+        photo_id (int): ID of the entity's current profile photo, or None.
+    """
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.name = get_username(entity)
+        self.photo_id = getattr(getattr(entity, 'photo', None), 'photo_id', None)
+
+
+class EntityCache:
+    """
+    Caches message senders by peer id, so names and avatars resolve from memory instead
+    of costing a Telegram request (and FloodWait budget) for every message.
+
+    Entities that arrive attached to a message refresh the cache for free; entries expire
+    after a TTL, and are dropped as soon as Telegram reports a name, profile or chat change.
+
+    Attributes:
+        cache (LRUCache): Cached entities keyed by marked peer id.
+        attached (int): Number of senders that came attached to their message.
+    """
+
+    def __init__(self, max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL):
+        self.cache = LRUCache(max_size, ttl)
+        self.attached = 0
+
+    async def get_sender(self, message):
+        """
+        Returns the sender of a message (or event), from memory when possible.
+
+        Args:
+            message: A Telegram message, message event or album event.
+
+        Returns:
+            CachedEntity: The sender, or None if the message has no resolvable sender.
+        """
+        sender_id = getattr(message, 'sender_id', None)
+        attached = getattr(message, 'sender', None)
+        if attached is not None and sender_id is not None:
+            self.attached += 1
+            return self._store(sender_id, attached)
+        if sender_id is not None:
+            cached = self.cache.get(sender_id)
+            if cached is not None:
+                return cached
+        entity = await message.get_sender()
+        if entity is None:
+            return None
+        return self._store(sender_id, entity) if sender_id is not None else CachedEntity(entity)
+
+    def wrap(self, entity):
+        """Returns a CachedEntity for an entity that is already known, e.g. the chat of a message."""
+        return self._store(utils.get_peer_id(entity), entity) if entity is not None else None
+
+    def _store(self, peer_id, entity):
+        cached = CachedEntity(entity)
+        self.cache.set(peer_id, cached)
+        return cached
+
+    def invalidate(self, peer_id):
+        """Drops an entity from the cache, so it is fetched again on its next message."""
+        self.cache.pop(peer_id)
+
+    def register(self, client):
+        """
+        Subscribes the cache to updates that change users and chats.
+
+        Args:
+            client: Telethon client receiving the updates.
+        """
+        client.add_event_handler(self._on_update, events.Raw(types=[UpdateUserName, UpdateUser, UpdateChannel,
+                                                                    UpdateChat]))
+
+    async def _on_update(self, update):
+        if isinstance(update, (UpdateUserName, UpdateUser)):
+            self.invalidate(update.user_id)
+        elif isinstance(update, UpdateChannel):
+            self.invalidate(utils.get_peer_id(PeerChannel(update.channel_id)))
+        elif isinstance(update, UpdateChat):
+            self.invalidate(utils.get_peer_id(PeerChat(update.chat_id)))
+
+    def stats(self):
+        """Returns the hit and miss counters of the cache, and the number of attached senders."""
+        return {**self.cache.stats(), 'attached': self.attached}
+
+    def register_metrics(self, metrics):
+        """Exposes the sender lookups and the size of the cache on a metrics registry."""
+        metrics.register('mirror_entity_cache_lookups_total', 'counter', 'Sender lookups by where they were '
+                         'answered from.', lambda: {'attached': self.attached, 'hit': self.cache.hits,
+                                                     'miss': self.cache.misses}, 'result')
+        metrics.register('mirror_entity_cache_size', 'gauge', 'Cached senders.', lambda: len(self.cache))
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from collections import Counter
+
+from config import (BACKPRESSURE_MAX_MESSAGES, BACKPRESSURE_MAX_BYTES, BACKPRESSURE_MAX_DISK_BYTES,
+                    BACKPRESSURE_MESSAGE_POLICY, BACKPRESSURE_MEDIA_POLICY)
+from utils.size_format import format_size
+from utils.telegram_event import event_messages, primary_message
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+SUMMARY = 'summary'
+PLACEHOLDER = 'placeholder'
+
+# Decisions of `before_prepare`, besides PLACEHOLDER: prepare the message without its media.
+PREPARE = 'prepare'
+SKIP = 'skip'
+
+FALLING_BEHIND = 'Discord is falling behind'
+
+
+class LoadShedder:
+    """
+    Caps what the pipeline holds while Discord falls behind Telegram.
+
+    Messages being prepared or waiting to be sent are counted, along with the bytes of
+    their media held in memory and of their files on disk, media cache files included.
+    The bytes of a message are estimated from the media metadata before anything is
+    downloaded, and corrected once it is prepared. Past a cap, the policies decide:
+
+        - Message policy, on `max_messages`: "block" stops preparing messages, so the ingest
+          queue fills and Telegram handlers wait; "summary" skips the next messages without
+          downloading anything and notes how many were skipped in the next one sent.
+        - Media policy, on `max_bytes` and `max_disk_bytes`: "block" stops preparing messages;
+          "placeholder" sends the text of the message with a note in place of its media,
+          without downloading it.
+
+    The message the send stage of a chat is waiting for is never blocked, so a full
+    reorder buffer always drains.
+
+    Attributes:
+        max_messages (int): Most messages being prepared or waiting to be sent.
+        max_bytes (int): Most bytes of media held in memory by those messages.
+        max_disk_bytes (int): Most bytes of files on disk held by those messages.
+        message_policy (str): "block" or "summary".
+        media_policy (str): "block" or "placeholder".
+        pending (dict): Messages, memory bytes and disk bytes currently held.
+        stats (Counter): Number of each shed decision.
+    """
+
+    def __init__(self, message_handler, max_messages=BACKPRESSURE_MAX_MESSAGES, max_bytes=BACKPRESSURE_MAX_BYTES,
+                 max_disk_bytes=BACKPRESSURE_MAX_DISK_BYTES, message_policy=BACKPRESSURE_MESSAGE_POLICY,
+                 media_policy=BACKPRESSURE_MEDIA_POLICY):
+        if message_policy not in (BLOCK, SUMMARY):
+            raise ValueError(f"Unknown message policy: {message_policy}")
+        if media_policy not in (BLOCK, PLACEHOLDER):
+            raise ValueError(f"Unknown media policy: {media_policy}")
+        self.message_handler = message_handler
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.message_policy = message_policy
+        self.media_policy = media_policy
+        self.pending = {'messages': 0, 'bytes': 0, 'disk_bytes': 0}
+        self.stats = Counter()
+        self._held = {}
+        self._skipped = Counter()
+        self._released = asyncio.Event()
+
+    def _messages_full(self):
+        return self.pending['messages'] >= self.max_messages
+
+    def _media_full(self):
+        return self.pending['bytes'] >= self.max_bytes or self.pending['disk_bytes'] >= self.max_disk_bytes
+
+    def _over_media_caps(self, memory, disk):
+        return (self.pending['bytes'] + memory > self.max_bytes
+                or self.pending['disk_bytes'] + disk > self.max_disk_bytes)
+
+    def _blocked(self):
+        return ((self.message_policy == BLOCK and self._messages_full())
+                or (self.media_policy == BLOCK and self._media_full()))
+
+    async def before_prepare(self, key, event, destinations, awaited):
+        """
+        Decides how a message is prepared, waiting while a "block" cap is reached, and counts
+        it with the estimated size of its media until it is released.
+
+        Args:
+            key (tuple): Ordering key of the message.
+            event: Telegram message or album event.
+            destinations (list): Destination objects the message is routed to, or None.
+            awaited: Callable telling whether the send stage of the key waits for this message.
+
+        Returns:
+            str: "skip" if the message is skipped by the "summary" policy, "placeholder" if it is
+                 prepared without its media, or "prepare".
+        """
+        if self.message_policy == SUMMARY and self._messages_full() and not awaited():
+            self._skipped[key] += 1
+            self.stats['skipped'] += 1
+            logger.warning(f"Skipping message {primary_message(event).id} from chat {key[0]}: "
+                           f"{self.pending['messages']} messages are waiting for Discord")
+            return SKIP
+        if self._blocked() and not awaited():
+            self.stats['blocked'] += 1
+            logger.warning(f"Pausing ingest at message {primary_message(event).id} from chat {key[0]}: "
+                           f"{self.pending['messages']} messages, {format_size(self.pending['bytes'])} in memory "
+                           f"and {format_size(self.pending['disk_bytes'])} on disk are waiting for Discord")
+            while self._blocked() and not awaited():
+                self._released.clear()
+                await self._released.wait()
+
+        media_messages = [message for message in event_messages(event) if message.media]
+        shared = len(destinations or [None]) > 1
+        estimates = [self.message_handler.media_processor.held_bytes(message, shared) for message in media_messages]
+        memory, disk = sum(size[0] for size in estimates), sum(size[1] for size in estimates)
+        decision = PREPARE
+        if self.media_policy == PLACEHOLDER and (memory or disk) and self._over_media_caps(memory, disk):
+            self.stats['media_replaced'] += len(media_messages)
+            logger.warning(f"Replacing {len(media_messages)} media of message {primary_message(event).id} from "
+                           f"chat {key[0]} with a placeholder: {format_size(self.pending['bytes'])} in memory and "
+                           f"{format_size(self.pending['disk_bytes'])} on disk are waiting for Discord")
+            decision = PLACEHOLDER
+            memory = disk = 0
+        self._held[id(event)] = (memory, disk)
+        self.pending['messages'] += 1
+        self.pending['bytes'] += memory
+        self.pending['disk_bytes'] += disk
+        return decision
+
+    @staticmethod
+    def _held_bytes(attachment):
+        """Returns the memory and disk bytes an attachment holds until it is sent."""
+        if attachment.data is not None:
+            return len(attachment.data), 0
+        if attachment.path:
+            return 0, attachment.size or 0
+        return 0, 0
+
+    def admit(self, key, prepared):
+        """
+        Replaces the estimate of a prepared message with what its attachments actually hold.
+        Media whose size was not known in advance is replaced by a note if it exceeds a cap
+        under the "placeholder" policy.
+
+        Args:
+            key (tuple): Ordering key of the message.
+            prepared (PreparedMessage): The message returned by `prepare_message`.
+        """
+        estimate = self._held.get(id(prepared.event))
+        if estimate is None:
+            return
+        held = [self._held_bytes(attachment) for attachment in prepared.attachments]
+        memory, disk = sum(size[0] for size in held), sum(size[1] for size in held)
+        self.pending['bytes'] -= estimate[0]
+        self.pending['disk_bytes'] -= estimate[1]
+        if (self.media_policy == PLACEHOLDER and (memory > estimate[0] or disk > estimate[1])
+                and self._over_media_caps(memory, disk)):
+            self._replace_media(key, prepared)
+            memory = disk = 0
+        self._held[id(prepared.event)] = (memory, disk)
+        self.pending['bytes'] += memory
+        self.pending['disk_bytes'] += disk
+
+    def _replace_media(self, key, prepared):
+        """Drops the downloaded media of a message, releasing its files, and notes it in the content."""
+        notes = [f"[{attachment.filename} ({format_size(attachment.size or 0)}) not mirrored: {FALLING_BEHIND}]"
+                 for attachment in prepared.attachments]
+        self.message_handler.discard_prepared_message(prepared)
+        prepared.attachments.clear()
+        for note in notes:
+            prepared.add_note(note, prepared.destinations)
+        self.stats['media_replaced'] += len(notes)
+        logger.warning(f"Replacing {len(notes)} media of message {primary_message(prepared.event).id} from chat "
+                       f"{key[0]} with a placeholder: {format_size(self.pending['bytes'])} in memory and "
+                       f"{format_size(self.pending['disk_bytes'])} on disk are waiting for Discord")
+
+    def before_send(self, key, prepared):
+        """Notes in a message how many messages of its chat were skipped before it."""
+        skipped = self._skipped.pop(key, 0)
+        if skipped:
+            note = f"[{skipped} message(s) skipped: {FALLING_BEHIND}]"
+            content = prepared.content.content
+            prepared.content.set_content(f"{note}\n{content}" if content else note)
+            self.stats['summaries'] += 1
+
+    def release(self, event):
+        """
+        Stops counting a message once the send stage is done with it, and wakes the
+        blocked workers, as the message their chat waits for may have changed.
+
+        Args:
+            event: Event of the message sent or discarded, whether or not it was prepared.
+        """
+        held = self._held.pop(id(event), None)
+        if held is not None:
+            self.pending['messages'] -= 1
+            self.pending['bytes'] -= held[0]
+            self.pending['disk_bytes'] -= held[1]
+        self._released.set()
+
+    def register_metrics(self, metrics):
+        """Exposes the held amounts and the shed decisions on a metrics registry."""
+        metrics.register('mirror_backpressure_pending', 'gauge', 'Messages, memory bytes and disk bytes '
+                         'waiting for Discord.', lambda: dict(self.pending), 'kind')
+        metrics.register('mirror_backpressure_decisions_total', 'counter', 'Load shedding decisions.',
+                         lambda: dict(self.stats), 'decision')
@@ -0,0 +1,122 @@
+import fnmatch
+import logging
+from collections import Counter
+
+from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto, DocumentAttributeFilename
+
+from config import MEDIA_RULES, DISCORD_MAX_UPLOAD_SIZE
+from utils.size_format import format_size
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD = 'download'
+DOWNSCALE = 'downscale'
+THUMBNAIL = 'thumbnail'
+STUB = 'stub'
+ACTIONS = (DOWNLOAD, DOWNSCALE, THUMBNAIL, STUB)
+
+
+class MediaRule:
+    """
+    What to do with media of some mime types once they exceed a size.
+
+    Attributes:
+        mime (str): Mime type pattern, e.g. "video/*".
+        action (str): "download", "downscale", "thumbnail" or "stub".
+        max_size (int): Size above which the action applies, in bytes; None for the upload
+                        limit of the destination, 0 to always apply it.
+    """
+
+    def __init__(self, mime='*', action=STUB, max_size=None):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown media action: {action}")
+        self.mime = mime
+        self.action = action
+        self.max_size = max_size
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('mime', '*'), data.get('action', STUB), data.get('max_size'))
+
+    def matches(self, mime_type):
+        return fnmatch.fnmatch(mime_type, self.mime)
+
+
+class MediaPolicy:
+    """
+    Decides how a media reaches a destination from its metadata, before it is downloaded.
+
+    The first rule matching the mime type of the media applies: if the media is larger
+    than the rule's `max_size`, or than the upload limit of the destination, the rule's
+    action is used, otherwise the media is downloaded as is. Media matched by no rule is
+    downloaded if it fits and replaced by a stub otherwise. Only images can be
+    downscaled; other media get a thumbnail instead.
+
+    Attributes:
+        rules (list): MediaRule objects, tried in order.
+        max_upload_size (int): Upload limit of destinations that do not set their own.
+        stats (Counter): Number of decisions per action.
+    """
+
+    def __init__(self, rules=MEDIA_RULES, max_upload_size=DISCORD_MAX_UPLOAD_SIZE):
+        self.rules = [rule if isinstance(rule, MediaRule) else MediaRule.from_dict(rule) for rule in rules]
+        self.max_upload_size = max_upload_size
+        self.stats = Counter()
+
+    @staticmethod
+    def media_size(media):
+        """Returns the size in bytes of a document or of the largest size of a photo, or None if unknown."""
+        if isinstance(media, MessageMediaDocument):
+            return getattr(media.document, 'size', None)
+        if isinstance(media, MessageMediaPhoto) and getattr(media.photo, 'sizes', None):
+            sizes = []
+            for size in media.photo.sizes:
+                if getattr(size, 'sizes', None):
+                    sizes.append(max(size.sizes))
+                elif getattr(size, 'size', None):
+                    sizes.append(size.size)
+                elif getattr(size, 'bytes', None):
+                    sizes.append(len(size.bytes))
+            return max(sizes) if sizes else None
+        return None
+
+    def upload_limit(self, destination):
+        return getattr(destination, 'max_upload_size', None) or self.max_upload_size
+
+    def decide(self, media, mime_type, destination):
+        """
+        Chooses how a media is sent to a destination.
+
+        Args:
+            media: The message media.
+            mime_type (str): Mime type of the media.
+            destination (Destination): Where the media is sent, or None for the default webhook.
+
+        Returns:
+            str: "download", "downscale", "thumbnail" or "stub".
+        """
+        size = self.media_size(media)
+        limit = self.upload_limit(destination)
+        action = DOWNLOAD
+        if size is not None:
+            rule = next((rule for rule in self.rules if rule.matches(mime_type)), None)
+            max_size = limit if rule is None or rule.max_size is None else min(rule.max_size, limit)
+            if size > max_size:
+                action = rule.action if rule else STUB
+        if action == DOWNSCALE and not mime_type.startswith('image/'):
+            action = THUMBNAIL
+        self.stats[action] += 1
+        if action != DOWNLOAD:
+            logger.info(f"Media of {format_size(size)} ({mime_type}) over the limit of "
+                        f"{format_size(limit)}: {action}")
+        return action
+
+    @staticmethod
+    def describe(media, mime_type):
+        """Returns the file name, or the mime type, and the size of a media, for stubs."""
+        name = mime_type
+        for attribute in getattr(getattr(media, 'document', None), 'attributes', None) or []:
+            if isinstance(attribute, DocumentAttributeFilename):
+                name = attribute.file_name
+        size = MediaPolicy.media_size(media)
+        return f"{name} ({format_size(size)})" if size is not None else name
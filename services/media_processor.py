@@ -1,9 +1,19 @@
+import asyncio
 import logging
 import mimetypes
+import os
 
 from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto
 
-from config import SAVE_FOLDER
+from config import (SAVE_FOLDER, MEDIA_MODE, MEDIA_SPOOL_THRESHOLD, MEDIA_STREAM_CHUNK_SIZE, MEDIA_DOWNSCALE_MAX_SIDE,
+                    IMAGE_REENCODE_ENABLED, IMAGE_REENCODE_THRESHOLD, IMAGE_ATTACHMENT_FORMATS,
+                    IMAGE_REENCODE_MIN_SAVING)
+from models.attachment import Attachment
+from services.media_policy import MediaPolicy, DOWNLOAD, DOWNSCALE, THUMBNAIL
+from utils.image_downscale import downscale_image
+from utils.image_encoder import encode_image, EXTENSIONS
+from utils.media_cache import file_digest
+from utils.processing_pool import default_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,11 +26,64 @@ class MediaProcessor:
     Attributes:
         save_folder (str): Directory path where media files are saved.
         file_manager: Utility for generating filenames and managing file operations.
+        mode (str): "disk" to download media to `save_folder`, "stream" to keep small
+                    files in memory and stream larger ones straight to Discord.
+        spool_threshold (int): Largest file size, in bytes, kept in memory in stream mode.
+        chunk_size (int): Size of the chunks requested from Telegram when streaming.
+        media_cache (MediaCache): Cache of downloaded photos and documents, or None.
+        downloader (ParallelDownloader): Downloads large documents over several connections, or None.
+        policy (MediaPolicy): Decides from metadata how media reaches each destination, or None
+                              to download everything as is.
+        reencode_threshold (int): Size above which photos are re-encoded in a smaller format,
+                                  or None to send them as downloaded.
+        encode_stats (dict): Number of photos re-encoded and bytes saved.
     """
 
-    def __init__(self, file_manager):
+    def __init__(self, file_manager, mode=MEDIA_MODE, spool_threshold=MEDIA_SPOOL_THRESHOLD,
+                 chunk_size=MEDIA_STREAM_CHUNK_SIZE, media_cache=None, downloader=None,
+                 policy=None, reencode_threshold=IMAGE_REENCODE_THRESHOLD if IMAGE_REENCODE_ENABLED else None):
         self.save_folder = SAVE_FOLDER
         self.file_manager = file_manager
+        self.mode = mode
+        self.spool_threshold = spool_threshold
+        self.chunk_size = chunk_size
+        self.media_cache = media_cache
+        self.downloader = downloader
+        self.policy = policy
+        self.reencode_threshold = reencode_threshold
+        self.encode_stats = {'images': 0, 'bytes_saved': 0}
+        self._cache_downloads = {}
+
+    def register_metrics(self, metrics):
+        """Exposes the counters of the media cache, the parallel downloader and photo re-encoding."""
+        if self.media_cache:
+            self.media_cache.register_metrics(metrics)
+        if self.downloader:
+            self.downloader.register_metrics(metrics)
+        metrics.register('mirror_photo_encoding_bytes_saved_total', 'counter', 'Bytes saved by re-encoding '
+                         'photos.', lambda: self.encode_stats['bytes_saved'])
+
+    @staticmethod
+    def _media_info(message):
+        """
+        Determines the mime type and file extension of the media of a message.
+
+        Args:
+            message: Telegram message containing media.
+
+        Returns:
+            tuple: (mime type, extension, filename prefix), or None if the media type is unsupported.
+        """
+        if isinstance(message.media, MessageMediaDocument):
+            mime_type = message.media.document.mime_type
+        elif isinstance(message.media, MessageMediaPhoto):
+            mime_type = 'image/jpeg'
+        else:
+            logger.warning(f"Unsupported media type: {type(message.media).__name__}")
+            return None
+        extension = mimetypes.guess_extension(mime_type) or '.bin'
+        prefix = f"{'doc_img' if isinstance(message.media, MessageMediaPhoto) else 'doc_file'}_"
+        return mime_type, extension, prefix
 
     async def process_media(self, client, event):
         """
@@ -36,15 +99,263 @@ class MediaProcessor:
         Returns:
             str: Path to the saved media file, or None if media type is unsupported.
         """
-        if isinstance(event.message.media, MessageMediaDocument):
-            mime_type = event.message.media.document.mime_type
-        elif isinstance(event.message.media, MessageMediaPhoto):
-            mime_type = 'image/jpeg'
-        else:
-            logger.warning(f"Unsupported media type: {type(event.message.media).__name__}")
+        return await self._download_to_disk(client, event.message)
+
+    async def _download_to_disk(self, client, message):
+        """Downloads the media of a message to a generated filename and returns its path."""
+        media_info = self._media_info(message)
+        if not media_info:
             return None
-        extension = mimetypes.guess_extension(mime_type) or '.bin'
-        media_path = self.file_manager.generate_filename(
-            f"{'doc_img' if isinstance(event.message.media, MessageMediaPhoto) else 'doc_file'}_", extension)
-        await client.download_media(event.message, file=media_path)
+        _, extension, prefix = media_info
+        media_path = self.file_manager.generate_filename(prefix, extension)
+        await self._download(client, message, media_path)
+        new_extension = await self._reencode_file(media_path) if isinstance(message.media, MessageMediaPhoto) else None
+        if new_extension and new_extension != extension:
+            new_path = f"{os.path.splitext(media_path)[0]}{new_extension}"
+            os.replace(media_path, new_path)
+            media_path = new_path
         return media_path
+
+    async def _download(self, client, message, file):
+        """Downloads the media of a message, in parallel parts if it is a large document."""
+        if self.downloader is not None and self.downloader.accepts(message.media):
+            return await self.downloader.download(client, message, file)
+        return await client.download_media(message, file=file)
+
+    def plan(self, message, destination):
+        """
+        Chooses, before downloading anything, how the media of a message is sent to a destination.
+
+        Args:
+            message: Telegram message containing media.
+            destination (Destination): Where the media is sent, or None for the default webhook.
+
+        Returns:
+            str: "download", "downscale", "thumbnail" or "stub".
+        """
+        media_info = self._media_info(message)
+        if self.policy is None or not media_info:
+            return DOWNLOAD
+        return self.policy.decide(message.media, media_info[0], destination)
+
+    def stub_text(self, message, action, reason='over the upload limit'):
+        """Returns the note sent with a thumbnail, or in place of a media that is not sent."""
+        media_info = self._media_info(message)
+        description = MediaPolicy.describe(message.media, media_info[0]) if media_info else 'media'
+        if action == THUMBNAIL:
+            return f"[{description}: preview only, {reason}]"
+        return f"[{description} not mirrored: {reason}]"
+
+    def held_bytes(self, message, shared=False):
+        """
+        Estimates from its metadata, before downloading it, what the media of a message
+        holds until it is sent, following the same choices as `get_attachment`.
+
+        Args:
+            message: Telegram message containing media.
+            shared (bool): Whether the attachment will be uploaded to several destinations.
+
+        Returns:
+            tuple: (bytes in memory, bytes on disk); media of unknown size counts as 0.
+        """
+        if not self._media_info(message):
+            return 0, 0
+        media = message.media
+        size = MediaPolicy.media_size(media)
+        if not size:
+            return 0, 0
+        if self._cache_key(media) and size <= self.media_cache.max_bytes:
+            return 0, size
+        if isinstance(media, MessageMediaDocument) and size > self.spool_threshold:
+            return (0, size) if self.mode != 'stream' or shared else (0, 0)
+        return (size, 0) if self.mode == 'stream' else (0, size)
+
+    async def get_attachment(self, client, message, shared=False, action=DOWNLOAD, destination=None):
+        """
+        Builds the Discord attachment for the media of a message, according to the media mode.
+
+        In stream mode photos and documents up to `spool_threshold` are downloaded into
+        memory, and larger documents are streamed from Telegram while they are uploaded.
+        Disk mode, and documents of unknown size, are downloaded to `save_folder`.
+        With a media cache, photos and documents that fit in it are served from it, so
+        a file forwarded again is not downloaded again, whatever the destination. The cache
+        takes precedence over the mode: cached media is written to disk even in stream mode.
+        Cached attachments stay pinned in the cache until passed to `release_cached`.
+
+        A streamed attachment is downloaded again on every upload, so attachments
+        `shared` by several destinations are never streamed: large documents are
+        downloaded once to disk instead.
+
+        Media that `plan` does not send as is gets a downscaled copy or its thumbnail instead,
+        or no attachment at all for a stub.
+
+        Args:
+            client: Telethon client used for media download.
+            message: Telegram message containing media.
+            shared (bool): Whether the attachment will be uploaded to several destinations.
+            action (str): The decision of `plan` for the destinations of the attachment.
+            destination (Destination): One of those destinations, whose upload limit a
+                                       downscaled image must fit in.
+
+        Returns:
+            Attachment: The attachment to upload, or None if media type is unsupported or no
+                        attachment is sent.
+        """
+        media_info = self._media_info(message)
+        if not media_info:
+            return None
+        if action == DOWNSCALE:
+            return await self._get_downscaled(client, message, destination)
+        if action == THUMBNAIL:
+            return await self._get_thumbnail(client, message)
+        if action != DOWNLOAD:
+            return None
+        _, extension, prefix = media_info
+        media = message.media
+        source = (message.chat_id, message.id)
+        size = getattr(getattr(media, 'document', None), 'size', None)
+        key = self._cache_key(media)
+        if key and (size is None or size <= self.media_cache.max_bytes):
+            path = await self._get_cached(client, message, key, extension)
+            return Attachment.from_path(path, source, cached=True) if path else None
+        too_large = isinstance(media, MessageMediaDocument) and (size is None or size > self.spool_threshold)
+        if self.mode != 'stream' or (too_large and (shared or size is None)):
+            media_path = await self._download_to_disk(client, message)
+            return Attachment.from_path(media_path, source) if media_path else None
+
+        if not too_large:
+            data = await self._download(client, message, bytes)
+            if isinstance(media, MessageMediaPhoto):
+                data, extension = await self._reencode(data, len(data)) or (data, extension)
+            filename = os.path.basename(self.file_manager.generate_filename(prefix, extension))
+            return Attachment(filename, data=data, source=source)
+        filename = os.path.basename(self.file_manager.generate_filename(prefix, extension))
+        return Attachment(filename, stream_factory=lambda: self._iter_media(client, media), size=size, source=source)
+
+    async def _get_downscaled(self, client, message, destination):
+        """Downloads an image into memory and re-encodes it to fit in the upload limit of a destination."""
+        data = await self._download(client, message, bytes)
+        jpeg = await default_pool().run(downscale_image, data, self.policy.upload_limit(destination),
+                                        MEDIA_DOWNSCALE_MAX_SIDE) if data else None
+        if not jpeg:
+            return None
+        filename = os.path.basename(self.file_manager.generate_filename('doc_img_', '.jpg'))
+        return Attachment(filename, data=jpeg, source=(message.chat_id, message.id))
+
+    async def _get_thumbnail(self, client, message):
+        """Downloads the largest thumbnail Telegram keeps for a media, or returns None if it has none."""
+        document = getattr(message.media, 'document', None)
+        if document is not None and not getattr(document, 'thumbs', None):
+            return None
+        data = await client.download_media(message, file=bytes, thumb=-1)
+        if not data:
+            return None
+        filename = os.path.basename(self.file_manager.generate_filename('thumb_', '.jpg'))
+        return Attachment(filename, data=data, source=(message.chat_id, message.id))
+
+    async def _reencode(self, source, size):
+        """
+        Re-encodes a photo larger than `reencode_threshold` in the smallest attachment format.
+
+        Args:
+            source: Path of the photo, or its content as bytes.
+            size (int): Size of the photo, in bytes.
+
+        Returns:
+            tuple: (encoded photo, extension), or None if it is not worth it.
+        """
+        if self.reencode_threshold is None or size <= self.reencode_threshold:
+            return None
+        try:
+            data, image_format, _ = await default_pool().run(encode_image, source, IMAGE_ATTACHMENT_FORMATS)
+        except Exception as e:
+            logger.warning(f"Error re-encoding a photo: {e}")
+            return None
+        if len(data) > size * (1 - IMAGE_REENCODE_MIN_SAVING):
+            return None
+        self.encode_stats['images'] += 1
+        self.encode_stats['bytes_saved'] += size - len(data)
+        return data, EXTENSIONS[image_format]
+
+    async def _reencode_file(self, path):
+        """
+        Re-encodes a photo on disk in place, see `_reencode`.
+
+        Returns:
+            str: Extension of the new format, or None if the file was left unchanged.
+        """
+        reencoded = await self._reencode(path, os.path.getsize(path))
+        if reencoded is None:
+            return None
+        data, extension = reencoded
+        with open(path, 'wb') as file:
+            file.write(data)
+        return extension
+
+    def _cache_key(self, media):
+        """Returns the media cache key of a photo or document, or None if it is not cached."""
+        if self.media_cache is None:
+            return None
+        if isinstance(media, MessageMediaDocument) and getattr(media.document, 'id', None):
+            return 'doc', media.document.id
+        if isinstance(media, MessageMediaPhoto) and getattr(media.photo, 'id', None):
+            return 'photo', media.photo.id
+        return None
+
+    async def _get_cached(self, client, message, key, extension):
+        """
+        Returns the path of a media in the cache, downloading it on a miss. Concurrent
+        requests for the same media share a single download.
+
+        The media is pinned in the cache, before it is even downloaded, so it cannot be
+        evicted before it has been sent; the caller unpins it with `release_cached`.
+        """
+        self.media_cache.pin(key)
+        try:
+            path = self.media_cache.get(key)
+            if not path:
+                download = self._cache_downloads.get(key)
+                if download is None:
+                    download = self._cache_downloads[key] = asyncio.ensure_future(
+                        self._download_to_cache(client, message, key, extension))
+                    download.add_done_callback(lambda _: self._cache_downloads.pop(key, None))
+                path = await asyncio.shield(download)
+        except BaseException:
+            self.media_cache.unpin(key)
+            raise
+        if not path:
+            self.media_cache.unpin(key)
+        return path
+
+    def release_cached(self, attachment):
+        """Unpins the media cache file of an attachment once it is no longer needed."""
+        if attachment.cached and self.media_cache:
+            self.media_cache.unpin(attachment.path)
+
+    async def _download_to_cache(self, client, message, key, extension):
+        temp_path = self.media_cache.temp_path(key)
+        try:
+            if not await self._download(client, message, temp_path):
+                return None
+            if key[0] == 'photo':
+                extension = await self._reencode_file(temp_path) or extension
+            digest = await default_pool().run(file_digest, temp_path) if self.media_cache.use_hash else None
+            return self.media_cache.add(key, temp_path, extension, digest)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    async def _iter_media(self, client, media):
+        """
+        Streams the content of a media from Telegram in chunks.
+
+        Args:
+            client: Telethon client used for media download.
+            media: The message media to stream.
+
+        Yields:
+            bytes: Consecutive chunks of the file.
+        """
+        async for chunk in client.iter_download(media, request_size=self.chunk_size):
+            yield chunk
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from config import COALESCE_WINDOW, DISCORD_MAX_CONTENT_LENGTH
+from utils.telegram_event import primary_message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCoalescer:
+    """
+    Merges bursts of short text messages into a single Discord post.
+
+    A text-only message is held for up to `window` seconds; consecutive text-only
+    messages of the same sender to the same destinations that arrive meanwhile are
+    appended to it, one per line, as long as the post stays within Discord's content
+    limit. Any other message, e.g. with media or a reply, sends the held message first.
+
+    Merged posts are not recorded in the message map: an edit of one of their messages
+    would otherwise replace the text of all of them.
+
+    Whether a message was delivered is only known once the post it is part of has been
+    sent, so it is reported through the `on_sent` callback given to `send`, for every
+    message of the post.
+
+    Attributes:
+        message_handler: Sends prepared messages.
+        discord_service: Service handling the delivery of messages to Discord.
+        window (float): Seconds a message waits for more messages to merge.
+        max_length (int): Maximum content length of a merged post.
+        stats (dict): Number of messages merged into another one and of posts sent.
+    """
+
+    def __init__(self, message_handler, discord_service, window=COALESCE_WINDOW,
+                 max_length=DISCORD_MAX_CONTENT_LENGTH):
+        self.message_handler = message_handler
+        self.discord_service = discord_service
+        self.window = window
+        self.max_length = max_length
+        self.stats = {'merged': 0, 'posts': 0}
+        self._pending = {}
+        self._callbacks = {}
+        self._timers = {}
+        self._locks = {}
+
+    @staticmethod
+    def _mergeable(prepared):
+        """Whether a message is text only: no media, media notes, embeds (replies) or reply."""
+        return (not prepared.attachments and not prepared.notes and not prepared.content.embeds
+                and prepared.content.content
+                and not primary_message(prepared.event).reply_to_msg_id)
+
+    def _can_merge(self, pending, prepared):
+        first, message = primary_message(pending.event), primary_message(prepared.event)
+        return (first.sender_id == message.sender_id and pending.destinations == prepared.destinations
+                and len(pending.content.content) + 1 + len(prepared.content.content) <= self.max_length)
+
+    async def send(self, key, prepared, on_sent=None):
+        """
+        Sends a prepared message, or holds it to merge the messages that follow it.
+
+        Args:
+            key (tuple): Ordering key of the message; messages are only merged within a key.
+            prepared (PreparedMessage): The message returned by `prepare_message`.
+            on_sent: Optional callback called with the event of the message and whether it
+                     was delivered, once the post it is part of has been sent.
+        """
+        pending = self._pending.get(key)
+        if pending is not None and self._mergeable(prepared) and self._can_merge(pending, prepared):
+            pending.content.set_content(f"{pending.content.content}\n{prepared.content.content}")
+            pending.merged_events.append(prepared.event)
+            self._callbacks[key].append((prepared.event, on_sent))
+            self.message_handler.discard_prepared_message(prepared)
+            self.stats['merged'] += 1
+            return
+
+        await self._flush(key)
+        if self._mergeable(prepared):
+            self._pending[key] = prepared
+            self._callbacks[key] = [(prepared.event, on_sent)]
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+            return
+        async with self._lock(key):
+            delivered = await self._send(key, prepared)
+        self._report([(prepared.event, on_sent)], delivered)
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        self._timers.pop(key, None)
+        await self._flush(key)
+
+    async def _flush(self, key):
+        """Sends the message held for a key, if any, and reports the result for each message merged into it."""
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        callbacks = self._callbacks.pop(key)
+        async with self._lock(key):
+            delivered = await self._send(key, pending)
+        self._report(callbacks, delivered)
+
+    async def _send(self, key, prepared):
+        """Sends a post, returning whether it was delivered."""
+        self.stats['posts'] += 1
+        try:
+            return await self.message_handler.send_prepared_message(self.discord_service, prepared)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message {primary_message(prepared.event).id} from chat {key[0]}: {e}")
+            return False
+
+    @staticmethod
+    def _report(callbacks, delivered):
+        for event, on_sent in callbacks:
+            if on_sent:
+                on_sent(event, delivered)
+
+    def _lock(self, key):
+        """Returns the lock that keeps the posts of a key in order while a held message is sent."""
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def flush(self):
+        """Sends every held message right away."""
+        await asyncio.gather(*[self._flush(key) for key in list(self._pending)])
@@ -1,10 +1,15 @@
-import os
-
-import aiohttp
+import asyncio
+import copy
 
 from models.content import Content
 from models.embed import Embed
+from models.prepared_message import PreparedMessage
 from models.user import get_username
+from services.entity_cache import EntityCache
+from services.media_policy import DOWNLOAD, DOWNSCALE, THUMBNAIL, STUB
+from services.recent_messages import RecentMessages
+from utils.metrics import default_metrics
+from utils.telegram_event import event_messages, primary_message
 
 
 class MessageHandler:
@@ -15,68 +20,242 @@ class MessageHandler:
     Attributes:
         media_processor: Processes and saves media content from messages.
         user_service: Retrieves additional user information such as profile image.
+        outbox: Durable outbox deliveries go through, or None to send directly.
+        entity_cache (EntityCache): Resolves senders from memory instead of Telegram requests.
+        recent_messages (RecentMessages): Recently seen messages, used to build reply embeds.
+        message_map (MessageMap): Records the Discord messages of each Telegram message, or None.
     """
 
-    def __init__(self, media_processor, user_service):
+    def __init__(self, media_processor, user_service, outbox=None, entity_cache=None, recent_messages=None,
+                 message_map=None):
         self.media_processor = media_processor
         self.user_service = user_service
+        self.outbox = outbox
+        self.entity_cache = entity_cache or EntityCache()
+        self.recent_messages = recent_messages or RecentMessages()
+        self.message_map = message_map
+
+    def register_metrics(self, metrics):
+        """Exposes the counters of the caches and services used to prepare messages on a metrics registry."""
+        self.entity_cache.register_metrics(metrics)
+        self.recent_messages.register_metrics(metrics)
+        self.user_service.register_metrics(metrics)
+        self.media_processor.register_metrics(metrics)
 
     async def handle_new_message(self, discord_service, client, event):
         """
         Processes and formats a new Telegram message for Discord, adding text, media,
-        user profile image, and reply details.
+        user profile image, and reply details, then sends it.
 
         Args:
             discord_service: Service handling message sending to Discord.
             client: Telethon client for accessing Telegram message details.
             event: Telegram message event containing the message content and media.
         """
-        message_text = event.message.message
-        user = await event.get_sender() or event.chat
-        user_name = get_username(user)
+        prepared = await self.prepare_message(client, event)
+        await self.send_prepared_message(discord_service, prepared)
+
+    async def prepare_message(self, client, event, destinations=None, skip_media_reason=None):
+        """
+        Fetches everything a message needs from Telegram (sender, avatar, media, reply)
+        and formats it for Discord, without sending it.
+
+        An album is prepared as a single message: its media are downloaded concurrently
+        and become the attachments of one post, with the captions as content.
 
-        document_path = None
-        files = {}
-        form_data = aiohttp.FormData()
+        Args:
+            client: Telethon client for accessing Telegram message details.
+            event: Telegram message or album event containing the message content and media.
+            destinations (list): Destination objects the message is routed to, or None
+                                 for the default webhook of the Discord service.
+            skip_media_reason (str): If given, media is not downloaded, and a note with this
+                                     reason is sent in its place.
+
+        Returns:
+            PreparedMessage: The formatted message, ready for `send_prepared_message`.
+        """
+        metrics = default_metrics()
+        messages = event_messages(event)
+        message = primary_message(event)
+        message_text = "\n".join(m.message for m in messages if m.message)
+        sender, user_name = await self._resolve_sender(event, event.chat)
         embed = Embed('*reply*:')
+        for m in messages:
+            self._remember(event.chat_id, m, user_name)
+
+        with metrics.timer('get_user_image_data'):
+            user_image_data_url = await self.user_service.get_user_image_data(client, sender, event)
+        content = Content(user_name, getattr(message, 'sender_id', None) or event.chat_id)
+        prepared = PreparedMessage(event, user_name, user_image_data_url, content, destinations)
+
+        try:
+            media_messages = [m for m in messages if m.media]
+            if media_messages and skip_media_reason:
+                for m in media_messages:
+                    prepared.add_note(self.media_processor.stub_text(m, STUB, skip_media_reason),
+                                      prepared.destinations)
+            elif media_messages:
+                with metrics.timer('process_media'):
+                    await self._add_attachments(client, prepared, media_messages)
+            if message_text:
+                prepared.content.set_content(message_text)
+            if message.reply_to_msg_id:
+                with metrics.timer('reply_fetch'):
+                    await self._handle_reply(prepared.content, embed, event, message.reply_to_msg_id)
+        except Exception:
+            self.discard_prepared_message(prepared)
+            raise
+        return prepared
+
+    async def _add_attachments(self, client, prepared, messages):
+        """
+        Downloads the media of the given messages concurrently and adds them to a prepared message.
+
+        How each media reaches each destination is planned from its metadata first, so media
+        over a destination's upload limit is downscaled, replaced by its thumbnail or by a
+        note, without downloading the original. Each variant is fetched once for all the
+        destinations that get it; a downscaled copy fits one upload limit, so it is only
+        shared by destinations with the same limit.
+
+        Args:
+            client: Telethon client used for media download.
+            prepared (PreparedMessage): The message the attachments are added to.
+            messages (list): Telegram messages containing media.
+
+        Raises:
+            Exception: The first download error, after the successful downloads were added,
+                       so their temporary files are cleaned up with the message.
+        """
+        variants = []
+        for message in messages:
+            plans = {}
+            for destination in prepared.destinations:
+                action = self.media_processor.plan(message, destination)
+                limit = self.media_processor.policy.upload_limit(destination) if action == DOWNSCALE else None
+                plans.setdefault((action, limit), []).append(destination)
+            for (action, _), destinations in plans.items():
+                variants.append((message, action, destinations))
+        results = await asyncio.gather(
+            *[self.media_processor.get_attachment(client, message, shared=len(destinations) > 1, action=action,
+                                                  destination=destinations[0])
+              for message, action, destinations in variants],
+            return_exceptions=True)
+        for (message, action, destinations), result in zip(variants, results):
+            if isinstance(result, BaseException):
+                continue
+            if result:
+                partial = destinations if len(destinations) < len(prepared.destinations) else None
+                prepared.add_attachment(result, temp=not result.cached, destinations=partial)
+            if action == THUMBNAIL and result:
+                prepared.add_note(self.media_processor.stub_text(message, THUMBNAIL), destinations)
+            elif action != DOWNLOAD and not result:
+                prepared.add_note(self.media_processor.stub_text(message, STUB), destinations)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+    async def send_prepared_message(self, discord_service, prepared):
+        """
+        Sends a prepared message to each of its destinations and deletes its temporary files.
 
-        user_image_data_url = await self.user_service.get_user_image_data(client, user, event)
-        form_data_message = Content(user_name)
+        Every destination reuses the same downloaded media.
 
-        if event.message.media:
-            document_path = await self.media_processor.process_media(client, event)
-        if message_text:
-            form_data_message.set_content(message_text)
-        if event.message.reply_to_msg_id:
-            await self._handle_reply(form_data_message, embed, event)
-        if document_path:
-            files['file'] = self.media_processor.file_manager.open_file_safely(document_path, event)
-            form_data.add_field('files', files['file'], filename=os.path.basename(document_path))
+        Args:
+            discord_service: Service handling message sending to Discord.
+            prepared (PreparedMessage): The message returned by `prepare_message`.
 
-        discord_service.update_webhook_avatar(user_name, user_image_data_url, form_data_message)
+        Returns:
+            bool: True if the message was delivered to every destination, False otherwise.
+        """
         try:
-            await discord_service.send_message(form_data_message, form_data)
+            results = await asyncio.gather(
+                *[self._send_to_destination(discord_service, prepared, destination)
+                  for destination in prepared.destinations])
+            return all(results)
         finally:
-            self.media_processor.file_manager.close_file_safely(files, document_path, event)
+            self.discard_prepared_message(prepared)
+
+    async def _send_to_destination(self, discord_service, prepared, destination):
+        """
+        Sends a prepared message to one destination with the sender's avatar, through the outbox if any,
+        and records the posted Discord messages in the message map.
+        """
+        content = copy.copy(prepared.content)
+        content.set_notes(prepared.notes_for(destination))
+        attachments = prepared.attachments_for(destination)
+        discord_service.update_webhook_avatar(prepared.user_name, prepared.user_image_data_url, content)
+        message = primary_message(prepared.event)
+        posted = [] if self.message_map else None
+        if self.outbox:
+            delivered = await self.outbox.deliver(discord_service, message.chat_id, message.id, content,
+                                                  attachments, destination, posted)
+        else:
+            delivered = await discord_service.send_message(content, attachments, destination, posted)
+        if posted and not prepared.merged_events:
+            thread_id = destination.thread_id if destination else None
+            self.message_map.add(message.chat_id, message.id, thread_id, posted, content.notes)
+        return delivered
+
+    def discard_prepared_message(self, prepared):
+        """
+        Deletes the temporary files of a prepared message and releases its media cache files.
+
+        Args:
+            prepared (PreparedMessage): The message whose files are no longer needed.
+        """
+        for path in prepared.temp_paths:
+            self.media_processor.file_manager.delete_file(path, prepared.event)
+        prepared.temp_paths.clear()
+        for attachment in prepared.cached_attachments:
+            self.media_processor.release_cached(attachment)
+        prepared.cached_attachments.clear()
+
+    async def _resolve_sender(self, message, fallback_chat):
+        """
+        Resolves the sender of a message and its display name through the entity cache.
+
+        Args:
+            message: Telegram message or event.
+            fallback_chat: Chat used as the sender when the message has none, e.g. channel posts.
 
-    @staticmethod
-    async def _handle_reply(form_data_message, embed, event):
+        Returns:
+            tuple: (CachedEntity of the sender or None, display name).
+        """
+        with default_metrics().timer('get_sender'):
+            sender = await self.entity_cache.get_sender(message) or self.entity_cache.wrap(fallback_chat)
+        if sender is None:
+            return None, get_username(None)
+        return sender, sender.name
+
+    def _remember(self, chat_id, message, sender_name):
+        """Adds a message to the recent messages index and returns its entry."""
+        mime_type = message.file.mime_type if message.file else None
+        return self.recent_messages.remember(chat_id, message.id, message.message or "", sender_name, mime_type)
+
+    async def _handle_reply(self, form_data_message, embed, event, reply_to_msg_id):
         """
         Adds reply information to the message, including reply text, user, and media details.
 
+        The replied message is looked up in the recent messages index first, and only
+        fetched from Telegram when it is not there.
+
         Args:
             form_data_message: Content object representing the primary message data.
             embed: Embed object for formatting the reply message in Discord.
             event: Telegram message event used to access the reply message.
+            reply_to_msg_id (int): ID of the replied message.
         """
-        reply_message = await event.get_reply_message()
-        if reply_message:
-            reply_user = await reply_message.get_sender() or event.chat
-            reply_user_name = get_username(reply_user)
-            reply_message_text = reply_message.message
-            if reply_message.file:
-                reply_message_text += f"\n*{reply_message.file.mime_type}*"
-            if reply_message_text:
-                embed.add_field(reply_user_name, reply_message_text, False)
-                embed.set_footer("Powered by Onimock")
-                form_data_message.add_embed(embed)
+        reply = self.recent_messages.get(event.chat_id, reply_to_msg_id)
+        if reply is None:
+            reply_message = await event.get_reply_message()
+            if not reply_message:
+                return
+            _, reply_user_name = await self._resolve_sender(reply_message, event.chat)
+            reply = self._remember(event.chat_id, reply_message, reply_user_name)
+        reply_message_text = reply.text
+        if reply.mime_type:
+            reply_message_text += f"\n*{reply.mime_type}*"
+        if reply_message_text:
+            embed.add_field(reply.sender_name, reply_message_text, False)
+            embed.set_footer("Powered by Onimock")
+            form_data_message.add_embed(embed)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import MESSAGE_MAP_PATH, MESSAGE_MAP_RETENTION
+
+logger = logging.getLogger(__name__)
+
+# Channel and supergroup ids are marked as -100xxxxxxxxxx; message ids of every other
+# chat are unique across the whole account.
+CHANNEL_ID_LIMIT = -1000000000000
+
+
+class MappedMessage:
+    """
+    A Discord webhook message mirroring a Telegram message.
+
+    Attributes:
+        message_id (int): ID of the Telegram message.
+        webhook_url (str): Webhook the message was posted with.
+        thread_id (int): Discord thread of the message, or None.
+        discord_message_id (int): ID of the Discord message.
+        notes (list): Notes posted after the text, e.g. in place of media, kept when the text is edited.
+    """
+
+    def __init__(self, message_id, webhook_url, thread_id, discord_message_id, notes=None):
+        self.message_id = message_id
+        self.webhook_url = webhook_url
+        self.thread_id = thread_id or None
+        self.discord_message_id = discord_message_id
+        self.notes = json.loads(notes) if notes else []
+
+
+class MessageMap:
+    """
+    Persistent mapping from Telegram messages to the Discord messages mirroring them.
+
+    A Telegram message maps to one Discord message per destination, or several when its
+    attachments were split across posts; the content is always in the first one. Rows
+    are kept in a SQLite table clustered on (chat id, message id), written in batches on
+    a single background thread and removed after `retention` seconds.
+
+    Attributes:
+        path (str): Path of the SQLite database.
+        retention (int): Seconds a mapping is kept.
+    """
+
+    def __init__(self, path=MESSAGE_MAP_PATH, retention=MESSAGE_MAP_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='message-map')
+        self._connection = None
+        self._pending = []
+        self._flush_task = None
+
+    async def _run(self, func, *args):
+        """Runs a database function on the message map thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        if self._connection is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS message_map (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                discord_message_id INTEGER NOT NULL,
+                webhook_url TEXT NOT NULL,
+                thread_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                notes TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (chat_id, message_id, discord_message_id)
+            ) WITHOUT ROWID''')
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(message_map)')]
+        if 'notes' not in columns:
+            self._connection.execute("ALTER TABLE message_map ADD COLUMN notes TEXT NOT NULL DEFAULT ''")
+        self._connection.execute('CREATE INDEX IF NOT EXISTS message_map_message ON message_map (message_id)')
+        self._connection.execute('DELETE FROM message_map WHERE created_at < ?', (time.time() - self.retention,))
+        self._connection.commit()
+
+    def add(self, chat_id, message_id, thread_id, posted, notes=None):
+        """
+        Records the Discord messages a Telegram message was posted as. The write is
+        committed in the background, together with the ones queued meanwhile.
+
+        Args:
+            chat_id (int): Chat of the Telegram message.
+            message_id (int): ID of the Telegram message.
+            thread_id (int): Discord thread the messages were posted into, or None.
+            posted (list): (webhook URL, Discord message id) of each posted message.
+            notes (list): Notes posted after the text of the message, if any.
+        """
+        now = time.time()
+        notes = json.dumps(notes) if notes else ''
+        self._pending.extend((chat_id, message_id, discord_message_id, webhook_url, thread_id or 0, now, notes)
+                             for webhook_url, discord_message_id in posted)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        """Commits the queued mappings until none are left."""
+        try:
+            while self._pending:
+                rows, self._pending = self._pending, []
+                try:
+                    await self._run(self._insert, rows)
+                except Exception as e:
+                    logger.error(f"Error writing to the message map: {e}")
+        finally:
+            self._flush_task = None
+
+    def _insert(self, rows):
+        self._open()
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO message_map (chat_id, message_id, discord_message_id, webhook_url, thread_id, '
+            'created_at, notes) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self._connection.commit()
+
+    async def get(self, chat_id, message_ids):
+        """
+        Looks up the Discord messages of Telegram messages.
+
+        Args:
+            chat_id (int): Chat of the messages, or None if unknown, which Telegram does
+                           for deletions outside channels.
+            message_ids (list): IDs of the Telegram messages.
+
+        Returns:
+            list: MappedMessage objects, the first post of each destination coming first.
+        """
+        if self._flush_task:
+            await self._flush_task
+        rows = await self._run(self._select, chat_id, list(message_ids))
+        return [MappedMessage(*row) for row in rows]
+
+    def _select(self, chat_id, message_ids):
+        self._open()
+        placeholders = ', '.join('?' * len(message_ids))
+        if chat_id is None:
+            where, args = f'chat_id > ? AND message_id IN ({placeholders})', [CHANNEL_ID_LIMIT, *message_ids]
+        else:
+            where, args = f'chat_id = ? AND message_id IN ({placeholders})', [chat_id, *message_ids]
+        return self._connection.execute(
+            'SELECT message_id, webhook_url, thread_id, discord_message_id, notes FROM message_map '
+            f'WHERE {where} ORDER BY message_id, discord_message_id', args).fetchall()
+
+    async def remove(self, chat_id, message_ids):
+        """Forgets the Discord messages of deleted Telegram messages."""
+        if self._flush_task:
+            await self._flush_task
+        await self._run(self._delete, chat_id, list(message_ids))
+
+    def _delete(self, chat_id, message_ids):
+        self._open()
+        placeholders = ', '.join('?' * len(message_ids))
+        if chat_id is None:
+            self._connection.execute(f'DELETE FROM message_map WHERE chat_id > ? AND message_id IN ({placeholders})',
+                                     [CHANNEL_ID_LIMIT, *message_ids])
+        else:
+            self._connection.execute(f'DELETE FROM message_map WHERE chat_id = ? AND message_id IN ({placeholders})',
+                                     [chat_id, *message_ids])
+        self._connection.commit()
+
+    async def close(self):
+        """Commits pending mappings and closes the database."""
+        if self._flush_task:
+            await self._flush_task
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
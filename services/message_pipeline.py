@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import logging
+
+from config import PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE
+from services.load_shedder import PREPARE, PLACEHOLDER, SKIP, FALLING_BEHIND
+from services.telegram_scheduler import telegram_priority, LIVE
+from utils.telegram_event import primary_message
+
+logger = logging.getLogger(__name__)
+
+
+class MessagePipeline:
+    """
+    Processes incoming Telegram messages concurrently while delivering them to Discord in order.
+
+    Messages go through three stages:
+        1. Ingest: events are numbered per chat/topic and put on a bounded queue.
+        2. Prepare: a pool of workers fetches senders, avatars, media and replies in parallel.
+        3. Send: prepared messages wait in a per chat/topic reorder buffer and are sent
+           strictly by sequence number, so a slow download never reorders the channel.
+
+    Attributes:
+        message_handler: Prepares and sends messages.
+        discord_service: Service handling the delivery of messages to Discord.
+        client: Telethon client used by the prepare stage.
+        workers (int): Number of prepare workers.
+        on_processed: Optional callback called with each event and whether it was delivered,
+                      in delivery order, once the pipeline is done with it; for messages held
+                      by the coalescer, once the post they are merged into has been sent.
+        coalescer (MessageCoalescer): Merges bursts of short messages in the send stage, or None.
+        shedder (LoadShedder): Caps the prepared messages waiting to be sent, or None for no cap.
+        priority (int): Priority of the Telegram requests of the prepare stage.
+    """
+
+    def __init__(self, message_handler, discord_service, client, workers=PIPELINE_WORKERS,
+                 queue_size=PIPELINE_QUEUE_SIZE, on_processed=None, coalescer=None,
+                 shedder=None, priority=LIVE):
+        self.message_handler = message_handler
+        self.discord_service = discord_service
+        self.client = client
+        self.workers = workers
+        self.on_processed = on_processed
+        self.coalescer = coalescer
+        self.shedder = shedder
+        self.priority = priority
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._sequences = {}
+        self._next_sequence = {}
+        self._reorder_buffers = {}
+        self._senders = {}
+        self._worker_tasks = []
+
+    @staticmethod
+    def ordering_key(event):
+        """
+        Returns the key messages are ordered by: the chat and, for forums, the topic.
+
+        Args:
+            event: Telegram message or album event.
+
+        Returns:
+            tuple: (chat id, topic id or None).
+        """
+        reply_to = getattr(primary_message(event), 'reply_to', None)
+        topic_id = None
+        if getattr(reply_to, 'forum_topic', False):
+            topic_id = reply_to.reply_to_top_id or reply_to.reply_to_msg_id
+        return event.chat_id, topic_id
+
+    def start(self):
+        """Starts the prepare workers."""
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, event, destinations=None):
+        """
+        Ingests a message event, waiting if the ingest queue is full.
+
+        Args:
+            event: Telegram message event to mirror.
+            destinations (list): Destination objects the message is routed to, or None
+                                 for the default webhook of the Discord service.
+        """
+        key = self.ordering_key(event)
+        sequence = next(self._sequences.setdefault(key, itertools.count()))
+        self._next_sequence.setdefault(key, 0)
+        await self._queue.put((key, sequence, event, destinations))
+
+    async def join(self):
+        """Waits until every ingested message has been prepared and sent."""
+        await self._queue.join()
+        while self._senders:
+            await asyncio.gather(*self._senders.values(), return_exceptions=True)
+        if self.coalescer:
+            await self.coalescer.flush()
+
+    async def stop(self):
+        """
+        Stops the workers and the send stage, discarding messages that were not sent.
+        Messages held by the coalescer are sent.
+        """
+        tasks = self._worker_tasks + list(self._senders.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.coalescer:
+            await self.coalescer.flush()
+        self._worker_tasks = []
+        self._senders.clear()
+        for buffer in self._reorder_buffers.values():
+            for event, prepared in buffer.values():
+                if prepared:
+                    self.message_handler.discard_prepared_message(prepared)
+                if self.shedder:
+                    self.shedder.release(event)
+            buffer.clear()
+
+    def queue_depths(self):
+        """
+        Returns the number of messages waiting in each stage.
+
+        Returns:
+            dict: Messages waiting to be prepared and prepared messages waiting to be sent.
+        """
+        return {
+            'ingest': self._queue.qsize(),
+            'reorder': sum(len(buffer) for buffer in self._reorder_buffers.values()),
+        }
+
+    def register_metrics(self, metrics):
+        """Exposes the queue depths of the pipeline on a metrics registry."""
+        metrics.register('mirror_pipeline_queue_depth', 'gauge', 'Messages waiting in each pipeline stage.',
+                         self.queue_depths, 'stage')
+
+    async def _worker(self):
+        """Prepare stage: turns queued events into prepared messages."""
+        with telegram_priority(self.priority):
+            await self._prepare_loop()
+
+    async def _prepare_loop(self):
+        while True:
+            key, sequence, event, destinations = await self._queue.get()
+            prepared = None
+            try:
+                decision = PREPARE
+                if self.shedder:
+                    decision = await self.shedder.before_prepare(
+                        key, event, destinations, lambda: sequence == self._next_sequence[key])
+                if decision != SKIP:
+                    prepared = await self.message_handler.prepare_message(
+                        self.client, event, destinations,
+                        skip_media_reason=FALLING_BEHIND if decision == PLACEHOLDER else None)
+                    if prepared and self.shedder:
+                        self.shedder.admit(key, prepared)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error preparing message {primary_message(event).id} from chat {key[0]}: {e}")
+            finally:
+                self._reorder_buffers.setdefault(key, {})[sequence] = (event, prepared)
+                self._schedule_send(key)
+                self._queue.task_done()
+
+    def _processed(self, event, delivered):
+        if self.on_processed:
+            self.on_processed(event, delivered)
+
+    def _schedule_send(self, key):
+        """Starts the send stage of a chat/topic if its next message is ready."""
+        if key in self._senders:
+            return
+        if self._next_sequence[key] in self._reorder_buffers.get(key, {}):
+            self._senders[key] = asyncio.create_task(self._send_in_order(key))
+
+    async def _send_in_order(self, key):
+        """Send stage: delivers buffered messages of a chat/topic by sequence number."""
+        buffer = self._reorder_buffers[key]
+        try:
+            while self._next_sequence[key] in buffer:
+                event, prepared = buffer.pop(self._next_sequence[key])
+                self._next_sequence[key] += 1
+                delivered = False
+                if prepared is not None:
+                    if self.shedder:
+                        self.shedder.before_send(key, prepared)
+                    try:
+                        if self.coalescer:
+                            # The coalescer reports the result once the post the message is part of is sent.
+                            await self.coalescer.send(key, prepared, self._processed)
+                            delivered = None
+                        else:
+                            delivered = await self.message_handler.send_prepared_message(self.discord_service,
+                                                                                         prepared)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error sending message {primary_message(event).id} from chat {key[0]}: {e}")
+                if self.shedder:
+                    self.shedder.release(event)
+                if delivered is not None:
+                    self._processed(event, delivered)
+        finally:
+            self._senders.pop(key, None)
@@ -0,0 +1,127 @@
+import logging
+
+from telethon import utils
+from telethon.tl.types import PeerChat, PeerChannel
+
+from models.route import Route
+from utils.telegram_event import primary_message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageRouter:
+    """
+    Routing table from Telegram chats and forum topics to Discord destinations.
+
+    Routes are indexed by (chat id, topic id), with topic id None meaning the whole chat,
+    so finding the destinations of a message is a couple of dictionary lookups no matter
+    how many routes are configured. Chat ids are indexed in their marked form (-100... for
+    channels, -... for basic groups), so a user, a group and a channel sharing a bare id
+    never match each other's routes. Like Telethon's `chats` filter, a route given a bare
+    positive id matches the user, group and channel with that id.
+
+    Attributes:
+        routes (list): The configured Route objects.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = []
+        self._index = {}
+        for route in routes or []:
+            self.add_route(route)
+
+    @classmethod
+    def from_config(cls, routes_config):
+        """
+        Builds a router from the ROUTES configuration list.
+
+        Args:
+            routes_config (list): Route dictionaries, as accepted by `Route.from_dict`.
+
+        Returns:
+            MessageRouter: The router with every configured route.
+        """
+        return cls([Route.from_dict(route) for route in routes_config])
+
+    @staticmethod
+    def _chat_keys(chat_id):
+        """Returns the marked ids a configured chat id stands for."""
+        if chat_id < 0:
+            return [chat_id]
+        return [chat_id, utils.get_peer_id(PeerChat(chat_id)), utils.get_peer_id(PeerChannel(chat_id))]
+
+    def add_route(self, route):
+        """
+        Adds a route to the table. Routes whose chat is not yet a numeric id are indexed
+        once `resolve` has been called.
+
+        Args:
+            route (Route): The route to add.
+        """
+        self.routes.append(route)
+        if isinstance(route.chat, int):
+            for chat_key in self._chat_keys(route.chat):
+                destinations = self._index.setdefault((chat_key, route.topic_id), [])
+                destinations.extend(d for d in route.destinations if d not in destinations)
+
+    async def resolve(self, client, chat_ids=None):
+        """
+        Resolves usernames and links of the routes to chat ids and rebuilds the index.
+
+        Args:
+            client: Telethon client used to resolve the chats.
+            chat_ids (CheckpointStore): Ids resolved on previous runs, used instead of asking
+                                        Telegram and updated with the newly resolved ones.
+        """
+        routes = self.routes
+        self.routes = []
+        self._index = {}
+        for route in routes:
+            if not isinstance(route.chat, int):
+                cached = chat_ids.get(route.chat) if chat_ids else None
+                if cached is not None:
+                    route.chat = cached
+                else:
+                    try:
+                        chat_id = await client.get_peer_id(route.chat)
+                    except Exception as e:
+                        logger.error(f"Error resolving chat {route.chat}: {e}")
+                        continue
+                    if chat_ids:
+                        chat_ids.set(route.chat, chat_id)
+                    route.chat = chat_id
+            self.add_route(route)
+        if chat_ids:
+            chat_ids.save()
+
+    def chats(self):
+        """
+        Returns the chats the client has to subscribe to.
+
+        Returns:
+            list: Chat ids of every route.
+        """
+        return list({route.chat for route in self.routes if isinstance(route.chat, int)})
+
+    def destinations_for(self, event):
+        """
+        Returns the destinations a message has to be sent to.
+
+        A message matches the routes of its whole chat and, when it belongs to a thread,
+        the routes of its top message or of the message it replies to.
+
+        Args:
+            event: Telegram message or album event.
+
+        Returns:
+            list: Destination objects, without duplicates, or an empty list if no route matches.
+        """
+        chat_key = event.chat_id
+        destinations = list(self._index.get((chat_key, None), ()))
+        reply_to = getattr(primary_message(event), 'reply_to', None)
+        if reply_to:
+            for topic_id in {getattr(reply_to, 'reply_to_top_id', None), getattr(reply_to, 'reply_to_msg_id', None)}:
+                if topic_id is not None:
+                    destinations.extend(d for d in self._index.get((chat_key, topic_id), ())
+                                        if d not in destinations)
+        return destinations
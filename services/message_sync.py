@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+from config import EDIT_DEBOUNCE_DELAY
+from models.content import Content
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSync:
+    """
+    Mirrors edits and deletions of Telegram messages onto the Discord messages posted for them.
+
+    Edits are debounced: the Discord message is only patched once a message has not been
+    edited for `debounce_delay` seconds, so a burst of typo fixes becomes a single PATCH.
+    Edits that leave the text unchanged, e.g. a link preview being added, are ignored.
+    The new text is rendered like the original post, followed by the notes it was posted
+    with, e.g. in place of media over the upload limit.
+
+    Attributes:
+        discord_service: Service handling the requests to Discord.
+        message_map (MessageMap): Discord messages of each mirrored Telegram message.
+        recent_messages (RecentMessages): Recently seen messages, kept up to date, or None.
+        debounce_delay (float): Seconds without edits before an edit is mirrored.
+        stats (dict): Counters of mirrored, debounced, unchanged and unmapped edits, and deletions.
+    """
+
+    def __init__(self, discord_service, message_map, recent_messages=None, debounce_delay=EDIT_DEBOUNCE_DELAY):
+        self.discord_service = discord_service
+        self.message_map = message_map
+        self.recent_messages = recent_messages
+        self.debounce_delay = debounce_delay
+        self.stats = {'edits': 0, 'debounced': 0, 'unchanged': 0, 'unmapped': 0, 'deletions': 0}
+        self._pending_edits = {}
+
+    def message_edited(self, event):
+        """
+        Schedules the mirroring of an edited message, replacing an edit of it that is still pending.
+
+        Args:
+            event: Telethon MessageEdited event.
+        """
+        key = (event.chat_id, event.message.id)
+        pending = self._pending_edits.get(key)
+        if pending:
+            pending[1].cancel()
+            self.stats['debounced'] += 1
+        self._pending_edits[key] = (event.message, asyncio.create_task(self._edit_later(key, event.message)))
+
+    async def _edit_later(self, key, message):
+        await asyncio.sleep(self.debounce_delay)
+        self._pending_edits.pop(key, None)
+        try:
+            await self._apply_edit(key[0], message)
+        except Exception as e:
+            logger.error(f"Error mirroring edit of message {message.id} from chat {key[0]}: {e}")
+
+    @staticmethod
+    def render(text, notes):
+        """
+        Returns the content of a Discord message after an edit, or None to clear it, as
+        Discord rejects an empty string.
+        """
+        content = Content(None)
+        content.set_content(text)
+        content.set_notes(notes)
+        return content.text() or None
+
+    async def _apply_edit(self, chat_id, message):
+        """Patches the content of the first Discord message of each destination of an edited message."""
+        text = message.message or ""
+        recent = self.recent_messages.peek(chat_id, message.id) if self.recent_messages else None
+        if recent is not None:
+            if recent.text == text:
+                self.stats['unchanged'] += 1
+                return
+            recent.text = text
+
+        mapped = await self.message_map.get(chat_id, [message.id])
+        if not mapped:
+            self.stats['unmapped'] += 1
+            return
+        first_posts = {}
+        for post in mapped:
+            first_posts.setdefault((post.webhook_url, post.thread_id), post)
+        self.stats['edits'] += 1
+        await asyncio.gather(*[
+            self.discord_service.edit_message(post.webhook_url, post.discord_message_id,
+                                              {'content': self.render(text, post.notes)}, post.thread_id)
+            for post in first_posts.values()])
+
+    async def message_deleted(self, event):
+        """
+        Deletes the Discord messages of deleted Telegram messages, dropping their pending edits.
+
+        Args:
+            event: Telethon MessageDeleted event. Its chat is unknown for deletions outside
+                   channels, whose message ids are unique across the account.
+        """
+        chat_id = event.chat_id
+        for message_id in event.deleted_ids:
+            for key in [key for key in self._pending_edits if key[1] == message_id and chat_id in (None, key[0])]:
+                self._pending_edits.pop(key)[1].cancel()
+            if self.recent_messages and chat_id is not None:
+                self.recent_messages.forget(chat_id, message_id)
+
+        mapped = await self.message_map.get(chat_id, event.deleted_ids)
+        if not mapped:
+            return
+        self.stats['deletions'] += len({post.message_id for post in mapped})
+        await asyncio.gather(*[
+            self.discord_service.delete_message(post.webhook_url, post.discord_message_id, post.thread_id)
+            for post in mapped])
+        await self.message_map.remove(chat_id, event.deleted_ids)
+
+    async def flush(self):
+        """Mirrors the pending edits right away, e.g. before shutting down."""
+        pending, self._pending_edits = self._pending_edits, {}
+        for _, task in pending.values():
+            task.cancel()
+        await asyncio.gather(*[task for _, task in pending.values()], return_exceptions=True)
+        for (chat_id, _), (message, _) in pending.items():
+            await self._apply_edit(chat_id, message)
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (OUTBOX_PATH, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_DELAY,
+                    OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETENTION, OUTBOX_SEND_LEASE)
+from models.attachment import Attachment
+from models.content import Content
+from models.route import Destination
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DELIVERED = 'delivered'
+FAILED = 'failed'
+
+
+class Outbox:
+    """
+    Durable SQLite outbox between the message handler and the Discord service.
+
+    Every delivery is stored before it is sent and marked delivered afterwards, so
+    messages that were in flight when the process stopped, or that Discord refused,
+    are retried with backoff and replayed on the next start. Deliveries are keyed by
+    chat, Telegram message id and destination, so a message is never sent twice to
+    the same place.
+
+    Only the send stage goes through the outbox: a message is stored once it has been
+    prepared and reaches the front of its chat's queue. Messages still waiting in the
+    ingest queue or the reorder buffer of the message pipeline when the process stops
+    are not stored, and are lost; the history backfill can recover them.
+
+    A new delivery is stored with a lease that keeps the retry loop away from it while its
+    first send runs; the lease is replaced by the outcome of the attempt, and released on
+    the next start if the process stopped mid-send. A delivery of a message that is already
+    being sent waits for that attempt and reports its result.
+
+    Media cache files of a pending delivery stay pinned until it is delivered or has
+    failed, so a retry finds them on disk instead of downloading them again.
+
+    The database runs in WAL mode on a single background thread. Writes that arrive
+    while a commit is running are grouped into the next one, so a lone message is
+    committed right away and a burst is committed in batches.
+
+    Attributes:
+        path (str): Path of the SQLite database.
+        batch_size (int): Maximum number of writes per commit.
+        max_attempts (int): Attempts before a delivery is marked as failed.
+        message_map (MessageMap): Records the Discord messages of retried deliveries, if given.
+        media_cache (MediaCache): Cache whose files pending deliveries keep pinned, if given.
+        stats (dict): Counters of stored, duplicate, delivered, retried and failed deliveries.
+    """
+
+    def __init__(self, path=OUTBOX_PATH, batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_base_delay=OUTBOX_RETRY_BASE_DELAY, retry_max_delay=OUTBOX_RETRY_MAX_DELAY,
+                 retention=OUTBOX_RETENTION, send_lease=OUTBOX_SEND_LEASE, message_map=None, media_cache=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retention = retention
+        self.send_lease = send_lease
+        self.message_map = message_map
+        self.media_cache = media_cache
+        self.stats = {'stored': 0, 'duplicates': 0, 'delivered': 0, 'retried': 0, 'failed': 0}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+        self._connection = None
+        self._batch = []
+        self._flush_task = None
+        self._in_flight = {}
+        self._pinned = {}
+
+    async def _run(self, func, *args):
+        """Runs a database function on the outbox thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        if self._connection is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                destination_key TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                content TEXT NOT NULL,
+                attachments TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (chat_id, message_id, destination_key)
+            )''')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, next_attempt_at)')
+        self._connection.execute('DELETE FROM outbox WHERE status != ? AND created_at < ?',
+                                 (PENDING, time.time() - self.retention))
+        # Leases of first sends interrupted by the last stop: retry them right away.
+        self._connection.execute('UPDATE outbox SET next_attempt_at = 0 WHERE status = ? AND attempts = 0',
+                                 (PENDING,))
+        self._connection.commit()
+
+    async def _write(self, func, *args):
+        """
+        Adds a write to the next batch and waits until it is committed.
+
+        Args:
+            func: Function called with the connection and `args` inside the batch transaction.
+
+        Returns:
+            The return value of `func`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._write_nowait(func, *args, future=future)
+        return await future
+
+    def _write_nowait(self, func, *args, future=None):
+        """Adds a write to the next batch without waiting for its commit."""
+        self._batch.append((func, args, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        """Commits queued writes, up to `batch_size` per transaction, until none are left."""
+        try:
+            while self._batch:
+                batch, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+                try:
+                    results = await self._run(self._commit_batch, batch)
+                except Exception as e:
+                    logger.error(f"Error writing to the outbox: {e}")
+                    for _, _, future in batch:
+                        if future and not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, _, future), result in zip(batch, results):
+                    if future and not future.done():
+                        future.set_result(result)
+        finally:
+            self._flush_task = None
+
+    def _commit_batch(self, batch):
+        self._open()
+        results = [func(self._connection, *args) for func, args, _ in batch]
+        self._connection.commit()
+        return results
+
+    @staticmethod
+    def _insert(connection, chat_id, message_id, destination, content, attachments, lease):
+        cursor = connection.execute(
+            'INSERT OR IGNORE INTO outbox (chat_id, message_id, destination_key, destination, content, attachments, '
+            'status, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (chat_id, message_id, destination.key(), json.dumps(destination.to_dict()),
+             json.dumps(content.to_record()), json.dumps([attachment.to_record() for attachment in attachments]),
+             PENDING, time.time() + lease, time.time()))
+        if cursor.rowcount:
+            return cursor.lastrowid, PENDING
+        row = connection.execute('SELECT id, status FROM outbox WHERE chat_id = ? AND message_id = ? '
+                                 'AND destination_key = ?', (chat_id, message_id, destination.key())).fetchone()
+        return row[0], row[1]
+
+    @staticmethod
+    def _update(connection, entry_id, status, attempts, next_attempt_at):
+        connection.execute('UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ? WHERE id = ?',
+                           (status, attempts, next_attempt_at, entry_id))
+
+    async def deliver(self, discord_service, chat_id, message_id, content, attachments, destination, posted=None):
+        """
+        Stores a delivery, sends it, and records the outcome.
+
+        Args:
+            discord_service: Service handling message sending to Discord.
+            chat_id (int): Chat of the Telegram message.
+            message_id (int): ID of the Telegram message.
+            content (Content): The message content, with its avatar already set.
+            attachments (list): Attachment objects to upload.
+            destination (Destination): Where the message is sent.
+            posted (list): Receives the (webhook URL, Discord message id) of each post, if given.
+
+        Returns:
+            bool: True if the message was delivered now or had already been delivered.
+        """
+        destination = destination or discord_service.default_destination()
+        entry_id, status = await self._write(self._insert, chat_id, message_id, destination, content, attachments,
+                                             self.send_lease)
+        if status != PENDING or entry_id in self._in_flight:
+            self.stats['duplicates'] += 1
+            if entry_id in self._in_flight:
+                return await asyncio.shield(self._in_flight[entry_id])
+            return status == DELIVERED
+        self.stats['stored'] += 1
+        self._start(entry_id)
+        delivered = False
+        try:
+            self._pin(entry_id, attachments)
+            delivered = await discord_service.send_message(content, attachments, destination, posted)
+            await self._record_attempt(entry_id, delivered, 0)
+        finally:
+            self._finish(entry_id, delivered)
+        return delivered
+
+    def _start(self, entry_id):
+        """Marks a delivery as being sent, so neither the retry loop nor another delivery sends it too."""
+        self._in_flight[entry_id] = asyncio.get_running_loop().create_future()
+
+    def _finish(self, entry_id, delivered):
+        """Ends the attempt of a delivery once its outcome is recorded, waking deliveries waiting on it."""
+        attempt = self._in_flight.pop(entry_id)
+        if not attempt.done():
+            attempt.set_result(delivered)
+
+    async def _record_attempt(self, entry_id, delivered, attempts):
+        """
+        Marks a delivery as delivered, or schedules its next attempt with backoff. The media
+        cache files of the delivery are released once it is delivered or has failed.
+        """
+        attempts += 1
+        if delivered:
+            self.stats['delivered'] += 1
+            self._unpin(entry_id)
+            self._write_nowait(self._update, entry_id, DELIVERED, attempts, 0)
+            return
+        if attempts >= self.max_attempts:
+            self.stats['failed'] += 1
+            self._unpin(entry_id)
+            logger.error(f"Outbox entry {entry_id} failed after {attempts} attempts, giving up.")
+            status, next_attempt_at = FAILED, 0
+        else:
+            delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempts - 1)))
+            status, next_attempt_at = PENDING, time.time() + delay / 2 + random.uniform(0, delay / 2)
+        await self._write(self._update, entry_id, status, attempts, next_attempt_at)
+
+    def _pin(self, entry_id, attachments):
+        """Pins the media cache files of a delivery until it is delivered or has failed, unless they already are."""
+        if self.media_cache is None or entry_id in self._pinned:
+            return
+        paths = [attachment.path for attachment in attachments if attachment.cached]
+        for path in paths:
+            self.media_cache.pin(path)
+        self._pinned[entry_id] = paths
+
+    def _unpin(self, entry_id):
+        for path in self._pinned.pop(entry_id, []):
+            self.media_cache.unpin(path)
+
+    def _due_entries(self, limit):
+        self._open()
+        return self._connection.execute(
+            'SELECT id, chat_id, message_id, destination, content, attachments, attempts FROM outbox '
+            'WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?', (PENDING, time.time(), limit)).fetchall()
+
+    async def run_retries(self, discord_service, client, media_processor, interval=1.0):
+        """
+        Resends pending deliveries whose retry time has come, including the ones left
+        over from a previous run. Runs until cancelled.
+
+        Media that is no longer on disk is downloaded again from its Telegram message.
+
+        Args:
+            discord_service: Service handling message sending to Discord.
+            client: Telethon client used to download media again.
+            media_processor: Downloads the media of Telegram messages.
+            interval (float): Seconds between checks for due deliveries.
+        """
+        while True:
+            try:
+                # Due rows are claimed as soon as they are read, so a delivery of the same
+                # message arriving before their turn waits for the retry instead of sending.
+                rows = [row for row in await self._run(self._due_entries, self.batch_size)
+                        if row[0] not in self._in_flight]
+                for row in rows:
+                    self._start(row[0])
+                try:
+                    for row in rows:
+                        await self._retry(discord_service, client, media_processor, *row)
+                finally:
+                    for row in rows:
+                        if row[0] in self._in_flight:
+                            self._finish(row[0], False)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reading the outbox: {e}")
+            await asyncio.sleep(interval)
+
+    async def _retry(self, discord_service, client, media_processor, entry_id, chat_id, message_id, destination,
+                     content, attachments, attempts):
+        """Resends a stored delivery claimed by the retry loop and records the outcome."""
+        self.stats['retried'] += 1
+        files = []
+        posted = [] if self.message_map else None
+        delivered = False
+        try:
+            try:
+                destination = Destination.from_dict(json.loads(destination))
+                files = await self._load_attachments(client, media_processor, json.loads(attachments), destination)
+                content = Content.from_record(json.loads(content))
+                delivered = await discord_service.send_message(content, files, destination, posted)
+                if posted:
+                    self.message_map.add(chat_id, message_id, destination.thread_id, posted, content.notes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error retrying message {message_id} from chat {chat_id}: {e}")
+                delivered = False
+            finally:
+                self._pin(entry_id, files)
+                for file in files:
+                    if file.cached:
+                        media_processor.release_cached(file)
+                    elif file.path:
+                        media_processor.file_manager.delete_file(file.path, None)
+            await self._record_attempt(entry_id, delivered, attempts)
+        finally:
+            self._finish(entry_id, delivered)
+
+    @staticmethod
+    async def _load_attachments(client, media_processor, records, destination):
+        """
+        Rebuilds the attachments of a stored delivery from disk, or from Telegram if the file is gone,
+        following the media policy of its destination.
+
+        Returns:
+            list: The attachments; files on disk are deleted, and media cache files released,
+                  once the retry is done.
+        """
+        attachments = []
+        for record in records:
+            if record['path'] and os.path.exists(record['path']):
+                attachment = Attachment(record['filename'], path=record['path'], cached=record.get('cached', False))
+                if attachment.cached and media_processor.media_cache:
+                    media_processor.media_cache.pin(attachment.path)
+                attachments.append(attachment)
+            elif record['source']:
+                message = await client.get_messages(record['source'][0], ids=record['source'][1])
+                action = media_processor.plan(message, destination) if message else None
+                attachment = await media_processor.get_attachment(client, message, action=action,
+                                                                  destination=destination) if message else None
+                if attachment:
+                    attachments.append(attachment)
+        return attachments
+
+    async def close(self):
+        """Commits pending writes and closes the database."""
+        if self._flush_task:
+            await self._flush_task
+        await self._flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
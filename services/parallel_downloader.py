@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import math
+
+from telethon import utils
+from telethon.network import MTProtoSender
+from telethon.tl import functions
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.types import MessageMediaDocument
+
+from config import PARALLEL_DOWNLOAD_THRESHOLD, PARALLEL_DOWNLOAD_CONNECTIONS, PARALLEL_DOWNLOAD_PART_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class ParallelDownloader:
+    """
+    Downloads large Telegram documents over several connections at once.
+
+    Telethon downloads a file over a single connection, requesting one part after the
+    other, so a large document is limited to that connection's bandwidth. Here the file
+    is split in parts of `part_size` bytes, fetched by `connections` senders opened to
+    the document's DC, and written at their offset in the destination as they arrive,
+    so the file is complete and in order once every part is in. The authorization
+    exported to a foreign DC is kept, so later downloads only open the connections.
+    Any failure falls back to `client.download_media`.
+
+    Telethon has no public API for extra connections, so this relies on private
+    TelegramClient members (`_call`, `_init_request`, `_get_dc`, `_connection`, `_log`,
+    `_proxy` and `_local_addr`, as of Telethon 1.x). They are only used in `_invoke`,
+    `_import_authorization` and `_open`; if a Telethon upgrade changes them, downloads
+    fail there and fall back to `client.download_media`.
+
+    Attributes:
+        threshold (int): Smallest document size, in bytes, downloaded in parallel.
+        connections (int): Number of connections used by a download.
+        part_size (int): Size of the requested parts, in bytes.
+        stats (dict): Number of parallel downloads, of fallbacks and bytes downloaded.
+    """
+
+    def __init__(self, threshold=PARALLEL_DOWNLOAD_THRESHOLD, connections=PARALLEL_DOWNLOAD_CONNECTIONS,
+                 part_size=PARALLEL_DOWNLOAD_PART_SIZE):
+        if part_size % 4096 or (1024 * 1024) % part_size or part_size > 512 * 1024:
+            raise ValueError(f"Invalid part size {part_size}: it must be a multiple of 4096 dividing 1 MiB")
+        self.threshold = threshold
+        self.connections = max(1, connections)
+        self.part_size = part_size
+        self.stats = {'downloads': 0, 'fallbacks': 0, 'bytes': 0}
+        self._auth_keys = {}
+        self._auth_lock = asyncio.Lock()
+
+    def register_metrics(self, metrics):
+        """Exposes the download counters on a metrics registry."""
+        metrics.register('mirror_parallel_downloads_total', 'counter', 'Parallel downloads by outcome.',
+                         lambda: {'parallel': self.stats['downloads'], 'fallback': self.stats['fallbacks']},
+                         'result')
+        metrics.register('mirror_parallel_download_bytes_total', 'counter', 'Bytes downloaded in parallel.',
+                         lambda: self.stats['bytes'])
+
+    def accepts(self, media):
+        """Whether a message media is a document large enough to be downloaded in parallel."""
+        size = getattr(getattr(media, 'document', None), 'size', None)
+        return isinstance(media, MessageMediaDocument) and size is not None and size > self.threshold
+
+    async def download(self, client, message, file):
+        """
+        Downloads the document of a message.
+
+        Args:
+            client: Telethon client used for the download.
+            message: Telegram message whose media is accepted by `accepts`.
+            file: Path to write the document to, or `bytes` to return its content.
+
+        Returns:
+            The path, or the content if `file` is `bytes`, like `client.download_media`.
+        """
+        try:
+            result = await self._download(client, message.media.document, file)
+            self.stats['downloads'] += 1
+            self.stats['bytes'] += message.media.document.size
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Parallel download of message {message.id} failed, downloading it sequentially: {e}")
+            self.stats['fallbacks'] += 1
+            return await client.download_media(message, file=file)
+
+    async def _download(self, client, document, file):
+        dc_id, location = utils.get_input_location(document)
+        parts = math.ceil(document.size / self.part_size)
+        senders = await asyncio.gather(*[self._connect(client, dc_id)
+                                         for _ in range(min(self.connections, parts))], return_exceptions=True)
+        try:
+            for sender in senders:
+                if isinstance(sender, BaseException):
+                    raise sender
+            if file is bytes:
+                buffer = bytearray(document.size)
+
+                def write(offset, data):
+                    buffer[offset:offset + len(data)] = data
+
+                await self._fetch_parts(client, senders, location, parts, write)
+                return bytes(buffer)
+            with open(file, 'wb') as output:
+                output.truncate(document.size)
+
+                def write(offset, data):
+                    output.seek(offset)
+                    output.write(data)
+
+                await self._fetch_parts(client, senders, location, parts, write)
+            return file
+        finally:
+            await asyncio.gather(*[sender.disconnect() for sender in senders
+                                   if not isinstance(sender, BaseException)])
+
+    async def _fetch_parts(self, client, senders, location, parts, write):
+        """
+        Fetches the parts of a file, each sender taking every n-th part, and writes them at
+        their offset.
+        """
+
+        async def fetch(index, sender):
+            for part in range(index, parts, len(senders)):
+                offset = part * self.part_size
+                result = await self._invoke(client, sender, functions.upload.GetFileRequest(
+                    location=location, offset=offset, limit=self.part_size))
+                write(offset, result.bytes)
+
+        await asyncio.gather(*[fetch(index, sender) for index, sender in enumerate(senders)])
+
+    async def _connect(self, client, dc_id):
+        """
+        Opens a connection to a DC. The home DC uses the session's authorization; on
+        another DC the first connection imports an exported one, whose key is reused.
+        """
+        if dc_id != client.session.dc_id and dc_id not in self._auth_keys:
+            async with self._auth_lock:
+                if dc_id not in self._auth_keys:
+                    sender = await self._open(client, dc_id, None)
+                    auth = await client(functions.auth.ExportAuthorizationRequest(dc_id))
+                    await self._import_authorization(client, sender, auth)
+                    self._auth_keys[dc_id] = sender.auth_key
+                    return sender
+        auth_key = client.session.auth_key if dc_id == client.session.dc_id else self._auth_keys[dc_id]
+        return await self._open(client, dc_id, auth_key)
+
+    # The methods below are the only ones using private TelegramClient members.
+
+    @staticmethod
+    async def _invoke(client, sender, request):
+        """Sends a request on a download sender through `client._call`, like Telethon's own downloads."""
+        return await client._call(sender, request)
+
+    @staticmethod
+    async def _import_authorization(client, sender, auth):
+        """Imports an exported authorization on a new sender, wrapped in the client's init request."""
+        client._init_request.query = functions.auth.ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, client._init_request))
+
+    @staticmethod
+    async def _open(client, dc_id, auth_key):
+        """Opens a sender to a DC with the client's connection type, proxy and loggers."""
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(dc.ip_address, dc.port, dc.id, loggers=client._log,
+                                                proxy=client._proxy, local_addr=client._local_addr))
+        return sender
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+from config import RECENT_MESSAGES_PER_CHAT
+
+
+class RecentMessage:
+    """
+    What a reply embed needs to know about a message.
+
+    Attributes:
+        text (str): The message text.
+        sender_name (str): Display name of the sender.
+        mime_type (str): Mime type of the attached file, or None.
+    """
+
+    def __init__(self, text, sender_name, mime_type=None):
+        self.text = text
+        self.sender_name = sender_name
+        self.mime_type = mime_type
+
+
+class RecentMessages:
+    """
+    Bounded index of the latest messages seen in each chat, keyed by message id.
+
+    Replies almost always point at a message mirrored moments earlier, so looking it up
+    here saves the `get_reply_message` request. Each chat keeps its `per_chat` most
+    recent messages.
+
+    Attributes:
+        per_chat (int): Number of messages kept per chat.
+        hits (int): Number of lookups found in the index.
+        misses (int): Number of lookups that had to be fetched from Telegram.
+    """
+
+    def __init__(self, per_chat=RECENT_MESSAGES_PER_CHAT):
+        self.per_chat = per_chat
+        self.hits = 0
+        self.misses = 0
+        self._chats = {}
+
+    def remember(self, chat_id, message_id, text, sender_name, mime_type=None):
+        """
+        Adds or replaces a message in the index of its chat.
+
+        Args:
+            chat_id (int): Chat of the message.
+            message_id (int): ID of the message.
+            text (str): The message text.
+            sender_name (str): Display name of the sender.
+            mime_type (str): Mime type of the attached file, if any.
+
+        Returns:
+            RecentMessage: The stored entry.
+        """
+        messages = self._chats.setdefault(chat_id, OrderedDict())
+        message = messages[message_id] = RecentMessage(text, sender_name, mime_type)
+        messages.move_to_end(message_id)
+        while len(messages) > self.per_chat:
+            messages.popitem(last=False)
+        return message
+
+    def get(self, chat_id, message_id):
+        """
+        Looks a message up.
+
+        Args:
+            chat_id (int): Chat of the message.
+            message_id (int): ID of the message.
+
+        Returns:
+            RecentMessage: The message, or None if it is not in the index.
+        """
+        message = self._chats.get(chat_id, {}).get(message_id)
+        if message is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return message
+
+    def peek(self, chat_id, message_id):
+        """Looks a message up without counting a hit or a miss, for lookups that are not reply embeds."""
+        return self._chats.get(chat_id, {}).get(message_id)
+
+    def forget(self, chat_id, message_id):
+        """Removes a message from the index, e.g. after it was deleted."""
+        self._chats.get(chat_id, {}).pop(message_id, None)
+
+    def hit_rate(self):
+        """Returns the fraction of lookups answered from the index."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'size': sum(len(messages) for messages in self._chats.values()), 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hit_rate()}
+
+    def register_metrics(self, metrics):
+        """Exposes the lookups answered from the index and from Telegram on a metrics registry."""
+        metrics.register('mirror_recent_messages_lookups_total', 'counter', 'Reply lookups in the recent '
+                         'messages index.', lambda: {'hit': self.hits, 'miss': self.misses}, 'result')
+        metrics.register('mirror_recent_messages_size', 'gauge', 'Messages in the recent messages index.',
+                         lambda: self.stats()['size'])
@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from telethon import errors, utils
+
+from config import (TELEGRAM_RATE_LIMITS, TELEGRAM_DEFAULT_RATE, TELEGRAM_RATE_BURST, TELEGRAM_MAX_FLOOD_WAIT,
+                    TELEGRAM_FLOOD_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+LIVE = 0
+AVATAR = 1
+BACKFILL = 2
+PRIORITY_NAMES = {LIVE: 'live', AVATAR: 'avatar', BACKFILL: 'backfill'}
+
+# Requests that fetch updates are never held back, so the client keeps receiving messages.
+UNSCHEDULED_REQUESTS = ('GetStateRequest', 'GetDifferenceRequest', 'GetChannelDifferenceRequest')
+
+# Parameters of the private `TelegramClient._call` the scheduler wraps, as of Telethon 1.x.
+CALL_PARAMETERS = ['sender', 'request', 'ordered', 'flood_sleep_threshold']
+
+_priority = contextvars.ContextVar('telegram_priority', default=LIVE)
+
+
+@contextmanager
+def telegram_priority(priority):
+    """
+    Runs the Telegram requests made within the block, and the tasks it starts, at a priority.
+
+    Priorities only lower: an avatar fetched for a backfilled message stays at the
+    backfill priority.
+
+    Args:
+        priority (int): LIVE, AVATAR or BACKFILL.
+    """
+    token = _priority.set(max(_priority.get(), priority))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _TokenBucket:
+    """Token bucket of one request type, handing its tokens to waiting calls by priority."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, rate * burst)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._waiters = []
+        self._order = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, priority):
+        """
+        Takes a token, waiting behind the calls of the same or a higher priority if there is none.
+
+        Returns:
+            bool: Whether the call had to wait.
+        """
+        self._refill()
+        if self.tokens >= 1 and not self._waiters:
+            self.tokens -= 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        return True
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+
+class TelegramScheduler:
+    """
+    Central scheduler of the requests the Telethon client sends.
+
+    Once installed on a client, every request, including the parts of media downloads,
+    goes through a token bucket of its type (TELEGRAM_RATE_LIMITS, per second), and the
+    calls waiting for a token are served by priority: live messages, then avatars, then
+    backfill, as set with `telegram_priority`. A FloodWait pauses every scheduled request
+    for the time Telegram asks, instead of only the one that hit it, and the request is
+    sent again after the pause. FloodWaits longer than `max_flood_wait` are raised to the
+    caller without pausing the others.
+
+    Attributes:
+        rates (dict): Requests per second allowed for each request type.
+        default_rate (float): Requests per second of the types not in `rates`.
+        burst (float): Seconds worth of requests a bucket lets through at once.
+        max_flood_wait (int): Longest FloodWait, in seconds, waited instead of raised.
+        retries (int): Times a request is sent again after a FloodWait.
+        stats (Counter): Calls and deferred calls per priority, FloodWaits and seconds waited.
+    """
+
+    def __init__(self, rates=TELEGRAM_RATE_LIMITS, default_rate=TELEGRAM_DEFAULT_RATE, burst=TELEGRAM_RATE_BURST,
+                 max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT, retries=TELEGRAM_FLOOD_RETRIES):
+        self.rates = rates
+        self.default_rate = default_rate
+        self.burst = burst
+        self.max_flood_wait = max_flood_wait
+        self.retries = retries
+        self.stats = Counter()
+        self._buckets = {}
+        self._paused_until = 0.0
+
+    def install(self, client):
+        """
+        Routes the requests of a client through the scheduler.
+
+        Telethon has no public hook for this, so the private `client._call`, which every
+        request of the client goes through, is replaced on that client instance. This
+        includes requests sent on other connections through it, such as the parts fetched
+        by ParallelDownloader. Telethon's own FloodWait sleep is turned off only for the
+        scheduled requests, which the scheduler pauses together instead; the client's
+        `flood_sleep_threshold` is left alone and still applies to unscheduled requests.
+
+        If `_call` is missing or its signature has changed, the scheduler is not installed
+        and requests are sent as they come, rather than failing.
+
+        Returns:
+            bool: Whether the scheduler was installed.
+        """
+        call = getattr(client, '_call', None)
+        try:
+            parameters = list(inspect.signature(call).parameters) if call else None
+        except (TypeError, ValueError):
+            parameters = None
+        if parameters != CALL_PARAMETERS:
+            logger.warning("This Telethon version has no compatible TelegramClient._call, "
+                           "Telegram requests will not be scheduled")
+            return False
+
+        async def scheduled_call(sender, request, ordered=False, flood_sleep_threshold=None):
+            if not self.schedules(request):
+                return await call(sender, request, ordered, flood_sleep_threshold)
+            return await self.run(request, lambda: call(sender, request, ordered, 0))
+
+        client._call = scheduled_call
+        return True
+
+    def schedules(self, request):
+        """Whether a request goes through the rate limits, rather than being sent right away."""
+        return self.request_name(request) not in UNSCHEDULED_REQUESTS
+
+    @staticmethod
+    def request_name(request):
+        if utils.is_list_like(request):
+            return 'batch'
+        return type(request).__name__
+
+    def _bucket(self, name):
+        if name not in self._buckets:
+            self._buckets[name] = _TokenBucket(self.rates.get(name, self.default_rate), self.burst)
+        return self._buckets[name]
+
+    async def _wait_pause(self):
+        """Waits until the current FloodWait pause is over. Returns whether it waited."""
+        waited = False
+        while self._paused_until > time.monotonic():
+            waited = True
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        return waited
+
+    def pause(self, seconds):
+        """Holds every scheduled request for the given time."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def run(self, request, send):
+        """
+        Sends a request once its bucket and any FloodWait pause allow it.
+
+        Args:
+            request: The Telethon request, or list of requests.
+            send: Coroutine function sending the request.
+
+        Returns:
+            The result of the request.
+        """
+        name = self.request_name(request)
+        if not self.schedules(request):
+            return await send()
+        priority = PRIORITY_NAMES[_priority.get()]
+        self.stats[f'calls_{priority}'] += 1
+        for attempt in range(self.retries + 1):
+            started_at = time.monotonic()
+            deferred = await self._wait_pause()
+            deferred = await self._bucket(name).acquire(_priority.get()) or deferred
+            deferred = await self._wait_pause() or deferred
+            if deferred:
+                self.stats[f'deferred_{priority}'] += 1
+                self.stats['wait_seconds'] += time.monotonic() - started_at
+            try:
+                return await send()
+            except errors.FloodWaitError as e:
+                self.stats['flood_waits'] += 1
+                if e.seconds > self.max_flood_wait:
+                    logger.error(f"FloodWait of {e.seconds}s on {name} is too long to wait, giving up the request")
+                    raise
+                self.pause(e.seconds)
+                if attempt == self.retries:
+                    logger.error(f"FloodWait of {e.seconds}s on {name}, giving up the request after "
+                                 f"{self.retries} retries")
+                    raise
+                logger.warning(f"FloodWait of {e.seconds}s on {name}: pausing every Telegram request")
+
+    def register_metrics(self, metrics):
+        """Exposes the scheduler counters on a metrics registry."""
+        def by_priority(kind):
+            return {name: self.stats[f'{kind}_{name}'] for name in PRIORITY_NAMES.values()}
+
+        metrics.register('mirror_telegram_calls_total', 'counter', 'Scheduled Telegram requests.',
+                         lambda: by_priority('calls'), 'priority')
+        metrics.register('mirror_telegram_deferred_total', 'counter', 'Telegram requests that waited for '
+                         'their rate limit or a FloodWait.', lambda: by_priority('deferred'), 'priority')
+        metrics.register('mirror_telegram_flood_waits_total', 'counter', 'FloodWait errors received.',
+                         lambda: self.stats['flood_waits'])
+        metrics.register('mirror_telegram_wait_seconds_total', 'counter', 'Seconds Telegram requests waited.',
+                         lambda: self.stats['wait_seconds'])
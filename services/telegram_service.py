@@ -1,11 +1,21 @@
+import asyncio
 import os
 import logging
 from telethon import TelegramClient, events
 from telethon.errors import ChannelInvalidError, ChannelForumMissingError
-from telethon.tl.functions.channels import JoinChannelRequest, GetForumTopicsByIDRequest, GetForumTopicsRequest
-from telethon.tl.types import MessageMediaPoll, ForumTopic, Channel, User
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.types import MessageMediaPoll, Channel, User
 from config import *
 from models.identifier import Identifier
+from models.route import Route
+from services.dialog_index import DialogIndex
+from services.load_shedder import LoadShedder
+from services.message_coalescer import MessageCoalescer
+from services.message_pipeline import MessagePipeline
+from services.message_router import MessageRouter
+from services.message_sync import MessageSync
+from utils.checkpoint_store import CheckpointStore
+from utils.metrics import default_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,18 +30,40 @@ class TelegramService:
         client: The Telethon client for interacting with Telegram.
         media_processor: Responsible for processing and storing media files.
         message_handler: Handles message formatting and sending to Discord.
+        pipeline_workers (int): Number of concurrent workers preparing messages while mirroring.
+        dialog_index (DialogIndex): Persistent index of the groups and forum topics.
+        scheduler (TelegramScheduler): Paces and prioritizes the requests of the client, or None.
     """
 
-    def __init__(self, api_id, api_hash, media_processor, message_handler):
+    def __init__(self, api_id, api_hash, media_processor, message_handler, pipeline_workers=PIPELINE_WORKERS,
+                 dialog_index=None, scheduler=None):
         self.client = TelegramClient(SESSION_NAME, api_id, api_hash)
         self.media_processor = media_processor
         self.message_handler = message_handler
+        self.pipeline_workers = pipeline_workers
+        self.dialog_index = dialog_index or DialogIndex()
+        self.scheduler = scheduler
+        if scheduler:
+            scheduler.install(self.client)
 
-    async def authenticate(self):
-        """Authenticates the user with Telegram, prompting for code if required."""
+    async def authenticate(self, interactive=True):
+        """
+        Authenticates the user with Telegram, prompting for code if required.
+
+        Args:
+            interactive (bool): Whether the user can be prompted; if not, an unauthorized
+                                session is reported instead.
+
+        Returns:
+            bool: True if the session is authorized.
+        """
         await self.client.connect()
-        if not await self.client.is_user_authorized():
-            await self._perform_authentication()
+        if await self.client.is_user_authorized():
+            return True
+        if not interactive:
+            return False
+        await self._perform_authentication()
+        return True
 
     async def _perform_authentication(self):
         """Handles two-factor authentication by requesting and verifying a code."""
@@ -41,12 +73,9 @@ class TelegramService:
         await self.client.sign_in(phone_number, code)
 
     async def list_groups(self):
-        """Lists all accessible Telegram channel groups."""
-        groups = []
-        async for dialog in self.client.iter_dialogs():
-            if dialog.is_channel:
-                groups.append(dialog)
-        return groups
+        """Lists all accessible Telegram channel groups, reading only the dialogs changed since the last listing."""
+        await self.dialog_index.refresh_dialogs(self.client)
+        return self.dialog_index.dialogs()
 
     async def get_group(self, group: Identifier):
         """
@@ -66,21 +95,21 @@ class TelegramService:
 
     async def subgroup_name(self, group, subgroup_id):
         """
-        Retrieves the name of a subgroup based on its ID.
+        Retrieves the name of a subgroup based on its ID, from the topic index when it is known.
 
         Args:
             group: The main group entity.
             subgroup_id: ID of the subgroup.
         """
-        subgroup = await self.client(GetForumTopicsByIDRequest(
-            channel=group,
-            topics=[subgroup_id]
-        ))
-        return subgroup.topics[0].title if isinstance(subgroup.topics[0], ForumTopic) else None
+        title = self.dialog_index.topic_title(group, subgroup_id)
+        if title is None and await self.subgroups_topics(group) is not None:
+            title = self.dialog_index.topic_title(group, subgroup_id)
+        return title
 
     async def subgroups_topics(self, group):
         """
         Retrieves topics within a group, handling errors if the group is invalid or lacks forums.
+        Only the topics with messages since the previous call are requested from Telegram.
 
         Args:
             group: Telegram group entity (e.g., Channel or User).
@@ -89,14 +118,8 @@ class TelegramService:
             return None
         else:
             try:
-                subgroups = await self.client(GetForumTopicsRequest(
-                    channel=group,
-                    offset_date=None,
-                    offset_id=0,
-                    offset_topic=0,
-                    limit=100
-                ))
-                return subgroups.topics
+                await self.dialog_index.refresh_topics(self.client, group)
+                return self.dialog_index.topics(group)
             except (ChannelInvalidError, ChannelForumMissingError):
                 return None
 
@@ -114,27 +137,86 @@ class TelegramService:
         filter messages by reply threads.
 
         Args:
-            group_id: ID of the group to mirror.
+            group_id: Marked ID of the group to mirror, as returned by `utils.get_peer_id`.
             discord_service: Service handling the delivery of messages to Discord.
             message_id: ID of a message to filter mirroring by replies (optional).
         """
+        route = Route(group_id, [discord_service.default_destination()], message_id)
+        await self.mirror_routes(MessageRouter([route]), discord_service)
+
+    async def mirror_routes(self, router, discord_service):
+        """
+        Starts mirroring every chat of a routing table with a single client, sending
+        each message to the Discord destinations of its chat and topic. Albums are
+        received as a single event and mirrored as one post. When the message handler
+        has a message map, edits and deletions are mirrored onto the posted messages.
+
+        Args:
+            router (MessageRouter): Routing table of chats, topics and destinations.
+            discord_service: Service handling the delivery of messages to Discord.
+        """
         await self._ensure_save_directory_exists()
+        coalescer = MessageCoalescer(self.message_handler, discord_service) if COALESCE_ENABLED else None
+        shedder = LoadShedder(self.message_handler) if BACKPRESSURE_ENABLED else None
+        pipeline = MessagePipeline(self.message_handler, discord_service, self.client, workers=self.pipeline_workers,
+                                   coalescer=coalescer, shedder=shedder)
+        metrics = default_metrics()
+        pipeline.register_metrics(metrics)
+        if shedder:
+            shedder.register_metrics(metrics)
+        if self.scheduler:
+            self.scheduler.register_metrics(metrics)
         async with (self.client):
-            @self.client.on(events.NewMessage(chats=group_id))
+            await router.resolve(self.client, CheckpointStore(CHAT_ID_CACHE_PATH))
+            self.message_handler.entity_cache.register(self.client)
+
+            async def receive(event):
+                metrics.inc('mirror_events_received_total')
+                with metrics.timer('event_receive'):
+                    destinations = router.destinations_for(event)
+                    if destinations:
+                        await pipeline.submit(event, destinations)
+
+            @self.client.on(events.NewMessage(chats=router.chats()))
             async def handler(event):
-                if not isinstance(event.message.media, MessageMediaPoll):
-                    reply_to = getattr(event.message, 'reply_to', None)
-                    reply_to_top_id = getattr(reply_to, 'reply_to_top_id', None)
-                    reply_to_msg_id = getattr(reply_to, 'reply_to_msg_id', None)
-
-                    if message_id and reply_to:
-                        if reply_to_top_id == message_id or reply_to_msg_id == message_id:
-                            await self.message_handler.handle_new_message(discord_service, self.client, event)
-                    elif not reply_to or not message_id:
-                        await self.message_handler.handle_new_message(discord_service, self.client, event)
-
-            print(f"Mirroring messages from group {group_id}. Press Ctrl+C to stop.")
-            await self.client.run_until_disconnected()
+                if not isinstance(event.message.media, MessageMediaPoll) and not event.message.grouped_id:
+                    await receive(event)
+
+            @self.client.on(events.Album(chats=router.chats()))
+            async def album_handler(event):
+                await receive(event)
+
+            message_map = self.message_handler.message_map
+            sync = MessageSync(discord_service, message_map,
+                               self.message_handler.recent_messages) if message_map else None
+            if sync:
+                @self.client.on(events.MessageEdited(chats=router.chats()))
+                async def edit_handler(event):
+                    sync.message_edited(event)
+
+                # Deletions outside channels carry no chat, so they cannot be filtered by chat;
+                # only messages found in the message map are deleted.
+                @self.client.on(events.MessageDeleted())
+                async def delete_handler(event):
+                    await sync.message_deleted(event)
+
+            print(f"Mirroring messages from {len(router.chats())} chat(s). Press Ctrl+C to stop.")
+            pipeline.start()
+            outbox = self.message_handler.outbox
+            retries = asyncio.create_task(
+                outbox.run_retries(discord_service, self.client, self.media_processor)) if outbox else None
+            try:
+                await self.client.run_until_disconnected()
+            finally:
+                await pipeline.stop()
+                if sync:
+                    await sync.flush()
+                    await message_map.close()
+                if retries:
+                    retries.cancel()
+                    await asyncio.gather(retries, return_exceptions=True)
+                    await outbox.close()
+                await discord_service.close()
 
     async def _ensure_save_directory_exists(self):
         """Ensures the directory for saving media files exists."""
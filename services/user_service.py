@@ -1,31 +1,214 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from config import (AVATAR_CACHE_SIZE, AVATAR_CACHE_TTL, AVATAR_DISK_CACHE, AVATAR_CACHE_FOLDER,
+                    AVATAR_DISK_CACHE_MAX_BYTES)
+from services.entity_cache import CachedEntity
+from services.telegram_scheduler import telegram_priority, AVATAR
 from utils.image_to_base64 import convert_image_to_base64
+from utils.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
 
 
 class UserService:
     """
     Handles user-related services, particularly for managing user profile images.
 
+    Converted avatars are cached in memory, and optionally on disk, keyed by the user id
+    and the Telegram photo id, so a user changing their photo naturally invalidates the entry.
+    A photo that cannot be downloaded, e.g. hidden by privacy settings, is cached in memory
+    as None, so it is not requested again for every message until the entry expires.
+    On disk, files older than the cache TTL are deleted, and the least recently used ones
+    once the folder exceeds `disk_cache_max_bytes`.
+
     Attributes:
         file_manager: Manages file operations such as downloading and deleting images.
+        avatar_cache (LRUCache): In-memory cache of base64 avatars.
+        disk_cache_folder (str): Folder of the on-disk avatar cache, or None if disabled.
+        disk_cache_max_bytes (int): Size budget of the on-disk avatar cache, in bytes.
+        disk_cache_size (int): Total size of the on-disk avatar cache, in bytes.
+        disk_hits (int): Number of memory misses served from the on-disk cache.
+        encode_stats (dict): Number of avatars encoded and bytes saved compared to PNG.
     """
 
-    def __init__(self, file_manager):
+    def __init__(self, file_manager, cache_size=AVATAR_CACHE_SIZE, cache_ttl=AVATAR_CACHE_TTL,
+                 disk_cache=AVATAR_DISK_CACHE, disk_cache_folder=AVATAR_CACHE_FOLDER,
+                 disk_cache_max_bytes=AVATAR_DISK_CACHE_MAX_BYTES):
         self.file_manager = file_manager
+        self.avatar_cache = LRUCache(cache_size, cache_ttl)
+        self.disk_cache_folder = disk_cache_folder if disk_cache else None
+        self.disk_cache_max_bytes = disk_cache_max_bytes
+        self.disk_cache_size = 0
+        self.disk_hits = 0
+        self.encode_stats = {'images': 0, 'bytes_saved': 0}
+        self._disk_entries = OrderedDict()
+        if self.disk_cache_folder:
+            os.makedirs(self.disk_cache_folder, exist_ok=True)
+            self._load_disk_cache()
+
+    @staticmethod
+    def avatar_cache_key(user):
+        """
+        Builds the avatar cache key of a user.
+
+        Args:
+            user (CachedEntity): The sender, whose photo id was read when it was cached,
+                                 or a Telegram user or chat entity.
+
+        Returns:
+            tuple: (user id, photo id), where photo id is None if the user has no photo,
+                   or None if the entity carries no photo information at all.
+        """
+        if isinstance(user, CachedEntity):
+            return (getattr(user.entity, 'id', None), user.photo_id) if hasattr(user.entity, 'photo') else None
+        if not hasattr(user, 'photo'):
+            return None
+        return getattr(user, 'id', None), getattr(user.photo, 'photo_id', None)
 
     async def get_user_image_data(self, client, user, event):
         """
-        Downloads the user's profile photo, converts it to base64, and cleans up the downloaded file.
+        Returns the user's profile photo as base64, downloading and converting it only on a cache miss.
 
         Args:
             client: The Telegram client used to interact with the Telegram API.
-            user: The user object whose profile photo is to be downloaded.
+            user: The user whose profile photo is to be downloaded, as a CachedEntity or an entity.
             event: The event context, used for error handling or logging.
 
         Returns:
-            str: Base64 representation of the user's profile photo.
+            str: Base64 representation of the user's profile photo, or None if the user has none.
         """
+        key = self.avatar_cache_key(user)
+        if isinstance(user, CachedEntity):
+            user = user.entity
+        if key is None:
+            return await self._download_user_image_data(client, user, event)
+        if key[1] is None:
+            return None
+
+        cached = self.avatar_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        img = self._read_disk_cache(key)
+        if img is None:
+            img = await self._download_user_image_data(client, user, event)
+            if img is not None:
+                self._write_disk_cache(key, img)
+        self.avatar_cache.set(key, img)
+        return img
+
+    async def _download_user_image_data(self, client, user, event):
+        """Downloads the user's profile photo, converts it to base64, and cleans up the downloaded file."""
         photo_path = self.file_manager.generate_filename('img', '.jpg')
-        await client.download_profile_photo(user, file=photo_path)
-        img = await convert_image_to_base64(photo_path)
+        with telegram_priority(AVATAR):
+            await client.download_profile_photo(user, file=photo_path)
+        img = await convert_image_to_base64(photo_path, stats=self.encode_stats)
         self.file_manager.delete_file(photo_path, event)
         return img
+
+    def _disk_cache_path(self, key):
+        user_id, photo_id = key
+        return os.path.join(self.disk_cache_folder, f"{user_id}_{photo_id}.b64")
+
+    def _load_disk_cache(self):
+        """Indexes the avatars left by a previous run, least recently used first, dropping expired ones."""
+        files = []
+        for name in os.listdir(self.disk_cache_folder):
+            path = os.path.join(self.disk_cache_folder, name)
+            try:
+                stat = os.stat(path)
+                if self.avatar_cache.ttl and time.time() - stat.st_mtime > self.avatar_cache.ttl:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._disk_entries[path] = size
+            self.disk_cache_size += size
+        self._prune_disk_cache()
+
+    def _forget_disk_entry(self, path):
+        self.disk_cache_size -= self._disk_entries.pop(path, 0)
+
+    def _prune_disk_cache(self):
+        """Deletes the least recently used avatars until the disk cache fits in its budget."""
+        while self.disk_cache_size > self.disk_cache_max_bytes and self._disk_entries:
+            path = next(iter(self._disk_entries))
+            self._forget_disk_entry(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _read_disk_cache(self, key):
+        """
+        Reads an avatar from the on-disk cache.
+
+        Args:
+            key (tuple): The avatar cache key.
+
+        Returns:
+            str: The cached base64 avatar, or None if absent, expired or disabled.
+        """
+        if not self.disk_cache_folder:
+            return None
+        path = self._disk_cache_path(key)
+        try:
+            if self.avatar_cache.ttl and time.time() - os.path.getmtime(path) > self.avatar_cache.ttl:
+                self._forget_disk_entry(path)
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as file:
+                img = file.read() or None
+            if img:
+                self.disk_hits += 1
+                if path in self._disk_entries:
+                    self._disk_entries.move_to_end(path)
+            return img
+        except FileNotFoundError:
+            self._forget_disk_entry(path)
+            return None
+        except Exception as e:
+            logger.error(f"Error reading avatar cache {path}: {e}")
+            return None
+
+    def _write_disk_cache(self, key, img):
+        """Stores an avatar in the on-disk cache, if enabled."""
+        if not self.disk_cache_folder:
+            return
+        path = self._disk_cache_path(key)
+        try:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(img)
+        except Exception as e:
+            logger.error(f"Error writing avatar cache {path}: {e}")
+            return
+        self._forget_disk_entry(path)
+        self._disk_entries[path] = os.path.getsize(path)
+        self.disk_cache_size += self._disk_entries[path]
+        self._prune_disk_cache()
+
+    def cache_stats(self):
+        """
+        Returns the avatar cache counters.
+
+        Returns:
+            dict: Size, hits, misses and hit rate of the in-memory avatar cache,
+                  plus the number of misses served from the disk cache and its size in bytes.
+        """
+        return {**self.avatar_cache.stats(), 'disk_hits': self.disk_hits, 'disk_bytes': self.disk_cache_size}
+
+    def register_metrics(self, metrics):
+        """Exposes the avatar cache counters and the bytes saved by avatar encoding on a metrics registry."""
+        metrics.register('mirror_avatar_cache_lookups_total', 'counter', 'Avatar lookups by where they were '
+                         'answered from.', lambda: {'memory': self.avatar_cache.hits, 'disk': self.disk_hits,
+                                                     'miss': self.avatar_cache.misses - self.disk_hits}, 'result')
+        metrics.register('mirror_avatar_cache_bytes', 'gauge', 'Size of the on-disk avatar cache.',
+                         lambda: self.disk_cache_size)
+        metrics.register('mirror_avatar_encoding_bytes_saved_total', 'counter', 'Bytes saved by encoding '
+                         'avatars in a smaller format than PNG.', lambda: self.encode_stats['bytes_saved'])
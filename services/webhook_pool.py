@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+
+class WebhookPool:
+    """
+    A pool of webhooks posting to the same Discord channel, with sticky user assignment.
+
+    Each user keeps posting through the same webhook, so its avatar only has to be set
+    once. Users are told apart by their Telegram id, so two senders with the same
+    display name never share a webhook. When a new user arrives and every webhook is taken, the webhook of the least
+    recently active user is reassigned. The pool also remembers the avatar each webhook
+    currently has, so an avatar update is only needed when it actually changes.
+
+    Attributes:
+        webhook_urls (list): URLs of the webhooks in the pool.
+        stats (dict): Counters of assignments, reassignments and avatar updates.
+    """
+
+    _NO_AVATAR = object()
+
+    def __init__(self, webhook_urls):
+        self.webhook_urls = list(dict.fromkeys(webhook_urls))
+        self.stats = {'assignments': 0, 'reassignments': 0, 'avatar_updates': 0}
+        self._assignments = OrderedDict()
+        self._free = list(self.webhook_urls)
+        self._avatars = {}
+
+    def assign(self, user_key, avatar):
+        """
+        Returns the webhook a user posts through, assigning one if needed.
+
+        Args:
+            user_key: Identifies the user, e.g. the Telegram sender id; the display name is
+                      only used for presentation, so a rename keeps the webhook.
+            avatar (str): The avatar data the user's posts need, or None if the post
+                          carries its own `avatar_url`.
+
+        Returns:
+            tuple: (webhook URL, whether its avatar has to be updated to `avatar`).
+        """
+        webhook_url = self._assignments.get(user_key)
+        if webhook_url:
+            self._assignments.move_to_end(user_key)
+        else:
+            self.stats['assignments'] += 1
+            if self._free:
+                webhook_url = self._free.pop(0)
+            else:
+                _, webhook_url = self._assignments.popitem(last=False)
+                self.stats['reassignments'] += 1
+            self._assignments[user_key] = webhook_url
+        needs_update = avatar is not None and self._avatars.get(webhook_url, self._NO_AVATAR) != avatar
+        if needs_update:
+            self.stats['avatar_updates'] += 1
+        if avatar is not None:
+            self._avatars[webhook_url] = avatar
+        return webhook_url, needs_update
+
+    def forget_avatar(self, webhook_url):
+        """
+        Forgets the avatar of a webhook, e.g. after a failed update, so it is set again next time.
+
+        Args:
+            webhook_url (str): The webhook whose avatar is unknown.
+        """
+        self._avatars.pop(webhook_url, None)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest_asyncio
+
+# The modules are imported from the repository root, like main.py does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_discord import FakeDiscordServer  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def discord_server():
+    """A local fake Discord webhook API."""
+    server = FakeDiscordServer(retry_after=0.01)
+    await server.start()
+    yield server
+    await server.stop()
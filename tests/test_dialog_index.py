@@ -0,0 +1,86 @@
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from telethon.tl.types import ForumTopic, ForumTopicDeleted
+
+from services.dialog_index import DialogIndex, DialogEntry
+
+pytestmark = pytest.mark.asyncio
+
+
+def dialog(dialog_id, title, timestamp, is_channel=True):
+    return SimpleNamespace(id=dialog_id, title=title, date=datetime.fromtimestamp(timestamp, timezone.utc),
+                           pinned=False, is_channel=is_channel, entity=SimpleNamespace(username=None))
+
+
+def topic(topic_id, title, top_message):
+    # Built without __init__, whose parameters change with the Telegram layer.
+    result = ForumTopic.__new__(ForumTopic)
+    result.__dict__.update(id=topic_id, title=title, top_message=top_message, pinned=False)
+    return result
+
+
+class FakeClient:
+    def __init__(self, dialogs=(), topics=()):
+        self.dialogs = list(dialogs)
+        self.topics = list(topics)
+        self.dialogs_read = 0
+        self.topic_requests = 0
+
+    async def iter_dialogs(self):
+        for item in sorted(self.dialogs, key=lambda item: item.date, reverse=True):
+            self.dialogs_read += 1
+            yield item
+
+    async def __call__(self, request):
+        self.topic_requests += 1
+        topics = sorted(self.topics, key=lambda item: getattr(item, 'top_message', 0), reverse=True)
+        return SimpleNamespace(topics=topics, messages=[])
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DialogIndex(str(tmp_path / 'index.json'), full_refresh_interval=3600, page_size=100)
+
+
+async def test_incremental_dialog_refresh_stops_at_the_watermark(index):
+    client = FakeClient([dialog(-1001, 'old', 1000), dialog(-1002, 'busy', 2000), dialog(5, 'user', 3000, False)])
+    await index.refresh_dialogs(client)
+    assert [entry.id for entry in index.dialogs()] == [-1002, -1001]
+    client.dialogs.append(dialog(-1003, 'new', 4000))
+    client.dialogs_read = 0
+    await index.refresh_dialogs(client)
+    assert [entry.title for entry in index.dialogs()] == ['new', 'busy', 'old']
+    assert client.dialogs_read == 2
+
+
+async def test_full_dialog_refresh_drops_left_channels(index):
+    client = FakeClient([dialog(-1001, 'left', 1000), dialog(-1002, 'kept', 2000)])
+    await index.refresh_dialogs(client)
+    client.dialogs = [dialog(-1002, 'kept', 2000)]
+    await index.refresh_dialogs(client, full=True)
+    assert [entry.id for entry in index.dialogs()] == [-1002]
+
+
+async def test_topics_are_read_incrementally(index):
+    forum = DialogEntry(-1001, 'forum')
+    client = FakeClient(topics=[topic(1, 'General', 10), topic(2, 'News', 20)])
+    await index.refresh_topics(client, forum)
+    assert [(entry.id, entry.title) for entry in index.topics(forum)] == [(2, 'News'), (1, 'General')]
+    client.topics = [topic(1, 'General', 30), topic(2, 'Renamed', 20), ForumTopicDeleted(id=3)]
+    await index.refresh_topics(client, forum)
+    assert index.topic_title(forum, 1) == 'General'
+    assert index.topic_title(forum, 2) == 'News'
+
+
+async def test_topics_renamed_without_a_message_are_picked_up_by_the_full_refresh(index):
+    forum = DialogEntry(-1001, 'forum')
+    client = FakeClient(topics=[topic(1, 'General', 10), topic(2, 'News', 20)])
+    await index.refresh_topics(client, forum)
+    client.topics = [topic(2, 'Announcements', 20)]
+    entry = index.store.get('topics:-1001')
+    entry['refreshed_at'] = time.time() - 7200
+    await index.refresh_topics(client, forum)
+    assert [(entry.id, entry.title) for entry in index.topics(forum)] == [(2, 'Announcements')]
@@ -0,0 +1,40 @@
+import pytest
+
+from models.content import Content
+from services.discord_service import DiscordService
+
+pytestmark = pytest.mark.asyncio
+
+
+def content(text):
+    result = Content('user', 1)
+    result.set_content(text)
+    result.set_avatar_url('https://example.test/avatar.png')
+    return result
+
+
+async def test_one_session_and_connection_pool_for_every_send(discord_server):
+    service = DiscordService(discord_server.webhook_url())
+    try:
+        session = await service.get_session()
+        connector = session.connector
+        for index in range(5):
+            assert await service.send_message(content(f"message {index}"))
+            assert await service.get_session() is session
+            assert session.connector is connector
+        assert service.connection_stats['created'] == 1
+        assert service.connection_stats['reused'] == 4
+        assert service.connection_reuse_ratio() == 0.8
+    finally:
+        await service.close()
+
+
+async def test_close_is_idempotent_and_a_new_session_is_created_after(discord_server):
+    service = DiscordService(discord_server.webhook_url())
+    first = await service.get_session()
+    await service.close()
+    await service.close()
+    assert first.closed
+    second = await service.get_session()
+    assert second is not first and not second.closed
+    await service.close()
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+from telethon.tl.types import UpdateUserName
+
+from services.entity_cache import EntityCache
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeMessage:
+    """A message whose sender is attached or has to be fetched."""
+
+    def __init__(self, sender_id, sender=None, fetched=None):
+        self.sender_id = sender_id
+        self.sender = sender
+        self.fetched = fetched
+        self.fetches = 0
+
+    async def get_sender(self):
+        self.fetches += 1
+        return self.fetched
+
+
+def user(user_id, name='Ana', photo_id=None):
+    return SimpleNamespace(id=user_id, first_name=name, last_name=None, username=None,
+                           photo=SimpleNamespace(photo_id=photo_id) if photo_id else None)
+
+
+async def test_attached_senders_fill_the_cache():
+    cache = EntityCache()
+    first = await cache.get_sender(FakeMessage(1, sender=user(1, photo_id=10)))
+    assert (first.name, first.photo_id) == ('Ana', 10)
+    message = FakeMessage(1, fetched=user(1, 'Other'))
+    assert await cache.get_sender(message) is first
+    assert message.fetches == 0
+    assert cache.attached == 1
+    assert cache.cache.hits == 1
+
+
+async def test_missing_senders_are_fetched_once():
+    cache = EntityCache()
+    message = FakeMessage(2, fetched=user(2, 'Bea'))
+    assert (await cache.get_sender(message)).name == 'Bea'
+    assert (await cache.get_sender(message)).name == 'Bea'
+    assert message.fetches == 1
+
+
+async def test_user_updates_invalidate_the_sender():
+    cache = EntityCache()
+    await cache.get_sender(FakeMessage(3, sender=user(3, 'Old')))
+    await cache._on_update(UpdateUserName(user_id=3, first_name='New', last_name='', usernames=[]))
+    message = FakeMessage(3, fetched=user(3, 'New'))
+    assert (await cache.get_sender(message)).name == 'New'
+    assert message.fetches == 1
@@ -0,0 +1,70 @@
+import base64
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from services.media_processor import MediaProcessor
+from utils.image_encoder import encode_image
+from utils.image_to_base64 import convert_image_to_base64
+
+
+def gradient(mode='RGB', side=200):
+    image = Image.new(mode, (side, side))
+    image.putdata([(x, y, (x + y) // 2, 128)[:len(mode)] for y in range(side) for x in range(side)])
+    return image
+
+
+def photo(side=200):
+    noise = random.Random(0)
+    return Image.frombytes('RGB', (side, side), bytes(noise.getrandbits(8) for _ in range(side * side * 3)))
+
+
+def saved(image, image_format='PNG', **params):
+    buffered = BytesIO()
+    image.save(buffered, format=image_format, **params)
+    return buffered.getvalue()
+
+
+def test_smallest_format_is_chosen_and_metadata_is_stripped():
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera maker'
+    source = saved(gradient(), 'JPEG', quality=95, exif=exif)
+    data, image_format, sizes = encode_image(source, ('JPEG', 'WEBP', 'PNG'), max_size=(75, 75))
+    assert len(data) == min(sizes.values()) < sizes['PNG']
+    with Image.open(BytesIO(data)) as image:
+        assert image.format == image_format
+        assert max(image.size) == 75
+        assert not image.getexif()
+
+
+def test_transparent_images_are_not_encoded_as_jpeg():
+    source = saved(gradient('RGBA'))
+    _, image_format, sizes = encode_image(source, ('JPEG', 'WEBP', 'PNG'))
+    assert 'JPEG' not in sizes
+    with pytest.raises(ValueError):
+        encode_image(source, ('JPEG',))
+
+
+@pytest.mark.asyncio
+async def test_avatar_data_uri_has_the_type_of_its_format(tmp_path):
+    path = tmp_path / 'avatar.png'
+    photo().save(path)
+    stats = {'images': 0, 'bytes_saved': 0}
+    data_uri = await convert_image_to_base64(str(path), stats=stats)
+    header, encoded = data_uri.split(',', 1)
+    with Image.open(BytesIO(base64.b64decode(encoded))) as image:
+        assert header == f'data:{Image.MIME[image.format]};base64'
+    assert stats['images'] == 1
+    assert stats['bytes_saved'] > 0
+
+
+@pytest.mark.asyncio
+async def test_photos_are_reencoded_only_above_the_threshold():
+    processor = MediaProcessor(None, reencode_threshold=50_000)
+    source = saved(photo(300))
+    assert await processor._reencode(source, 40_000) is None
+    data, extension = await processor._reencode(source, len(source))
+    assert extension in ('.jpg', '.webp')
+    assert processor.encode_stats == {'images': 1, 'bytes_saved': len(source) - len(data)}
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models.attachment import Attachment
+from models.content import Content
+from models.prepared_message import PreparedMessage
+from services.load_shedder import LoadShedder, BLOCK, SUMMARY, PLACEHOLDER, PREPARE, SKIP
+
+pytestmark = pytest.mark.asyncio
+
+KEY = (-100, None)
+
+
+def event(message_id, media_size=None):
+    message = SimpleNamespace(id=message_id, message='text', media=media_size and SimpleNamespace(size=media_size))
+    return SimpleNamespace(chat_id=KEY[0], message=message, messages=None)
+
+
+class FakeHandler:
+    def __init__(self):
+        self.media_processor = SimpleNamespace(held_bytes=lambda message, shared: (0, message.media.size))
+        self.discarded = []
+
+    def discard_prepared_message(self, prepared):
+        self.discarded.append(prepared)
+
+
+def prepared_for(item, attachments=()):
+    content = Content('user')
+    content.set_content('text')
+    prepared = PreparedMessage(item, 'user', None, content)
+    for attachment in attachments:
+        prepared.add_attachment(attachment, temp=False)
+    return prepared
+
+
+async def test_message_cap_blocks_until_a_message_is_released():
+    shedder = LoadShedder(FakeHandler(), max_messages=1, message_policy=BLOCK)
+    first, second = event(1), event(2)
+    assert await shedder.before_prepare(KEY, first, None, lambda: False) == PREPARE
+    waiting = asyncio.create_task(shedder.before_prepare(KEY, second, None, lambda: False))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    shedder.release(first)
+    assert await asyncio.wait_for(waiting, 1) == PREPARE
+    assert shedder.pending['messages'] == 1
+    assert shedder.stats['blocked'] == 1
+
+
+async def test_awaited_message_is_never_blocked():
+    shedder = LoadShedder(FakeHandler(), max_messages=1, message_policy=BLOCK)
+    await shedder.before_prepare(KEY, event(1), None, lambda: False)
+    assert await asyncio.wait_for(shedder.before_prepare(KEY, event(2), None, lambda: True), 1) == PREPARE
+
+
+async def test_summary_skips_and_notes_the_count():
+    shedder = LoadShedder(FakeHandler(), max_messages=1, message_policy=SUMMARY)
+    first = event(1)
+    await shedder.before_prepare(KEY, first, None, lambda: False)
+    assert await shedder.before_prepare(KEY, event(2), None, lambda: False) == SKIP
+    assert await shedder.before_prepare(KEY, event(3), None, lambda: False) == SKIP
+    shedder.release(first)
+    prepared = prepared_for(event(4))
+    shedder.before_send(KEY, prepared)
+    assert prepared.content.content.startswith('[2 message(s) skipped')
+
+
+async def test_placeholder_is_decided_before_download():
+    shedder = LoadShedder(FakeHandler(), max_disk_bytes=100, media_policy=PLACEHOLDER)
+    assert await shedder.before_prepare(KEY, event(1, media_size=60), None, lambda: False) == PREPARE
+    assert shedder.pending['disk_bytes'] == 60
+    assert await shedder.before_prepare(KEY, event(2, media_size=60), None, lambda: False) == PLACEHOLDER
+    assert shedder.pending == {'messages': 2, 'bytes': 0, 'disk_bytes': 60}
+    assert shedder.stats['media_replaced'] == 1
+
+
+@pytest.mark.parametrize('cached', [False, True])
+async def test_files_on_disk_count_against_the_disk_cap(tmp_path, cached):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'x' * 50)
+    shedder = LoadShedder(FakeHandler(), max_disk_bytes=1000, media_policy=BLOCK)
+    item = event(1)
+    item.message.media = None
+    await shedder.before_prepare(KEY, item, None, lambda: False)
+    shedder.admit(KEY, prepared_for(item, [Attachment.from_path(str(path), cached=cached)]))
+    assert shedder.pending['disk_bytes'] == 50
+    shedder.release(item)
+    assert shedder.pending == {'messages': 0, 'bytes': 0, 'disk_bytes': 0}
+
+
+async def test_media_of_unknown_size_over_the_cap_is_replaced_after_download():
+    handler = FakeHandler()
+    shedder = LoadShedder(handler, max_bytes=10, media_policy=PLACEHOLDER)
+    item = event(1)
+    item.message.media = None
+    await shedder.before_prepare(KEY, item, None, lambda: False)
+    prepared = prepared_for(item, [Attachment('photo.jpg', data=b'x' * 20)])
+    shedder.admit(KEY, prepared)
+    assert prepared.attachments == []
+    assert handler.discarded == [prepared]
+    assert prepared.notes_for(None) == ['[photo.jpg (20 B) not mirrored: Discord is falling behind]']
+    assert shedder.pending['bytes'] == 0
@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from services.dialog_index import DialogIndex
+from services.telegram_service import TelegramService
+
+
+class FakeClient:
+    async def iter_dialogs(self):
+        yield SimpleNamespace(id=-1001234567890, title='channel', date=datetime.now(timezone.utc), pinned=False,
+                              is_channel=True, entity=SimpleNamespace(username='channel'))
+
+
+class FakeTelegramService:
+    def __init__(self, index_path):
+        self.client = FakeClient()
+        self.dialog_index = DialogIndex(index_path)
+        self.mirrored = []
+
+    async def mirror_group_messages(self, chat_id, discord_service, sub_group_id):
+        self.mirrored.append((chat_id, sub_group_id))
+
+
+@pytest.mark.asyncio
+async def test_listed_group_starts_mirroring_by_marked_id(tmp_path):
+    telegram_service = FakeTelegramService(str(tmp_path / 'index.json'))
+    groups = await TelegramService.list_groups(telegram_service)
+    await main.start_mirroring_group(groups[0], telegram_service, None, None)
+    assert telegram_service.mirrored == [(-1001234567890, None)]
@@ -0,0 +1,52 @@
+import os
+
+from utils.media_cache import MediaCache
+
+
+def add(cache, key, size, digest=None):
+    temp_path = cache.temp_path(key)
+    with open(temp_path, 'wb') as file:
+        file.write(b'x' * size)
+    return cache.add(key, temp_path, '.bin', digest)
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10, use_hash=False)
+    first = add(cache, ('doc', 1), 6)
+    second = add(cache, ('doc', 2), 6)
+    assert not os.path.exists(first)
+    assert cache.get(('doc', 2)) == second
+    assert cache.get(('doc', 1)) is None
+    assert cache.size == 6
+
+
+def test_pinned_files_are_kept_until_unpinned(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10, use_hash=False)
+    cache.pin(('doc', 1))
+    first = add(cache, ('doc', 1), 6)
+    add(cache, ('doc', 2), 6)
+    add(cache, ('doc', 3), 6)
+    assert os.path.exists(first)
+    assert cache.stats['evictions'] == 1
+    cache.unpin(first)
+    assert not os.path.exists(first)
+    assert cache.size == 6
+
+
+def test_cached_files_survive_a_restart(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10, use_hash=False)
+    path = add(cache, ('doc', 1), 4)
+    with open(cache.temp_path(('doc', 2)), 'wb') as file:
+        file.write(b'partial')
+    restarted = MediaCache(str(tmp_path), max_bytes=10, use_hash=False)
+    assert restarted.get(('doc', 1)) == path
+    assert restarted.size == 4
+    assert not os.path.exists(cache.temp_path(('doc', 2)))
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=100, use_hash=True)
+    first = add(cache, ('doc', 1), 6, digest='abc')
+    second = add(cache, ('doc', 2), 6, digest='abc')
+    assert os.path.samefile(first, second)
+    assert cache.stats['hash_matches'] == 1
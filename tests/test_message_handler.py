@@ -0,0 +1,54 @@
+import random
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from telethon.tl.types import MessageMediaPhoto
+
+from models.prepared_message import PreparedMessage
+from models.route import Destination
+from services.media_policy import DOWNSCALE, MediaPolicy, MediaRule
+from services.media_processor import MediaProcessor
+from services.message_handler import MessageHandler
+from utils.file_manager import FileManager
+
+
+class FakeClient:
+    def __init__(self, data):
+        self.data = data
+        self.downloads = 0
+
+    async def download_media(self, message, file=None, thumb=None):
+        self.downloads += 1
+        return self.data
+
+
+def noise_jpeg(side):
+    image = Image.frombytes('RGB', (side, side), bytes(random.getrandbits(8) for _ in range(side * side * 3)))
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=95)
+    return buffered.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_downscaled_images_fit_the_limit_of_each_destination(tmp_path):
+    file_manager = FileManager()
+    file_manager.base_folder = str(tmp_path)
+    policy = MediaPolicy(rules=[MediaRule('image/*', DOWNSCALE)], max_upload_size=10 ** 9)
+    handler = MessageHandler(MediaProcessor(file_manager, policy=policy, reencode_threshold=None), None)
+    large = Destination('https://discord.test/large', max_upload_size=60_000)
+    same = Destination('https://discord.test/same', max_upload_size=60_000)
+    small = Destination('https://discord.test/small', max_upload_size=15_000)
+    data = noise_jpeg(400)
+    media = MessageMediaPhoto(photo=SimpleNamespace(sizes=[SimpleNamespace(size=len(data))]))
+    message = SimpleNamespace(chat_id=-100, id=1, media=media)
+    prepared = PreparedMessage(None, 'user', None, None, [large, same, small])
+    client = FakeClient(data)
+    await handler._add_attachments(client, prepared, [message])
+    [shared] = prepared.attachments_for(large)
+    [small_copy] = prepared.attachments_for(small)
+    assert prepared.attachments_for(same) == [shared]
+    assert 15_000 < len(shared.data) <= 60_000
+    assert len(small_copy.data) <= 15_000
+    assert client.downloads == 2
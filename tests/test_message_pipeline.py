@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models.content import Content
+from models.prepared_message import PreparedMessage
+from services.message_coalescer import MessageCoalescer
+from services.message_pipeline import MessagePipeline
+
+pytestmark = pytest.mark.asyncio
+
+
+def event(chat_id, message_id, text='text', delay=0.0, sender_id=1):
+    message = SimpleNamespace(id=message_id, chat_id=chat_id, message=text, sender_id=sender_id, reply_to=None,
+                              reply_to_msg_id=None, media=None)
+    return SimpleNamespace(chat_id=chat_id, message=message, messages=None, delay=delay)
+
+
+class FakeHandler:
+    """Prepares events after their `delay` and records what is sent."""
+
+    def __init__(self, fail_prepare=(), fail_send=False):
+        self.fail_prepare = fail_prepare
+        self.fail_send = fail_send
+        self.sent = []
+
+    async def prepare_message(self, client, event, destinations=None, skip_media_reason=None):
+        await asyncio.sleep(event.delay)
+        if event.message.id in self.fail_prepare:
+            raise RuntimeError('prepare failed')
+        content = Content('user', event.message.sender_id)
+        content.set_content(event.message.message)
+        return PreparedMessage(event, 'user', None, content, destinations)
+
+    async def send_prepared_message(self, discord_service, prepared):
+        self.sent.append((prepared.event.chat_id, prepared.event.message.id, prepared.content.content))
+        return not self.fail_send
+
+    def discard_prepared_message(self, prepared):
+        pass
+
+
+async def run_pipeline(handler, events, coalescer=None, workers=4):
+    processed = []
+    pipeline = MessagePipeline(handler, None, None, workers=workers, coalescer=coalescer,
+                               on_processed=lambda event, delivered: processed.append(
+                                   (event.chat_id, event.message.id, delivered)))
+    pipeline.start()
+    for item in events:
+        await pipeline.submit(item)
+    await pipeline.join()
+    await pipeline.stop()
+    return processed
+
+
+async def test_messages_are_sent_in_order_per_chat():
+    # Later messages are prepared faster, so they are ready before the earlier ones.
+    events = [event(chat_id, message_id, delay=0.05 - message_id * 0.005)
+              for message_id in range(1, 9) for chat_id in (-100, -200)]
+    handler = FakeHandler()
+    processed = await run_pipeline(handler, events)
+    for chat_id in (-100, -200):
+        assert [sent[1] for sent in handler.sent if sent[0] == chat_id] == list(range(1, 9))
+        assert [item[1] for item in processed if item[0] == chat_id] == list(range(1, 9))
+    assert all(item[2] for item in processed)
+
+
+async def test_failed_prepare_is_reported_and_does_not_block_the_chat():
+    handler = FakeHandler(fail_prepare={2})
+    processed = await run_pipeline(handler, [event(-100, message_id) for message_id in (1, 2, 3)])
+    assert [sent[1] for sent in handler.sent] == [1, 3]
+    assert processed == [(-100, 1, True), (-100, 2, False), (-100, 3, True)]
+
+
+async def test_forum_topics_are_ordered_independently():
+    slow, fast = event(-100, 1, delay=0.05), event(-100, 2)
+    slow.message.reply_to = SimpleNamespace(forum_topic=True, reply_to_top_id=10, reply_to_msg_id=10)
+    fast.message.reply_to = SimpleNamespace(forum_topic=True, reply_to_top_id=20, reply_to_msg_id=20)
+    handler = FakeHandler()
+    await run_pipeline(handler, [slow, fast])
+    assert [sent[1] for sent in handler.sent] == [2, 1]
+
+
+async def test_coalesced_messages_report_the_result_of_their_post():
+    handler = FakeHandler(fail_send=True)
+    coalescer = MessageCoalescer(handler, None, window=0.05)
+    processed = await run_pipeline(handler, [event(-100, message_id, text=f"m{message_id}")
+                                             for message_id in (1, 2, 3)], coalescer=coalescer, workers=1)
+    assert handler.sent == [(-100, 1, 'm1\nm2\nm3')]
+    assert sorted(processed) == [(-100, 1, False), (-100, 2, False), (-100, 3, False)]
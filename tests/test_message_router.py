@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from models.route import Destination, Route
+from services.message_router import MessageRouter
+
+CHANNEL_ID = -1001234567890
+GROUP_ID = -1234567890
+
+
+def event(chat_id, reply_to=None):
+    return SimpleNamespace(chat_id=chat_id, message=SimpleNamespace(message='text', reply_to=reply_to))
+
+
+def topic(top_id=None, msg_id=None):
+    return SimpleNamespace(reply_to_top_id=top_id, reply_to_msg_id=msg_id, forum_topic=True)
+
+
+def test_marked_id_matches_only_its_peer():
+    channel = Destination('https://discord.test/channel')
+    router = MessageRouter([Route(CHANNEL_ID, [channel])])
+    assert router.destinations_for(event(CHANNEL_ID)) == [channel]
+    assert router.destinations_for(event(GROUP_ID)) == []
+    assert router.destinations_for(event(1234567890)) == []
+
+
+def test_bare_id_matches_user_group_and_channel():
+    destination = Destination('https://discord.test/any')
+    router = MessageRouter([Route(1234567890, [destination])])
+    for chat_id in (1234567890, GROUP_ID, CHANNEL_ID):
+        assert router.destinations_for(event(chat_id)) == [destination]
+
+
+def test_topic_routes():
+    general = Destination('https://discord.test/general')
+    news = Destination('https://discord.test/news')
+    router = MessageRouter([Route(CHANNEL_ID, [general]), Route(CHANNEL_ID, [news, general], topic_id=42)])
+    assert router.destinations_for(event(CHANNEL_ID)) == [general]
+    assert router.destinations_for(event(CHANNEL_ID, topic(top_id=42, msg_id=50))) == [general, news]
+    assert router.destinations_for(event(CHANNEL_ID, topic(msg_id=42))) == [general, news]
+    assert router.destinations_for(event(CHANNEL_ID, topic(top_id=7, msg_id=8))) == [general]
+
+
+def test_unresolved_routes_are_not_indexed():
+    router = MessageRouter([Route('@somechannel', [Destination('https://discord.test/a')])])
+    assert router.chats() == []
+    assert router.destinations_for(event(CHANNEL_ID)) == []
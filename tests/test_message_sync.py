@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.discord_service import DiscordService
+from services.message_map import MappedMessage
+from services.message_sync import MessageSync
+from services.recent_messages import RecentMessages
+
+WEBHOOK = 'https://discord.test/api/webhooks/1/token'
+
+
+class FakeMessageMap:
+    def __init__(self, posts):
+        self.posts = posts
+        self.removed = []
+
+    async def get(self, chat_id, message_ids):
+        return [post for post in self.posts if post.message_id in message_ids]
+
+    async def remove(self, chat_id, message_ids):
+        self.removed.append((chat_id, list(message_ids)))
+
+
+class FakeDiscord:
+    def __init__(self):
+        self.edits = []
+        self.deletions = []
+
+    async def edit_message(self, webhook_url, message_id, payload, thread_id=None):
+        self.edits.append((message_id, payload['content']))
+        return True
+
+    async def delete_message(self, webhook_url, message_id, thread_id=None):
+        self.deletions.append(message_id)
+        return True
+
+
+def edited(message_id, text):
+    return SimpleNamespace(chat_id=-100, message=SimpleNamespace(id=message_id, message=text))
+
+
+def test_edits_and_deletions_of_a_webhook_share_one_bucket():
+    service = DiscordService(WEBHOOK)
+    assert service._bucket('PATCH', f'{WEBHOOK}/messages/1') is service._bucket('PATCH', f'{WEBHOOK}/messages/2')
+    assert service._bucket('DELETE', f'{WEBHOOK}/messages/1') is not service._bucket('PATCH', f'{WEBHOOK}/messages/1')
+
+
+def test_idle_buckets_are_dropped():
+    service = DiscordService(WEBHOOK, bucket_idle_timeout=10)
+    service._bucket('PATCH', f'{WEBHOOK}/messages/1').last_used -= 20
+    service._bucket('POST', WEBHOOK)
+    assert list(service._buckets) == [('POST', WEBHOOK)]
+
+
+@pytest.mark.asyncio
+async def test_burst_of_edits_is_mirrored_once_with_its_notes():
+    discord = FakeDiscord()
+    sync = MessageSync(discord, FakeMessageMap([MappedMessage(1, WEBHOOK, None, 501, '["*file over the limit*"]')]),
+                       debounce_delay=0.01)
+    for text in ('tpyo', 'typo', 'typo fixed'):
+        sync.message_edited(edited(1, text))
+    await asyncio.sleep(0.05)
+    assert discord.edits == [(501, 'typo fixed\n*file over the limit*')]
+    assert sync.stats['debounced'] == 2
+
+
+@pytest.mark.asyncio
+async def test_unchanged_edits_are_ignored_without_counting_lookups():
+    discord = FakeDiscord()
+    recent = RecentMessages()
+    recent.remember(-100, 1, 'same', 'Ana')
+    sync = MessageSync(discord, FakeMessageMap([MappedMessage(1, WEBHOOK, None, 501)]), recent, debounce_delay=0)
+    sync.message_edited(edited(1, 'same'))
+    await sync.flush()
+    assert discord.edits == []
+    assert sync.stats['unchanged'] == 1
+    assert (recent.hits, recent.misses) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_emptied_message_clears_its_content():
+    discord = FakeDiscord()
+    sync = MessageSync(discord, FakeMessageMap([MappedMessage(1, WEBHOOK, None, 501)]), debounce_delay=0)
+    sync.message_edited(edited(1, ''))
+    await sync.flush()
+    assert discord.edits == [(501, None)]
+
+
+@pytest.mark.asyncio
+async def test_deleted_message_drops_its_pending_edit():
+    discord = FakeDiscord()
+    message_map = FakeMessageMap([MappedMessage(1, WEBHOOK, None, 501), MappedMessage(1, WEBHOOK, None, 502)])
+    sync = MessageSync(discord, message_map, debounce_delay=10)
+    sync.message_edited(edited(1, 'edited'))
+    await sync.message_deleted(SimpleNamespace(chat_id=-100, deleted_ids=[1]))
+    await sync.flush()
+    assert discord.edits == []
+    assert discord.deletions == [501, 502]
+    assert message_map.removed == [(-100, [1])]
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from models.content import Content
+from models.route import Destination
+from services.outbox import Outbox, PENDING, DELIVERED, FAILED
+
+pytestmark = pytest.mark.asyncio
+
+DESTINATION = Destination('https://discord.test/webhook')
+MEDIA_PROCESSOR = SimpleNamespace(media_cache=None, file_manager=None)
+
+
+class FakeDiscord:
+    """Fails the first `failures` sends, then delivers, taking `delay` seconds per send."""
+
+    def __init__(self, failures=0, delay=0):
+        self.failures = failures
+        self.delay = delay
+        self.sent = []
+
+    def default_destination(self):
+        return DESTINATION
+
+    async def send_message(self, content, attachments=None, destination=None, posted=None):
+        self.sent.append(content.text())
+        await asyncio.sleep(self.delay)
+        return len(self.sent) > self.failures
+
+
+def content(text='hello'):
+    result = Content('user', 1)
+    result.set_content(text)
+    return result
+
+
+def status(outbox):
+    outbox._open()
+    return outbox._connection.execute('SELECT status, attempts, next_attempt_at FROM outbox').fetchone()
+
+
+async def stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def test_delivered_message_is_not_sent_twice(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    discord = FakeDiscord()
+    assert await outbox.deliver(discord, -100, 1, content(), [], DESTINATION)
+    assert await outbox.deliver(discord, -100, 1, content(), [], DESTINATION)
+    await outbox.close()
+    assert len(discord.sent) == 1
+    assert outbox.stats['duplicates'] == 1
+    assert status(outbox)[:2] == (DELIVERED, 1)
+
+
+async def test_failed_delivery_is_retried_with_backoff(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), retry_base_delay=10, retry_max_delay=60)
+    started_at = time.time()
+    assert not await outbox.deliver(FakeDiscord(failures=1), -100, 1, content(), [], DESTINATION)
+    await outbox.close()
+    entry_status, attempts, next_attempt_at = status(outbox)
+    assert (entry_status, attempts) == (PENDING, 1)
+    # First retry after half to all of the base delay.
+    assert started_at + 5 <= next_attempt_at <= time.time() + 10
+
+
+async def test_backoff_doubles_up_to_the_maximum(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), max_attempts=10, retry_base_delay=1, retry_max_delay=4)
+    entry_id, _ = await outbox._write(outbox._insert, -100, 1, DESTINATION, content(), [], 0)
+    delays = []
+    for attempts in range(5):
+        before = time.time()
+        await outbox._record_attempt(entry_id, False, attempts)
+        delays.append(status(outbox)[2] - before)
+    await outbox.close()
+    for delay, full in zip(delays, (1, 2, 4, 4, 4)):
+        assert full / 2 - 0.1 <= delay <= full + 0.1
+
+
+@pytest.mark.parametrize('failures, final_status', [(2, DELIVERED), (10, FAILED)])
+async def test_retries_deliver_pending_messages_or_give_up_after_max_attempts(tmp_path, failures, final_status):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), max_attempts=3, retry_base_delay=0, retry_max_delay=0)
+    discord = FakeDiscord(failures=failures)
+    await outbox.deliver(discord, -100, 1, content(), [], DESTINATION)
+    retries = asyncio.create_task(outbox.run_retries(discord, None, MEDIA_PROCESSOR, interval=0.01))
+    await asyncio.sleep(0.2)
+    await stop(retries)
+    await outbox.close()
+    assert len(discord.sent) == 3
+    assert status(outbox)[:2] == (final_status, 3)
+    assert outbox.stats['retried'] == 2
+
+
+async def test_first_sends_are_not_picked_up_by_the_retry_loop(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    discord = FakeDiscord(delay=0.001)
+    retries = asyncio.create_task(outbox.run_retries(discord, None, MEDIA_PROCESSOR, interval=0))
+    results = await asyncio.gather(*(outbox.deliver(discord, -100, message_id, content(f'm{message_id}'), [],
+                                                    DESTINATION) for message_id in range(500)))
+    await stop(retries)
+    await outbox.close()
+    assert all(results)
+    assert max(Counter(discord.sent).values()) == 1
+    assert len(discord.sent) == 500
+    assert outbox.stats['retried'] == 0
+
+
+async def test_delivery_of_a_message_being_retried_waits_for_the_retry(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), retry_base_delay=0, retry_max_delay=0)
+    discord = FakeDiscord(failures=1, delay=0.05)
+    assert not await outbox.deliver(discord, -100, 1, content(), [], DESTINATION)
+    retries = asyncio.create_task(outbox.run_retries(discord, None, MEDIA_PROCESSOR, interval=0.01))
+    while len(discord.sent) < 2:
+        await asyncio.sleep(0.001)
+    assert await outbox.deliver(discord, -100, 1, content(), [], DESTINATION)
+    await stop(retries)
+    await outbox.close()
+    assert len(discord.sent) == 2
+    assert status(outbox)[:2] == (DELIVERED, 2)
+
+
+async def test_lease_of_an_interrupted_first_send_is_released_on_restart(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    await outbox._write(outbox._insert, -100, 1, DESTINATION, content(), [], outbox.send_lease)
+    await outbox.close()
+    restarted = Outbox(str(tmp_path / 'outbox.db'))
+    assert status(restarted)[2] == 0
@@ -0,0 +1,101 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from telethon.tl.types import Document, MessageMediaDocument
+
+from services.parallel_downloader import ParallelDownloader
+
+PART_SIZE = 4096
+CONTENT = os.urandom(PART_SIZE * 5 + 100)
+
+
+class FakeSender:
+    def __init__(self, dc_id):
+        self.dc_id = dc_id
+        self.auth_key = f'key-{dc_id}'
+        self.requests = 0
+        self.disconnected = False
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+class FakeDownloader(ParallelDownloader):
+    """Serves parts from CONTENT instead of opening connections to Telegram."""
+
+    def __init__(self, fail_part=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_part = fail_part
+        self.senders = []
+
+    async def _open(self, client, dc_id, auth_key):
+        sender = FakeSender(dc_id)
+        self.senders.append(sender)
+        return sender
+
+    async def _import_authorization(self, client, sender, auth):
+        pass
+
+    async def _invoke(self, client, sender, request):
+        if request.offset // PART_SIZE == self.fail_part:
+            raise ConnectionError('connection lost')
+        sender.requests += 1
+        return SimpleNamespace(bytes=CONTENT[request.offset:request.offset + request.limit])
+
+
+class FakeClient:
+    def __init__(self, dc_id=2):
+        self.session = SimpleNamespace(dc_id=dc_id, auth_key='home')
+        self.fallbacks = 0
+
+    async def __call__(self, request):
+        return SimpleNamespace(id=1, bytes=b'exported')
+
+    async def download_media(self, message, file=None):
+        self.fallbacks += 1
+        return CONTENT if file is bytes else file
+
+
+def message(dc_id=2, size=len(CONTENT)):
+    document = Document(id=1, access_hash=2, file_reference=b'', date=None, mime_type='video/mp4', size=size,
+                        dc_id=dc_id, attributes=[])
+    return SimpleNamespace(id=10, media=MessageMediaDocument(document=document))
+
+
+@pytest.mark.asyncio
+async def test_parts_are_fetched_over_every_connection_and_written_in_order(tmp_path):
+    downloader = FakeDownloader(connections=3, part_size=PART_SIZE)
+    path = str(tmp_path / 'video.mp4')
+    assert await downloader.download(FakeClient(), message(), path) == path
+    with open(path, 'rb') as file:
+        assert file.read() == CONTENT
+    assert [sender.requests for sender in downloader.senders] == [2, 2, 2]
+    assert all(sender.disconnected for sender in downloader.senders)
+    assert downloader.stats == {'downloads': 1, 'fallbacks': 0, 'bytes': len(CONTENT)}
+
+
+@pytest.mark.asyncio
+async def test_authorization_of_a_foreign_dc_is_exported_once():
+    downloader = FakeDownloader(connections=2, part_size=PART_SIZE)
+    client = FakeClient(dc_id=2)
+    assert await downloader.download(client, message(dc_id=4), bytes) == CONTENT
+    assert await downloader.download(client, message(dc_id=4), bytes) == CONTENT
+    assert downloader._auth_keys == {4: 'key-4'}
+
+
+@pytest.mark.asyncio
+async def test_failed_download_falls_back_to_telethon():
+    downloader = FakeDownloader(fail_part=3, connections=2, part_size=PART_SIZE)
+    client = FakeClient()
+    assert await downloader.download(client, message(), bytes) == CONTENT
+    assert client.fallbacks == 1
+    assert downloader.stats['fallbacks'] == 1
+    assert all(sender.disconnected for sender in downloader.senders)
+
+
+def test_only_large_documents_are_accepted():
+    downloader = ParallelDownloader(threshold=1000)
+    assert downloader.accepts(message(size=1001).media)
+    assert not downloader.accepts(message(size=1000).media)
+    assert not downloader.accepts(SimpleNamespace(photo=object()))
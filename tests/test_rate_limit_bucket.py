@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from models.content import Content
+from services.discord_service import DiscordService
+from utils.rate_limit_bucket import RateLimitBucket
+
+
+def test_new_bucket_does_not_wait():
+    assert RateLimitBucket().delay() == 0.0
+
+
+def test_exhausted_bucket_waits_until_reset():
+    bucket = RateLimitBucket()
+    bucket.update({'X-RateLimit-Limit': '5', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '2.5',
+                   'X-RateLimit-Bucket': 'abc'})
+    assert bucket.limit == 5
+    assert bucket.bucket_id == 'abc'
+    assert 2.0 < bucket.delay() <= 2.5
+
+
+@pytest.mark.asyncio
+async def test_remaining_requests_do_not_wait():
+    bucket = RateLimitBucket()
+    bucket.update({'X-RateLimit-Remaining': '2', 'X-RateLimit-Reset-After': '10'})
+    assert bucket.delay() == 0.0
+    await bucket.acquire()
+    assert bucket.remaining == 1
+
+
+def test_invalid_headers_are_ignored():
+    bucket = RateLimitBucket()
+    bucket.update({'X-RateLimit-Remaining': 'many'})
+    assert bucket.remaining is None
+    assert bucket.delay() == 0.0
+
+
+def test_block_for_holds_requests_back():
+    bucket = RateLimitBucket()
+    bucket.block_for(1.0)
+    assert bucket.remaining == 0
+    assert 0.5 < bucket.delay() <= 1.0
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_the_window():
+    bucket = RateLimitBucket()
+    bucket.block_for(0.05)
+    started_at = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started_at >= 0.04
+    assert bucket.delay() == 0.0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_posts_are_retried(discord_server):
+    discord_server.rate_limit_every = 3
+    service = DiscordService(discord_server.webhook_url(), retry_base_delay=0.01)
+    try:
+        for index in range(6):
+            content = Content('user', 1)
+            content.set_content(f"message {index}")
+            content.set_avatar_url('https://example.test/avatar.png')
+            assert await service.send_message(content)
+    finally:
+        await service.close()
+    assert service.delivery_stats['sent'] == 6
+    assert service.delivery_stats['rate_limited'] == discord_server.responses[429] > 0
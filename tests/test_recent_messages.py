@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pytest
+
+from models.content import Content
+from models.embed import Embed
+from services.message_handler import MessageHandler
+from services.recent_messages import RecentMessages
+from utils.metrics import Metrics
+
+
+def test_each_chat_keeps_its_latest_messages():
+    recent = RecentMessages(per_chat=2)
+    for message_id in (1, 2, 3):
+        recent.remember(-100, message_id, f'm{message_id}', 'Ana')
+    recent.remember(-200, 1, 'other chat', 'Bea')
+    assert recent.get(-100, 1) is None
+    assert recent.get(-100, 3).text == 'm3'
+    assert recent.get(-200, 1).sender_name == 'Bea'
+    recent.forget(-100, 3)
+    assert recent.get(-100, 3) is None
+    assert recent.stats() == {'size': 2, 'hits': 2, 'misses': 2, 'hit_rate': 0.5}
+
+
+def test_lookups_are_exported_as_metrics():
+    recent = RecentMessages()
+    metrics = Metrics(enabled=True)
+    recent.register_metrics(metrics)
+    recent.remember(-100, 1, 'text', 'Ana')
+    recent.get(-100, 1)
+    recent.get(-100, 2)
+    rendered = metrics.render()
+    assert 'mirror_recent_messages_lookups_total{result="hit"} 1' in rendered
+    assert 'mirror_recent_messages_lookups_total{result="miss"} 1' in rendered
+    assert 'mirror_recent_messages_size 1' in rendered
+
+
+@pytest.mark.asyncio
+async def test_reply_to_a_recent_message_is_built_without_fetching_it():
+    async def get_reply_message():
+        raise AssertionError('the replied message was fetched')
+
+    handler = MessageHandler(None, None)
+    handler.recent_messages.remember(-100, 7, 'original', 'Ana', 'image/png')
+    content = Content('Bea')
+    event = SimpleNamespace(chat_id=-100, chat=None, get_reply_message=get_reply_message)
+    await handler._handle_reply(content, Embed('*reply*:'), event, 7)
+    assert content.embeds[0].fields == [{'name': 'Ana', 'value': 'original\n*image/png*', 'inline': False}]
+    assert handler.recent_messages.hit_rate() == 1.0
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+from telethon import errors
+from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.functions.updates import GetStateRequest
+
+from services.telegram_scheduler import TelegramScheduler, _TokenBucket, telegram_priority, LIVE, AVATAR, BACKFILL
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeClient:
+    def __init__(self):
+        self.flood_sleep_threshold = 60
+        self.calls = []
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        self.calls.append((type(request).__name__, flood_sleep_threshold))
+        return 'result'
+
+
+def flood_wait(seconds):
+    error = errors.FloodWaitError(request=None, capture=1)
+    error.seconds = seconds
+    return error
+
+
+async def test_only_scheduled_requests_skip_telethon_flood_sleep():
+    client = FakeClient()
+    assert TelegramScheduler().install(client)
+    await client._call(None, GetHistoryRequest(None, 0, None, 0, 1, 0, 0, 0))
+    await client._call(None, GetStateRequest(), flood_sleep_threshold=30)
+    assert client.calls == [('GetHistoryRequest', 0), ('GetStateRequest', 30)]
+    assert client.flood_sleep_threshold == 60
+
+
+async def test_incompatible_call_is_not_replaced():
+    class OtherClient:
+        async def _call(self, sender, request):
+            return None
+
+    client = OtherClient()
+    call = client._call
+    assert not TelegramScheduler().install(client)
+    assert client._call == call
+
+
+async def test_waiting_calls_are_served_by_priority():
+    bucket = _TokenBucket(rate=50, burst=0)
+    await bucket.acquire(LIVE)
+    served = []
+
+    async def acquire(priority):
+        await bucket.acquire(priority)
+        served.append(priority)
+
+    await asyncio.gather(acquire(BACKFILL), acquire(AVATAR), acquire(BACKFILL), acquire(LIVE))
+    assert served == [LIVE, AVATAR, BACKFILL, BACKFILL]
+
+
+async def test_flood_wait_pauses_every_request_and_retries():
+    scheduler = TelegramScheduler(rates={}, default_rate=1000)
+    attempts = []
+
+    async def flooded():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise flood_wait(0.1)
+        return 'sent'
+
+    async def other():
+        return time.monotonic()
+
+    started_at = time.monotonic()
+    with telegram_priority(BACKFILL):
+        result, other_sent_at = await asyncio.gather(
+            scheduler.run('flooded', flooded), scheduler.run('other', other))
+    assert result == 'sent'
+    assert attempts[1] - started_at >= 0.1
+    assert other_sent_at - started_at >= 0.1
+    assert scheduler.stats['flood_waits'] == 1
+    assert scheduler.stats['calls_backfill'] == 2
+
+
+async def test_long_flood_wait_is_raised_without_pausing():
+    scheduler = TelegramScheduler(max_flood_wait=5)
+
+    async def flooded():
+        raise flood_wait(60)
+
+    with pytest.raises(errors.FloodWaitError):
+        await scheduler.run('flooded', flooded)
+    assert scheduler._paused_until == 0.0
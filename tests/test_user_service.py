@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from services.entity_cache import CachedEntity
+from services.user_service import UserService
+from utils.file_manager import FileManager
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeClient:
+    """Writes a small JPEG for users with a photo, and nothing for the others."""
+
+    def __init__(self, hidden=()):
+        self.hidden = hidden
+        self.downloads = 0
+
+    async def download_profile_photo(self, user, file=None):
+        self.downloads += 1
+        if user.id in self.hidden:
+            return None
+        Image.new('RGB', (120, 120), (user.id % 255, 80, 160)).save(file, 'JPEG')
+        return file
+
+
+def user(user_id, photo_id):
+    return SimpleNamespace(id=user_id, photo=SimpleNamespace(photo_id=photo_id) if photo_id else None)
+
+
+@pytest.fixture
+def file_manager(tmp_path):
+    manager = FileManager()
+    manager.base_folder = str(tmp_path)
+    return manager
+
+
+async def test_avatar_is_downloaded_once_per_photo(file_manager):
+    service = UserService(file_manager, disk_cache=False)
+    client = FakeClient()
+    first = await service.get_user_image_data(client, user(1, 10), None)
+    assert first.startswith('data:image/')
+    assert await service.get_user_image_data(client, user(1, 10), None) == first
+    assert client.downloads == 1
+    await service.get_user_image_data(client, user(1, 11), None)
+    assert client.downloads == 2
+    assert await service.get_user_image_data(client, user(2, None), None) is None
+    assert client.downloads == 2
+
+
+async def test_disk_cache_survives_a_restart(file_manager, tmp_path):
+    folder = str(tmp_path / 'avatars')
+    client = FakeClient()
+    first = await UserService(file_manager, disk_cache_folder=folder).get_user_image_data(client, user(1, 10), None)
+    restarted = UserService(file_manager, disk_cache_folder=folder)
+    assert await restarted.get_user_image_data(client, user(1, 10), None) == first
+    assert client.downloads == 1
+    assert restarted.disk_hits == 1
+
+
+async def test_disk_cache_is_bounded(file_manager, tmp_path):
+    folder = str(tmp_path / 'avatars')
+    client = FakeClient()
+    service = UserService(file_manager, disk_cache_folder=folder, disk_cache_max_bytes=1)
+    await service.get_user_image_data(client, user(1, 10), None)
+    await service.get_user_image_data(client, user(2, 20), None)
+    assert service.disk_cache_size <= 1
+    assert service.cache_stats()['disk_bytes'] == service.disk_cache_size
+
+
+async def test_photo_that_cannot_be_downloaded_is_not_requested_again(file_manager):
+    service = UserService(file_manager, disk_cache=False)
+    client = FakeClient(hidden={1})
+    assert await service.get_user_image_data(client, user(1, 10), None) is None
+    assert await service.get_user_image_data(client, user(1, 10), None) is None
+    assert client.downloads == 1
+
+
+async def test_cached_sender_keys_the_avatar_by_its_photo_id(file_manager):
+    service = UserService(file_manager, disk_cache=False)
+    client = FakeClient()
+    sender = CachedEntity(user(1, 10))
+    assert service.avatar_cache_key(sender) == (1, 10)
+    first = await service.get_user_image_data(client, sender, None)
+    assert await service.get_user_image_data(client, CachedEntity(user(1, 10)), None) == first
+    assert client.downloads == 1
+    await service.get_user_image_data(client, CachedEntity(user(1, 11)), None)
+    assert client.downloads == 2
+    assert await service.get_user_image_data(client, CachedEntity(user(2, None)), None) is None
+    assert client.downloads == 2
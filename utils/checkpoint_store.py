@@ -0,0 +1,45 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """
+    Small JSON file of named checkpoints, such as the last mirrored message id of each chat.
+
+    Attributes:
+        path (str): Path of the JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._checkpoints = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Error reading checkpoints {self.path}: {e}")
+            return {}
+
+    def get(self, key, default=None):
+        return self._checkpoints.get(str(key), default)
+
+    def set(self, key, value):
+        self._checkpoints[str(key)] = value
+
+    def save(self):
+        """Writes the checkpoints to disk atomically."""
+        temp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self._checkpoints, file)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving checkpoints {self.path}: {e}")
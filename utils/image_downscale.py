@@ -0,0 +1,33 @@
+from io import BytesIO
+
+
+def downscale_image(data, max_bytes, max_side):
+    """
+    Re-encodes an image as a JPEG that fits in an upload limit, run on the processing pool.
+
+    The image is first shrunk to `max_side` pixels on its longest side, then the quality
+    and the size are lowered step by step until the file fits.
+
+    Args:
+        data (bytes): The original image.
+        max_bytes (int): Largest size of the result, in bytes.
+        max_side (int): Largest width or height of the result, in pixels.
+
+    Returns:
+        bytes: The JPEG image, or None if it cannot be made small enough.
+    """
+    # Imported here so that starting the mirror does not pay for loading Pillow.
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert('RGB')
+        side = max_side
+        for _ in range(6):
+            img.thumbnail((side, side))
+            for quality in (85, 70, 55):
+                buffered = BytesIO()
+                img.save(buffered, format='JPEG', quality=quality, optimize=True)
+                if buffered.tell() <= max_bytes:
+                    return buffered.getvalue()
+            side = int(max(img.size) * 0.75)
+    return None
@@ -0,0 +1,50 @@
+from io import BytesIO
+
+from config import IMAGE_QUALITY
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png'}
+
+
+def encode_image(source, formats, max_size=None, quality=IMAGE_QUALITY):
+    """
+    Encodes an image in whichever of the given formats is smallest, run on the processing pool.
+
+    The image is rotated according to its EXIF orientation and saved without metadata
+    (EXIF, ICC profile). JPEG is skipped for images with transparency.
+
+    Args:
+        source: Path of the image, or its content as bytes.
+        formats (tuple): Acceptable formats among "JPEG", "WEBP" and "PNG".
+        max_size (tuple): Maximum width and height, or None to keep the dimensions.
+        quality (int): Quality of the lossy formats.
+
+    Returns:
+        tuple: (encoded image, its format, dict of the size of every format tried).
+    """
+    # Imported here so that starting the mirror does not pay for loading Pillow.
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img = ImageOps.exif_transpose(img)
+        if max_size:
+            img.thumbnail(max_size)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        encoded = {}
+        for image_format in formats:
+            if image_format == 'JPEG' and has_alpha:
+                continue
+            frame = img.convert('RGBA' if has_alpha else 'RGB')
+            frame.info = {}
+            buffered = BytesIO()
+            if image_format == 'PNG':
+                frame.save(buffered, format='PNG')
+            elif image_format == 'WEBP':
+                frame.save(buffered, format='WEBP', quality=quality, method=6)
+            else:
+                frame.save(buffered, format='JPEG', quality=quality, optimize=True, progressive=True)
+            encoded[image_format] = buffered.getvalue()
+    if not encoded:
+        raise ValueError(f"No format of {formats} can encode an image with transparency")
+    best = min(encoded, key=lambda image_format: len(encoded[image_format]))
+    return encoded[best], best, {image_format: len(data) for image_format, data in encoded.items()}
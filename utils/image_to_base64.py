@@ -1,24 +1,32 @@
 import base64
-from io import BytesIO
-from PIL import Image
 import os
 import logging
 
+from config import AVATAR_IMAGE_FORMATS
+from utils.image_encoder import encode_image, MIME_TYPES
+from utils.processing_pool import default_pool
+
 logger = logging.getLogger(__name__)
 
 
-async def convert_image_to_base64(image_path, max_size=(75, 75)):
+async def convert_image_to_base64(image_path, max_size=(75, 75), pool=None, stats=None):
     """
     Convert an image to a Base64-encoded string.
 
     This function takes an image file located at `image_path`,
     resizes it to fit within the specified `max_size` (width, height)
-    while maintaining the aspect ratio, and encodes it in Base64.
+    while maintaining the aspect ratio, and encodes it in Base64, in
+    the smallest of the AVATAR_IMAGE_FORMATS. The decoding and encoding
+    run on a processing pool, so the event loop is not blocked.
 
     Args:
         image_path (str): The path to the image file to be converted.
         max_size (tuple): A tuple representing the maximum width and
                           height for the thumbnail (default is (75, 75)).
+        pool (ProcessingPool): Pool the conversion runs on, defaults to
+                               the shared pool.
+        stats (dict): If given, its `images` and `bytes_saved` counters are
+                      incremented, bytes saved being measured against PNG.
 
     Returns:
         str: A Base64-encoded string representing the image,
@@ -29,12 +37,28 @@ async def convert_image_to_base64(image_path, max_size=(75, 75)):
         logging.info(f"Image {image_path} not found.")
         return None
     try:
-        with Image.open(image_path) as img:
-            img.thumbnail(max_size)
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            return f"data:image/jpg;base64,{base64_image}"
+        data_uri, saved = await (pool or default_pool()).run(encode_image_to_base64, image_path, max_size)
+        if stats is not None:
+            stats['images'] += 1
+            stats['bytes_saved'] += saved
+        return data_uri
     except Exception as e:
         logging.error(f"Error converting image to Base64: {e}")
         return None
+
+
+def encode_image_to_base64(image_path, max_size=(75, 75), formats=AVATAR_IMAGE_FORMATS):
+    """
+    Synchronous part of `convert_image_to_base64`, run on the processing pool.
+
+    Args:
+        image_path (str): The path to the image file to be converted.
+        max_size (tuple): Maximum width and height of the thumbnail.
+        formats (tuple): Acceptable formats; PNG is always tried, as the reference.
+
+    Returns:
+        tuple: (Base64 data URI of the image, bytes saved compared to PNG).
+    """
+    data, image_format, sizes = encode_image(image_path, tuple(dict.fromkeys(formats + ('PNG',))), max_size)
+    base64_image = base64.b64encode(data).decode('utf-8')
+    return f"data:{MIME_TYPES[image_format]};base64,{base64_image}", sizes['PNG'] - len(data)
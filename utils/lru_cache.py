@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-memory least-recently-used cache with optional time-to-live eviction.
+
+    Attributes:
+        max_size (int): Maximum number of entries kept before the oldest is evicted.
+        ttl (float): Seconds an entry stays valid, or None to never expire.
+        hits (int): Number of successful lookups.
+        misses (int): Number of lookups that found no valid entry.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is missing or expired.
+
+        Returns:
+            The cached value, or `default` on a miss.
+        """
+        value = self.peek(key, self._MISSING)
+        if value is self._MISSING:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """
+        Returns the cached value for a key without touching the counters or LRU order.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        return value
+
+    def set(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes a key from the cache and returns its value, or `default` if absent."""
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        """Removes every entry from the cache. Counters are kept."""
+        self._entries.clear()
+
+    def __contains__(self, key):
+        return self.peek(key, self._MISSING) is not self._MISSING
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Size, hits, misses and hit rate of the cache.
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from config import MEDIA_CACHE_FOLDER, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_HASH
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """
+    On-disk cache of Telegram media, keyed by photo or document id.
+
+    Files are named after their key, so the cache survives restarts, and the least
+    recently used ones are deleted once the total size exceeds `max_bytes`. With
+    `use_hash`, a file whose content is already cached under another id is hard-linked
+    to the existing copy instead of being stored again.
+
+    Files still in use are pinned with `pin` until they have been uploaded, and eviction
+    skips them, so a file is never deleted while a message waiting to be sent refers to it.
+
+    Attributes:
+        folder (str): Folder holding the cached files.
+        max_bytes (int): Size budget of the cache, in bytes.
+        use_hash (bool): Whether identical files with different ids are stored once.
+        size (int): Total size of the cached files, in bytes.
+        stats (dict): Hits, misses, bytes saved by hits, evictions and content-hash matches.
+    """
+
+    def __init__(self, folder=MEDIA_CACHE_FOLDER, max_bytes=MEDIA_CACHE_MAX_BYTES, use_hash=MEDIA_CACHE_HASH):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'evictions': 0, 'hash_matches': 0}
+        self._entries = OrderedDict()
+        self._digests = {}
+        self._pins = {}
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key_name(key):
+        kind, media_id = key
+        return f"{kind}_{media_id}"
+
+    def _name(self, key):
+        """Returns the entry name of a (kind, id) key or of the path of a cached file."""
+        if isinstance(key, tuple):
+            return self.key_name(key)
+        return os.path.splitext(os.path.basename(key))[0]
+
+    def pin(self, key):
+        """
+        Keeps a media from being evicted until it is unpinned. Pins are counted, so a media
+        used by several messages stays until all of them are done with it.
+
+        Args:
+            key: (kind, id) of the media, or the path of its cached file. A media may be pinned
+                 before it is in the cache, so it is not evicted between its download and its use.
+        """
+        name = self._name(key)
+        self._pins[name] = self._pins.get(name, 0) + 1
+
+    def unpin(self, key):
+        """Releases a pin taken with `pin`, evicting files that were kept over the budget."""
+        name = self._name(key)
+        count = self._pins.get(name, 0) - 1
+        if count > 0:
+            self._pins[name] = count
+            return
+        self._pins.pop(name, None)
+        self._evict()
+
+    def _load(self):
+        """Indexes the files left by a previous run, least recently used first."""
+        files = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, name, path, size in sorted(files):
+            self._entries[name] = (path, size)
+            self.size += size
+        self._evict()
+
+    def get(self, key):
+        """
+        Returns the path of a cached media, marking it as recently used.
+
+        Args:
+            key (tuple): (kind, id) of the media.
+
+        Returns:
+            str: Path of the cached file, or None on a miss.
+        """
+        name = self.key_name(key)
+        entry = self._entries.get(name)
+        if entry is None or not os.path.exists(entry[0]):
+            if entry is not None:
+                self._remove(name)
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(name)
+        os.utime(entry[0])
+        self.stats['hits'] += 1
+        self.stats['bytes_saved'] += entry[1]
+        return entry[0]
+
+    def temp_path(self, key):
+        """Returns the path a media is downloaded to before being added with `add`."""
+        return os.path.join(self.folder, f"{self.key_name(key)}.part")
+
+    def add(self, key, temp_path, extension, digest=None):
+        """
+        Moves a downloaded file into the cache.
+
+        Args:
+            key (tuple): (kind, id) of the media.
+            temp_path (str): The downloaded file, as returned by `temp_path`.
+            extension (str): Extension of the cached file.
+            digest (str): SHA-256 of the content, to store identical files once.
+
+        Returns:
+            str: Path of the cached file.
+        """
+        name = self.key_name(key)
+        path = os.path.join(self.folder, f"{name}{extension}")
+        existing = self._entries.get(self._digests.get(digest)) if digest else None
+        if existing and os.path.exists(existing[0]):
+            try:
+                os.link(existing[0], path)
+                os.remove(temp_path)
+                self.stats['hash_matches'] += 1
+            except OSError:
+                os.replace(temp_path, path)
+        else:
+            os.replace(temp_path, path)
+        if digest:
+            self._digests[digest] = name
+        if name in self._entries:
+            self._remove(name, delete=False)
+        size = os.path.getsize(path)
+        self._entries[name] = (path, size)
+        self.size += size
+        self._evict()
+        return path
+
+    def _remove(self, name, delete=True):
+        path, size = self._entries.pop(name)
+        self.size -= size
+        if delete:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        """
+        Deletes the least recently used files until the cache fits in its budget. Pinned files
+        and the most recent one are kept, even if that leaves the cache over its budget.
+        """
+        if self.size <= self.max_bytes:
+            return
+        for name in list(self._entries)[:-1]:
+            if name in self._pins:
+                continue
+            self._remove(name)
+            self.stats['evictions'] += 1
+            if self.size <= self.max_bytes:
+                return
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def register_metrics(self, metrics):
+        """Exposes the cache counters and size on a metrics registry."""
+        metrics.register('mirror_media_cache_events_total', 'counter', 'Media cache hits, misses, evictions '
+                         'and content-hash matches.', lambda: {name: value for name, value in self.stats.items()
+                                                               if name != 'bytes_saved'}, 'event')
+        metrics.register('mirror_media_cache_bytes_saved_total', 'counter', 'Bytes served from the media cache '
+                         'instead of Telegram.', lambda: self.stats['bytes_saved'])
+        metrics.register('mirror_media_cache_bytes', 'gauge', 'Size of the media cache.', lambda: self.size)
@@ -0,0 +1,181 @@
+import bisect
+import logging
+import time
+
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, as exposed by Prometheus.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets, in seconds.
+        counts (list): Observations per bucket, the last one counting values above every bound.
+        total (float): Sum of the observed values.
+        count (int): Number of observations.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Timer:
+    """Context manager recording the duration of a stage."""
+
+    __slots__ = ('histogram', 'started_at')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started_at)
+
+
+class _NullTimer:
+    """Context manager doing nothing, used while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Latency histograms per processing stage and counters, served in the Prometheus text format.
+
+    Recording a stage costs two clock reads and a bucket increment; while metrics are
+    disabled it costs nothing but a method call. Values that services already count,
+    such as queue depths or retries, are not duplicated: they are registered as
+    collectors and only read when the endpoint is scraped.
+
+    Attributes:
+        enabled (bool): Whether stages and counters are recorded.
+        buckets (tuple): Latency histogram bucket bounds, in seconds.
+        stages (dict): Histogram of each stage.
+        counters (dict): Value of each counter recorded here.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, buckets=METRICS_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.stages = {}
+        self.counters = {}
+        self._collectors = {}
+        self._runner = None
+
+    def timer(self, stage):
+        """
+        Returns a context manager recording the duration of a stage.
+
+        Args:
+            stage (str): Name of the stage, used as the `stage` label.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(self.buckets)
+        return _Timer(histogram)
+
+    def inc(self, name, value=1):
+        """Increments a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register(self, name, kind, help_text, func, label=None):
+        """
+        Registers a value read from a service when the endpoint is scraped.
+
+        Args:
+            name (str): Metric name.
+            kind (str): "counter" or "gauge".
+            help_text (str): Description of the metric.
+            func: Callable returning a number, or a dict of numbers keyed by `label` value.
+            label (str): Label name of the values returned as a dict.
+        """
+        self._collectors[name] = (kind, help_text, func, label)
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        lines = ['# HELP mirror_stage_duration_seconds Duration of each processing stage.',
+                 '# TYPE mirror_stage_duration_seconds histogram']
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'mirror_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'mirror_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'mirror_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+        for name, value in self.counters.items():
+            lines += [f'# TYPE {name} counter', f'{name} {value}']
+        for name, (kind, help_text, func, label) in self._collectors.items():
+            try:
+                value = func()
+            except Exception as e:
+                logger.error(f"Error collecting metric {name}: {e}")
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            if isinstance(value, dict):
+                lines += [f'{name}{{{label}="{key}"}} {item}' for key, item in value.items()]
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    async def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """Serves the metrics on http://host:port/metrics. Does nothing while metrics are disabled."""
+        if not self.enabled or self._runner is not None:
+            return
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        """Stops the metrics endpoint. Safe to call more than once."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+_default_metrics = None
+
+
+def default_metrics():
+    """Returns the shared metrics registry configured in config.py."""
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+    return _default_metrics
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from config import PROCESSING_POOL_KIND, PROCESSING_POOL_WORKERS, PROCESSING_POOL_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingPool:
+    """
+    Runs CPU-bound jobs, such as image decoding and encoding, outside the event loop.
+
+    Jobs run on a thread or process pool. At most `queue_size` jobs are submitted at a
+    time, so a burst of images waits here instead of piling up in the executor. Functions
+    run on a process pool must be picklable, i.e. defined at module level.
+
+    Attributes:
+        kind (str): "thread" or "process".
+        workers (int): Number of threads or processes.
+        queue_size (int): Maximum number of jobs queued or running at once.
+        stats (dict): Number of jobs, failures, total and maximum run time and queue wait.
+    """
+
+    def __init__(self, kind=PROCESSING_POOL_KIND, workers=PROCESSING_POOL_WORKERS,
+                 queue_size=PROCESSING_POOL_QUEUE_SIZE):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats = {'jobs': 0, 'failed': 0, 'total_time': 0.0, 'max_time': 0.0, 'total_wait': 0.0,
+                      'max_wait': 0.0}
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='processing')
+        return self._executor
+
+    async def run(self, func, *args):
+        """
+        Runs a function on the pool and waits for its result.
+
+        Args:
+            func: The function to run.
+            *args: Arguments passed to the function.
+
+        Returns:
+            The return value of the function.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        queued_at = time.perf_counter()
+        async with self._slots:
+            started_at = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+            except Exception:
+                self.stats['failed'] += 1
+                raise
+            finally:
+                self._record(func, started_at - queued_at, time.perf_counter() - started_at)
+
+    def _record(self, func, wait, duration):
+        """Records the timing of a finished job."""
+        self.stats['jobs'] += 1
+        self.stats['total_time'] += duration
+        self.stats['max_time'] = max(self.stats['max_time'], duration)
+        self.stats['total_wait'] += wait
+        self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+        logger.debug(f"{func.__name__} ran in {duration * 1000:.1f}ms after waiting {wait * 1000:.1f}ms")
+
+    def shutdown(self):
+        """Shuts the executor down, waiting for running jobs. The pool can be used again afterwards."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_default_pool = None
+
+
+def default_pool():
+    """Returns the shared processing pool configured in config.py."""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ProcessingPool()
+    return _default_pool
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+
+class RateLimitBucket:
+    """
+    Tracks the state of one Discord rate-limit bucket from its `X-RateLimit-*` headers.
+
+    Attributes:
+        limit (int): Requests allowed per window, or None until the first response.
+        remaining (int): Requests left in the current window, or None if unknown.
+        reset_at (float): Monotonic time at which the window resets.
+        bucket_id (str): The bucket hash reported by Discord, if any.
+        last_used (float): Monotonic time of the last request, used to forget idle buckets.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.bucket_id = None
+        self.last_used = time.monotonic()
+
+    def delay(self):
+        """
+        Returns how long to wait before the next request can be sent without hitting the limit.
+
+        Returns:
+            float: Seconds to wait, 0 if a request can be sent right away.
+        """
+        if self.remaining is None or self.remaining > 0:
+            return 0.0
+        return max(0.0, self.reset_at - time.monotonic())
+
+    async def acquire(self):
+        """Waits for the bucket window if it is exhausted and reserves one request of it."""
+        self.last_used = time.monotonic()
+        delay = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+            self.remaining = None
+        if self.remaining:
+            self.remaining -= 1
+
+    def update(self, headers):
+        """
+        Updates the bucket state from the rate-limit headers of a response.
+
+        Args:
+            headers: The response headers mapping.
+        """
+        try:
+            if 'X-RateLimit-Limit' in headers:
+                self.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Remaining' in headers:
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset-After' in headers:
+                self.reset_at = time.monotonic() + float(headers['X-RateLimit-Reset-After'])
+            self.bucket_id = headers.get('X-RateLimit-Bucket', self.bucket_id)
+        except ValueError:
+            pass
+
+    def idle(self, timeout):
+        """Whether the bucket has not been used for `timeout` seconds and no longer holds requests back."""
+        return time.monotonic() - self.last_used > timeout and not self.delay()
+
+    def block_for(self, seconds):
+        """
+        Marks the bucket as exhausted for the given time, e.g. after a 429 response.
+
+        Args:
+            seconds (float): Seconds until requests may be sent again.
+        """
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + seconds)
@@ -0,0 +1,7 @@
+def format_size(size):
+    """Returns a byte count in a human readable unit, e.g. "12 MiB"."""
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
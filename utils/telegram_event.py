@@ -0,0 +1,64 @@
+def event_messages(event):
+    """
+    Returns the Telegram messages carried by an event.
+
+    Args:
+        event: A NewMessage event, or an Album event grouping several messages.
+
+    Returns:
+        list: The messages of the event, in order.
+    """
+    messages = getattr(event, 'messages', None)
+    return list(messages) if messages else [event.message]
+
+
+def primary_message(event):
+    """
+    Returns the message that represents an event: the first one with a caption for
+    albums, or the message itself for single messages.
+
+    Args:
+        event: A NewMessage event, or an Album event grouping several messages.
+
+    Returns:
+        The representative Telegram message.
+    """
+    messages = event_messages(event)
+    return next((message for message in messages if message.message), messages[0])
+
+
+class HistoryEvent:
+    """
+    Presents messages read from the chat history like the events received while mirroring,
+    so they can go through the same message handling.
+
+    Attributes:
+        message: The (first) message.
+        messages (list): Every message of the album, or None for a single message.
+    """
+
+    def __init__(self, messages):
+        self.message = messages[0]
+        self.messages = messages if len(messages) > 1 else None
+
+    @property
+    def chat_id(self):
+        return self.message.chat_id
+
+    @property
+    def chat(self):
+        return self.message.chat
+
+    @property
+    def sender_id(self):
+        return self.message.sender_id
+
+    @property
+    def sender(self):
+        return self.message.sender
+
+    async def get_sender(self):
+        return await self.message.get_sender()
+
+    async def get_reply_message(self):
+        return await self.message.get_reply_message()
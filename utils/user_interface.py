@@ -4,6 +4,8 @@ class UserInterface:
         print("\nChoose an option:")
         print("1. List all groups and choose one to mirror")
         print("2. Enter the username at(@) or ID of the group to mirror")
+        print("3. Mirror all routes configured in config.py")
+        print("4. Backfill the history of a group")
         print("0. Exit")
 
     @staticmethod
@@ -33,6 +35,12 @@ class UserInterface:
     def get_group():
         return input("Enter the username at(@) or ID or link of the group you want to mirror: ")
 
+    @staticmethod
+    def get_backfill_range():
+        start = input("Backfill from (message ID or date YYYY-MM-DD, empty for the beginning): ")
+        end = input("Backfill up to (message ID or date YYYY-MM-DD, empty for the latest message): ")
+        return start.strip(), end.strip()
+
     @staticmethod
     def exit():
         print("Exiting...")